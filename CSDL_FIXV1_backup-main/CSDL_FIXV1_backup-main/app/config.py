@@ -5,6 +5,7 @@ from typing import List, Dict, Any, Optional
 from pathlib import Path
 from pydantic_settings import BaseSettings
 from supabase import create_client, Client
+from supabase.lib.client_options import SyncClientOptions
 from dotenv import load_dotenv
 
 # Load .env nếu có
@@ -19,6 +20,9 @@ logger = logging.getLogger(__name__)
 class Settings(BaseSettings):
     SUPABASE_URL: str = os.getenv("SUPABASE_URL", "https://gqudofrvqpesiyibtgnt.supabase.co")
     SUPABASE_KEY: str = os.getenv("SUPABASE_KEY", "")
+    # Project Supabase riêng chứa bảng transaction_price (trang cổ phiếu, job đồng bộ giá)
+    STOCK_SUPABASE_URL: str = os.getenv("STOCK_SUPABASE_URL", "https://lmibkxgbkvwcegromqvi.supabase.co")
+    STOCK_SUPABASE_KEY: str = os.getenv("STOCK_SUPABASE_KEY", "")
 
     APP_TITLE: str = "Financial Data & Analysis API"
     APP_DESCRIPTION: str = "API hợp nhất cung cấp dữ liệu tài chính, thị trường chứng khoán, tin tức và các phân tích."
@@ -45,10 +49,89 @@ class Settings(BaseSettings):
         'UPCOMINDEX': {'index_type': 'UPCOM', 'index_type_id': None, 'source': 'VCI', 'table': 'index_history', 'default_start_date': '2020-01-01'}
     }
 
+    INDEX_TYPES_TTL_SECONDS: int = 3600
+    INDEX_FETCH_TIMEOUT_SECONDS: float = 20.0
+    INDEX_FETCH_DEADLINE_SECONDS: float = 25.0
+
+    # 27 mã ngân hàng dùng cho bảng giá, trang cổ phiếu và job đồng bộ giá
+    BANK_SYMBOLS: List[str] = [
+        'VCB', 'BID', 'CTG', 'TCB', 'MBB', 'VPB', 'ACB', 'HDB', 'STB',
+        'EIB', 'LPB', 'SHB', 'VIB', 'MSB', 'OCB', 'TPB', 'BAB', 'ABB',
+        'BVB', 'KLB', 'NAB', 'PGB', 'SGB', 'VAB', 'VBB', 'SSB', 'SCB'
+    ]
+
+    # Ingestion scheduler: đồng bộ vnstock -> Supabase chạy nền, tách khỏi request
+    INGESTION_ENABLED: bool = True
+    INGESTION_STARTUP_DELAY_SECONDS: float = 5.0
+    INGESTION_OFF_HOURS_INTERVAL_SECONDS: int = 3600
+    # Lần chạy cuối của phiên rơi vào N giây sau giờ đóng cửa, để ghi giá đóng cửa mà không chờ lịch ngoài giờ
+    INGESTION_POST_CLOSE_DELAY_SECONDS: float = 120.0
+    INDEX_SYNC_INTERVAL_SECONDS: int = 300
+    INDEX_SYNC_TIMEOUT_SECONDS: float = 120.0
+    INDEX_UPSERT_CHUNK_SIZE: int = 500
+    STOCK_SYNC_INTERVAL_SECONDS: int = 900
+    STOCK_SYNC_TIMEOUT_SECONDS: float = 600.0
+    # Mã chưa có dòng nào trong transaction_price: lấy lịch sử N ngày gần nhất
+    STOCK_SYNC_INITIAL_LOOKBACK_DAYS: int = 365
+    # Ngày nghỉ lễ của HOSE/HNX dạng 'YYYY-MM-DD' (ngoài thứ Bảy, Chủ nhật)
+    MARKET_HOLIDAYS: List[str] = []
+
     WEBSOCKET_STOCK_INTERVAL_SECONDS: int = 10
+    WEBSOCKET_MAX_SYMBOLS_PER_CLIENT: int = 1000
+    # Outbox mỗi kết nối: số frame tối đa chờ gửi, số lần tràn liên tiếp trước khi ngắt client chậm
+    WEBSOCKET_OUTBOX_SIZE: int = 4
+    WEBSOCKET_MAX_CONSECUTIVE_OVERFLOWS: int = 3
+    WEBSOCKET_SEND_TIMEOUT_SECONDS: float = 15.0
+    # Ring buffer tick trong phiên: 2048 tick/mã đủ cho cả phiên với chu kỳ 10s
+    TICK_HISTORY_CAPACITY_PER_SYMBOL: int = 2048
+
+    # Thread pool cho các lời gọi blocking tới vnstock / supabase-py
+    UPSTREAM_MAX_WORKERS: int = 16
+    UPSTREAM_MAX_PENDING: int = 200
+    UPSTREAM_CALL_TIMEOUT_SECONDS: float = 30.0
+    # Kích thước trang khi đọc bảng lớn; không vượt quá max-rows của PostgREST (mặc định 1000)
+    SUPABASE_PAGE_SIZE: int = 1000
+    # Bộ lọc `in` với danh sách id lớn: số id mỗi lô và số lô chạy đồng thời
+    SUPABASE_IN_CHUNK_SIZE: int = 200
+    SUPABASE_IN_MAX_CONCURRENCY: int = 4
     DEFAULT_LINE_ITEM_ID_TONG_NGUON_VON: int = 88
     DEFAULT_YEAR_TONG_NGUON_VON: int = 2024
     DEFAULT_QUARTER_TONG_NGUON_VON: str = "Q4"
+    # Năm tài chính hợp lệ cho các API số liệu theo kỳ (chặn key cache tuỳ ý)
+    FINANCIAL_YEAR_MIN: int = 2000
+    FINANCIAL_YEAR_MAX: int = 2100
+    # Số cặp (line_item, kỳ) tối đa trong một request /financial/chart-data
+    FINANCIAL_CHART_MAX_KEYS: int = 400
+    # Số line item tối đa trong một request /financial_data/compare
+    FINANCIAL_COMPARE_MAX_LINE_ITEMS: int = 20
+    # Độ dài tối đa (số năm) của khoảng year_from..year_to cho /financial_data
+    FINANCIAL_DATA_MAX_YEARS: int = 30
+    MARKET_CAP_CACHE_TTL_SECONDS: int = 86400
+    # Giới hạn các cache trong bộ nhớ theo mã / tham số (chống tăng bộ nhớ không giới hạn)
+    HISTORY_CACHE_MAX_SERIES: int = 64
+    CHART_CACHE_MAX_ENTRIES: int = 512
+    INDICATOR_CACHE_MAX_ENTRIES: int = 512
+    # Số mục tối đa của mỗi cache số liệu tài chính theo tham số (tổng nguồn vốn, dữ liệu biểu đồ, ...)
+    FINANCIAL_CACHE_MAX_ENTRIES: int = 256
+    # Ma trận (kỳ x mã) của /market-cap/series lớn hơn nhiều so với một response nên giữ ít line item hơn
+    MARKET_CAP_SERIES_CACHE_MAX_ENTRIES: int = 32
+    # Mã không có trong bảng 'stocks': nhớ kết quả "không có" trong khoảng này trước khi hỏi lại DB
+    STOCK_ID_MISS_TTL_SECONDS: int = 600
+    # Catalog stocks / report_types / line_items: chu kỳ làm mới nền
+    CATALOG_REFRESH_SECONDS: int = 600
+    # HTTP pool dùng chung cho PostgREST / supabase-py (xem app/services/http_pool.py)
+    HTTP2_ENABLED: bool = True
+    HTTP_MAX_CONNECTIONS: int = 50
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTP_KEEPALIVE_EXPIRY_SECONDS: float = 30.0
+    HTTP_CONNECT_TIMEOUT_SECONDS: float = 5.0
+    HTTP_READ_TIMEOUT_SECONDS: float = 30.0
+    HTTP_WRITE_TIMEOUT_SECONDS: float = 10.0
+    HTTP_POOL_TIMEOUT_SECONDS: float = 10.0
+    # Thử lại lời gọi đọc: tổng số lần gửi và backoff (có jitter) giữa các lần
+    HTTP_RETRY_ATTEMPTS: int = 3
+    HTTP_RETRY_BACKOFF_SECONDS: float = 0.2
+    HTTP_RETRY_MAX_BACKOFF_SECONDS: float = 2.0
 
     class Config:
         env_file = ".env"
@@ -61,18 +144,37 @@ def get_settings() -> Settings:
     logging.getLogger().setLevel(current_settings.LOG_LEVEL.upper())
     return current_settings
 
-@lru_cache()
-def get_supabase_client() -> Client:
-    current_app_settings = get_settings()
-    if not current_app_settings.SUPABASE_URL or not current_app_settings.SUPABASE_KEY:
-        logger.error("CRITICAL: Supabase URL or Key is missing in loaded settings. Cannot initialize client.")
-        raise ValueError("Supabase URL or Key is missing in settings. Cannot initialize Supabase client.")
+REQUIRED_SUPABASE_SETTINGS = ("SUPABASE_URL", "SUPABASE_KEY", "STOCK_SUPABASE_URL", "STOCK_SUPABASE_KEY")
+
+def validate_supabase_settings(current_settings: Settings) -> None:
+    """Gọi khi khởi động: dừng ngay nếu thiếu URL/key Supabase, thay vì để request gửi apikey rỗng rồi lỗi về sau."""
+    missing = [name for name in REQUIRED_SUPABASE_SETTINGS if not getattr(current_settings, name)]
+    if missing:
+        logger.error(f"CRITICAL: Missing Supabase settings: {', '.join(missing)}. Set them in the environment or .env.")
+        raise RuntimeError(f"Missing Supabase settings: {', '.join(missing)}")
+
+def _create_supabase_client(url: str, key: str, name: str) -> Client:
+    # Import muộn: http_pool đọc settings từ module này
+    from app.services.http_pool import http_pool
+    if not url or not key:
+        logger.error(f"CRITICAL: Supabase URL or Key for {name} is missing in loaded settings. Cannot initialize client.")
+        raise ValueError(f"Supabase URL or Key for {name} is missing in settings. Cannot initialize Supabase client.")
     try:
-        supabase: Client = create_client(current_app_settings.SUPABASE_URL, current_app_settings.SUPABASE_KEY)
-        logger.info("Supabase client initialized successfully.")
+        supabase: Client = create_client(url, key, options=SyncClientOptions(httpx_client=http_pool.sync_client))
+        logger.info(f"Supabase client ({name}) initialized successfully.")
         return supabase
     except Exception as e:
-        logger.error(f"CRITICAL: Failed to initialize Supabase client: {e}", exc_info=True)
+        logger.error(f"CRITICAL: Failed to initialize Supabase client ({name}): {e}", exc_info=True)
         raise RuntimeError(f"Supabase client initialization failed: {e}") from e
 
+@lru_cache()
+def get_supabase_client() -> Client:
+    current_app_settings = get_settings()
+    return _create_supabase_client(current_app_settings.SUPABASE_URL, current_app_settings.SUPABASE_KEY, "main")
+
+@lru_cache()
+def get_stock_supabase_client() -> Client:
+    current_app_settings = get_settings()
+    return _create_supabase_client(current_app_settings.STOCK_SUPABASE_URL, current_app_settings.STOCK_SUPABASE_KEY, "stock")
+
 settings: Settings = get_settings() 
\ No newline at end of file
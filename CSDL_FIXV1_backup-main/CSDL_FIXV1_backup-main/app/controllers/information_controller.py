@@ -1,12 +1,21 @@
 from fastapi import APIRouter, Request
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
-from fastapi import APIRouter, Query
+from fastapi import APIRouter, HTTPException, Query
+from app.config import settings
 from app.services.information_service import (
     get_all_stocks,
     get_all_report_types,
     get_line_items_by_report_type,
-    fetch_financial_data
+    fetch_financial_data,
+    fetch_financial_comparison,
+    stream_financial_data,
+    financial_year_range,
+    resolve_stock_id,
+    ALL_BANKS,
+    FINANCIAL_DATA_YEARS,
+    FINANCIAL_DATA_FORMATS,
+    FORMAT_RECORDS
 )
 
 router = APIRouter()
@@ -28,8 +37,43 @@ async def line_items(report_type_id: int):
 async def financial_data(
     symbol: str = Query(...),
     report_type_id: int = Query(...),
-    period: str = Query("yearly")
+    period: str = Query("yearly"),
+    format: str = Query(FORMAT_RECORDS, pattern=f"^({'|'.join(FINANCIAL_DATA_FORMATS)})$"),
+    year_from: int = Query(FINANCIAL_DATA_YEARS.start),
+    year_to: int = Query(FINANCIAL_DATA_YEARS.stop - 1),
+    stream: bool = Query(False, description="Trả NDJSON, mỗi dòng một chỉ tiêu, gửi dần trong lúc đọc DB")
 ):
-    return await fetch_financial_data(symbol, report_type_id, period)
-
+    if stream:
+        try:
+            years = financial_year_range(year_from, year_to)
+        except ValueError as e:
+            return JSONResponse({"error": str(e)})
+        stock_id = await resolve_stock_id(symbol)
+        if stock_id is None:
+            return JSONResponse({"error": "Symbol not found"})
+        return StreamingResponse(
+            stream_financial_data(stock_id, report_type_id, period, years, format),
+            media_type="application/x-ndjson"
+        )
+    # Trả JSONResponse trực tiếp: kết quả đã là kiểu JSON thuần, bỏ qua bước jsonable_encoder duyệt từng ô
+    return JSONResponse(await fetch_financial_data(symbol, report_type_id, period, format, year_from, year_to))
 
+@router.get("/financial_data/compare")
+async def financial_data_compare(
+    report_type_id: int = Query(...),
+    line_item_ids: str = Query(..., description="Danh sách line_item_id, phân tách bằng dấu phẩy"),
+    symbols: str = Query(ALL_BANKS, description=f"Danh sách mã, phân tách bằng dấu phẩy; '{ALL_BANKS}' = toàn bộ mã ngân hàng"),
+    period: str = Query("yearly", pattern="^(yearly|quarterly)$"),
+    year_from: int = Query(FINANCIAL_DATA_YEARS.start),
+    year_to: int = Query(FINANCIAL_DATA_YEARS.stop - 1)
+):
+    try:
+        ids = [int(x) for x in line_item_ids.split(",") if x.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="line_item_ids must be a comma-separated list of integers")
+    if len(ids) > settings.FINANCIAL_COMPARE_MAX_LINE_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {settings.FINANCIAL_COMPARE_MAX_LINE_ITEMS} line items per request")
+    symbol_list = [x.strip().upper() for x in symbols.split(",") if x.strip()]
+    if symbol_list == [ALL_BANKS.upper()]:
+        symbol_list = [ALL_BANKS]
+    return JSONResponse(await fetch_financial_comparison(symbol_list, report_type_id, ids, period, year_from, year_to))
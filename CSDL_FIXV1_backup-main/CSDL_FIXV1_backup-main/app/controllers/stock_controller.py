@@ -2,22 +2,21 @@ from fastapi import Request, APIRouter
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 from app.models.stock import StockModel
+from app.services.upstream_executor import run_upstream
+from app.config import settings
 from typing import Dict, Any
 
 router = APIRouter()
 templates = Jinja2Templates(directory="templates")
 
-symbols = [
-    "VCB", "BID", "CTG", "TCB", "MBB", "VPB", "ACB", "HDB", "STB", "EIB",
-    "LPB", "SHB", "VIB", "MSB", "OCB", "TPB", "BAB", "ABB", "BVB", "KLB",
-    "NAB", "PGB", "SGB", "VAB", "VBB", "SSB", "SCB"
-]
+symbols = settings.BANK_SYMBOLS
 
 @router.get("/stock", response_class=HTMLResponse)
 async def get_stock(request: Request, bank_code: str = "VCB") -> HTMLResponse:
     return await get_home(request, bank_code)
 
-async def get_home(request: Request, bank_code: str = "VCB") -> HTMLResponse:
+def _load_stock_page_data(bank_code: str) -> Dict[str, Any]:
+    # Toàn bộ phần này gọi vnstock / supabase đồng bộ, nên chạy trên upstream executor
     model = StockModel(bank_code)
     try:
         company_profile, key_developments = model.get_company_profile()
@@ -39,14 +38,31 @@ async def get_home(request: Request, bank_code: str = "VCB") -> HTMLResponse:
         price_data = []
         stock_info = {}
 
-    return templates.TemplateResponse("stock.html", {
-        "request": request,
-        "selected": bank_code,
-        "bank_codes": symbols,
+    return {
         "company_profile": company_profile,
         "key_developments": key_developments,
         "officers_html": officers_html,
         "shareholders_html": shareholders_html,
         "price_data": price_data,
         "stock_info": stock_info
+    }
+
+async def get_home(request: Request, bank_code: str = "VCB") -> HTMLResponse:
+    try:
+        page_data = await run_upstream(_load_stock_page_data, bank_code)
+    except Exception:
+        page_data = {
+            "company_profile": "Không thể tải dữ liệu.",
+            "key_developments": "Không thể tải dữ liệu.",
+            "officers_html": "Không thể tải dữ liệu.",
+            "shareholders_html": "Không thể tải dữ liệu.",
+            "price_data": [],
+            "stock_info": {}
+        }
+
+    return templates.TemplateResponse("stock.html", {
+        "request": request,
+        "selected": bank_code,
+        "bank_codes": symbols,
+        **page_data
     })
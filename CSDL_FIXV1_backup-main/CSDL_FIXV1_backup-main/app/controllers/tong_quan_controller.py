@@ -2,23 +2,46 @@
 Tổng hợp các controller: ...
 """
 from fastapi import APIRouter, HTTPException, Query, Path, Depends, FastAPI, WebSocket, WebSocketDisconnect, Request
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 import logging
 import asyncio
+import json
+from datetime import datetime
 from starlette.websockets import WebSocketState
 from app.services.tong_quan_service import (
     calculate_total_capital_for_all_stocks,
+    get_cached_total_capital,
     fetch_all_news,
     fetch_news_by_id,
     get_market_data_service,
+    MARKET_CAP_DEFAULT_PARAMS,
     MarketDataService,
     FinancialService,
-    IndexService
+    IndexService,
+    get_index_service
 )
-from app.models.tong_quan_model import MarketCapItem, FinancialDataPoint, StockModel
+from app.services.upstream_executor import run_upstream, get_upstream_executor, UpstreamError
+from app.services.tick_history_service import get_tick_history_store
+from app.services.result_cache import invalidate_tag, etag_matches, JsonPayload, TAG_FINANCIAL_REPORTS
+from app.services.history_cache import OhlcvSeries
+from app.services.chart_service import get_chart_service, KIND_INDEX, SUPPORTED_KINDS, RESOLUTIONS
+from app.services.stock_service import get_stock_history_series, is_supported_stock
+from app.services.indicator_service import get_indicator_engine, resolve_params
+from app.services.ingestion_scheduler import get_ingestion_scheduler
+from app.services.catalog_service import get_reference_catalog
+from app.services.http_pool import get_http_pool
+from app.services.priceboard_service import (
+    get_price_board_broadcaster,
+    PriceBoardBroadcaster,
+    PriceBoardSubscriber,
+    normalize_symbols,
+    PROTOCOL_FULL,
+    SUPPORTED_PROTOCOLS
+)
+from app.models.tong_quan_model import MarketCapItem, FinancialDataPoint
 from app.config import settings
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response
 
 logger = logging.getLogger(__name__)
 
@@ -39,40 +62,69 @@ async def get_home(request: Request, bank_code: str = "VCB"):
         }
     )
 
+def _ensure_known_line_item(*line_item_ids: int) -> None:
+    """404 nếu line_item_id không có trong catalog (khi catalog đã nạp), để id tuỳ ý không tạo mục cache / truy vấn DB."""
+    catalog = get_reference_catalog()
+    if not catalog.loaded:
+        return
+    unknown = [line_item_id for line_item_id in line_item_ids if line_item_id not in catalog.snapshot.line_item_name_by_id]
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Không tìm thấy line_item_id: {', '.join(map(str, unknown))}")
+
 # ================= TỔNG VỐN HÓA API =================
 @router_api.get("/capital/total", summary="Tính tổng nguồn vốn cho các cổ phiếu dựa trên tiêu chí")
-def get_total_capital_api_endpoint(
-    year: int = Query(2024, description="Năm tài chính, ví dụ: 2023"),
-    quarter: str = Query("Q4", description="Quý tài chính, ví dụ: Q1, Q2, Q3, Q4"),
-    line_item_id: int = Query(88, description="ID của chỉ tiêu dòng (line item) trong báo cáo tài chính")
+async def get_total_capital_api_endpoint(
+    year: int = Query(2024, ge=settings.FINANCIAL_YEAR_MIN, le=settings.FINANCIAL_YEAR_MAX, description="Năm tài chính, ví dụ: 2023"),
+    quarter: str = Query("Q4", pattern=r"^Q[1-4]$", description="Quý tài chính, ví dụ: Q1, Q2, Q3, Q4"),
+    line_item_id: int = Query(88, ge=1, description="ID của chỉ tiêu dòng (line item) trong báo cáo tài chính")
 ):
-    logger.info(f"API request to /capital/total with params: year={year}, quarter='{quarter}', line_item_id={line_item_id}")
-    try:
-        total_capital = calculate_total_capital_for_all_stocks(
-            year=year,
-            quarter=quarter,
-            line_item_id=line_item_id
-        )
+    logger.debug(f"API request to /capital/total with params: year={year}, quarter='{quarter}', line_item_id={line_item_id}")
+    _ensure_known_line_item(line_item_id)
+    total_capital = get_cached_total_capital(year, quarter, line_item_id)
+    if total_capital is None:
+        try:
+            total_capital = await run_upstream(
+                calculate_total_capital_for_all_stocks,
+                year=year,
+                quarter=quarter,
+                line_item_id=line_item_id
+            )
+        except UpstreamError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        except Exception as e:
+            logger.exception(f"Lỗi trong API /capital/total: {e}")
+            raise HTTPException(status_code=500, detail=f"Lỗi máy chủ nội bộ khi tính toán tổng nguồn vốn: {str(e)}")
         logger.info(f"Calculated total capital: {total_capital} for params: year={year}, quarter='{quarter}', line_item_id={line_item_id}")
-        return {
-            "year_queried": year,
-            "quarter_queried": quarter,
-            "line_item_id_queried": line_item_id,
-            "calculated_total_capital": total_capital
-        }
-    except Exception as e:
-        logger.exception(f"Lỗi trong API /capital/total: {e}")
-        raise HTTPException(status_code=500, detail=f"Lỗi máy chủ nội bộ khi tính toán tổng nguồn vốn: {str(e)}")
+    return {
+        "year_queried": year,
+        "quarter_queried": quarter,
+        "line_item_id_queried": line_item_id,
+        "calculated_total_capital": total_capital
+    }
+
+@router_api.post("/financial/reports/ingested", summary="Báo có báo cáo tài chính mới: xoá các cache số liệu tài chính và làm ấm lại")
+async def financial_reports_ingested() -> Dict[str, Any]:
+    try:
+        hooks_called = await run_upstream(invalidate_tag, TAG_FINANCIAL_REPORTS)
+    except UpstreamError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return {"status": "invalidated", "hooks_called": hooks_called}
 
 # ================= NEWS API =================
 @router_api.get("/news", response_model=List[Dict[str, Any]], summary="Get All News")
 async def get_news_list():
-    news_list = fetch_all_news()
+    try:
+        news_list = await run_upstream(fetch_all_news)
+    except UpstreamError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     return news_list
 
 @router_api.get("/news/{news_id}", response_model=Dict[str, Any], summary="Get News By ID")
 async def get_news_item_by_id(news_id: int):
-    news_item = fetch_news_by_id(news_id)
+    try:
+        news_item = await run_upstream(fetch_news_by_id, news_id)
+    except UpstreamError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     if news_item is None:
         raise HTTPException(status_code=404, detail="News not found")
     return news_item
@@ -80,27 +132,48 @@ async def get_news_item_by_id(news_id: int):
 # ================= MARKET DATA API =================
 @router_api.get("/market-cap", response_model=List[MarketCapItem], summary="Get Market Capitalization Data")
 async def get_market_cap_data_api(
+    request: Request,
     service: MarketDataService = Depends(get_market_data_service)
-) -> List[MarketCapItem]:
-    target_line_item_id = 88
-    target_year = 2024
-    target_quarter = "Q4"
-    min_stock_id = 1
-    max_stock_id = 27
-    try:
-        data = service.get_market_cap(
-            line_item_id=target_line_item_id,
-            year=target_year,
-            quarter=target_quarter,
-            min_stock_id=min_stock_id,
-            max_stock_id=max_stock_id
-        )
-        return data
-    except HTTPException as http_exc:
-        raise http_exc
-    except Exception as e:
-        logger.error(f"Error in market_data_controller: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail="Internal server error in market data controller")
+) -> Response:
+    params = MARKET_CAP_DEFAULT_PARAMS
+    payload = service.get_cached_market_cap_payload(**params)
+    if payload is None:
+        try:
+            payload = await run_upstream(service.get_market_cap_payload, **params)
+        except HTTPException as http_exc:
+            raise http_exc
+        except UpstreamError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        except Exception as e:
+            logger.error(f"Error in market_data_controller: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail="Internal server error in market data controller")
+    return _json_payload_response(request, payload)
+
+@router_api.get("/market-cap/series", summary="Giá trị line item (mặc định: tổng nguồn vốn) theo mọi kỳ cho toàn bộ mã, tuỳ chọn top N mỗi kỳ")
+async def get_market_cap_series_api(
+    request: Request,
+    line_item_id: int = Query(settings.DEFAULT_LINE_ITEM_ID_TONG_NGUON_VON, ge=1, description="ID của chỉ tiêu (line item)"),
+    top: Optional[int] = Query(None, ge=1, le=500, description="Chỉ trả N mã lớn nhất mỗi kỳ, kèm thứ hạng"),
+    service: MarketDataService = Depends(get_market_data_service)
+) -> Response:
+    _ensure_known_line_item(line_item_id)
+    payload = service.get_cached_market_cap_series_payload(line_item_id, top)
+    if payload is None:
+        try:
+            payload = await run_upstream(service.get_market_cap_series_payload, line_item_id, top)
+        except UpstreamError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        except Exception as e:
+            logger.error(f"Error building market cap series for line_item_id={line_item_id}: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail="Internal server error in market data controller")
+    return _json_payload_response(request, payload)
+
+def _json_payload_response(request: Request, payload: JsonPayload) -> Response:
+    """Trả body đã serialize kèm ETag; 304 nếu client đã có đúng phiên bản (If-None-Match)."""
+    headers = {"ETag": payload.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), payload.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=payload.body, media_type="application/json", headers=headers)
 
 # ================= FINANCIAL DATA API =================
 @router_api.get(
@@ -110,11 +183,14 @@ async def get_market_cap_data_api(
 )
 async def get_financial_data_for_chart_endpoint(
     line_item_id: int = Path(..., description="ID của chỉ số tài chính cần lấy", ge=1),
+    year: Optional[int] = Query(None, ge=settings.FINANCIAL_YEAR_MIN, le=settings.FINANCIAL_YEAR_MAX, description="Năm tài chính (mặc định: DEFAULT_YEAR_TONG_NGUON_VON)"),
+    quarter: Optional[str] = Query(None, pattern=r"^Q[1-4]$", description="Quý Q1..Q4 (mặc định: DEFAULT_QUARTER_TONG_NGUON_VON)"),
     service: FinancialService = Depends(FinancialService)
 ):
     logger.info(f"Controller: Received request at /financial/chart-data/{line_item_id}")
+    _ensure_known_line_item(line_item_id)
     try:
-        data = await service.get_chart_data(line_item_id=line_item_id)
+        data = await service.get_chart_data(line_item_id=line_item_id, year=year, quarter=quarter)
         if not data:
             logger.info(f"Controller: No data found for line_item_id={line_item_id}")
         logger.info(f"Controller: Returning data for line_item_id={line_item_id}")
@@ -126,9 +202,53 @@ async def get_financial_data_for_chart_endpoint(
         logger.exception(f"Controller: Unexpected error handling request for line_item_id={line_item_id}: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error in financial data controller")
 
+def _parse_periods(periods: str) -> List[Tuple[int, str]]:
+    """'2024Q4,2024-Q3' -> [(2024, 'Q4'), (2024, 'Q3')]"""
+    parsed: List[Tuple[int, str]] = []
+    for raw in periods.split(','):
+        token = raw.strip().upper().replace('-', '')
+        if not token:
+            continue
+        if len(token) != 6 or not token[:4].isdigit() or token[4] != 'Q' or token[5] not in '1234':
+            raise HTTPException(status_code=400, detail=f"Kỳ không hợp lệ: '{raw}'. Định dạng: 2024Q4")
+        period = (int(token[:4]), token[4:])
+        if not settings.FINANCIAL_YEAR_MIN <= period[0] <= settings.FINANCIAL_YEAR_MAX:
+            raise HTTPException(status_code=400, detail=f"Năm ngoài phạm vi {settings.FINANCIAL_YEAR_MIN}-{settings.FINANCIAL_YEAR_MAX}: '{raw}'")
+        if period not in parsed:
+            parsed.append(period)
+    return parsed
+
+@router_api.get("/financial/chart-data", summary="Dữ liệu biểu đồ tài chính cho nhiều line item và nhiều kỳ trong một request")
+async def get_financial_chart_data_batch(
+    line_item_ids: str = Query(..., description="Danh sách line_item_id, phân tách bằng dấu phẩy, ví dụ: 88,89"),
+    periods: Optional[str] = Query(None, description="Danh sách kỳ, ví dụ: 2024Q4,2024Q3 (mặc định: kỳ mặc định)"),
+    service: FinancialService = Depends(FinancialService)
+) -> List[Dict[str, Any]]:
+    try:
+        item_ids = list(dict.fromkeys(int(raw) for raw in line_item_ids.split(',') if raw.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="line_item_ids phải là danh sách số nguyên")
+    period_list = _parse_periods(periods) if periods else [(settings.DEFAULT_YEAR_TONG_NGUON_VON, settings.DEFAULT_QUARTER_TONG_NGUON_VON)]
+    if not item_ids or not period_list:
+        raise HTTPException(status_code=400, detail="Cần ít nhất một line_item_id và một kỳ")
+    if len(item_ids) * len(period_list) > settings.FINANCIAL_CHART_MAX_KEYS:
+        raise HTTPException(status_code=400, detail=f"Tối đa {settings.FINANCIAL_CHART_MAX_KEYS} cặp (line_item, kỳ) mỗi request")
+    _ensure_known_line_item(*item_ids)
+    try:
+        results = await run_upstream(service.get_chart_data_batch, item_ids, period_list)
+    except UpstreamError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except Exception as e:
+        logger.exception(f"Controller: Unexpected error in batched chart data for {item_ids} x {period_list}: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error in financial data controller")
+    return [
+        {"line_item_id": line_item_id, "year": year, "quarter": quarter, "data": data}
+        for (line_item_id, year, quarter), data in results.items()
+    ]
+
 # ================= INDICES API =================
 @router_api.get("/index/all", summary="Lấy dữ liệu đã xử lý cho tất cả các chỉ số thị trường", response_model=Dict[str, Any])
-async def get_all_indices_data_logic(index_service: IndexService = Depends(IndexService)) -> Dict[str, Any]:
+async def get_all_indices_data_logic(index_service: IndexService = Depends(get_index_service)) -> Dict[str, Any]:
     logger.info("API request to /index/all")
     try:
         all_indices_data = await index_service.fetch_and_process_all_indices()
@@ -138,41 +258,227 @@ async def get_all_indices_data_logic(index_service: IndexService = Depends(Index
         logger.exception(f"Unexpected error in API endpoint /index/all: {e}")
         raise HTTPException(status_code=500, detail=f"Internal server error while fetching indices data: {str(e)}")
 
-# --- WebSocket Stock Updates giữ nguyên ---
+@router_api.post("/index/types/invalidate", summary="Xoá cache map index_types, request kế tiếp sẽ nạp lại từ DB")
+async def invalidate_index_types(index_service: IndexService = Depends(get_index_service)) -> Dict[str, Any]:
+    index_service.invalidate_index_types()
+    return {"status": "invalidated"}
+
+# ================= HISTORY CHART API =================
+async def _load_history_series(kind: str, symbol: str, index_service: IndexService) -> OhlcvSeries:
+    """Lịch sử OHLCV đã cache của một chỉ số (index_history) hoặc cổ phiếu (transaction_price)."""
+    if kind not in SUPPORTED_KINDS:
+        raise HTTPException(status_code=400, detail=f"kind phải là một trong {list(SUPPORTED_KINDS)}")
+    try:
+        if kind == KIND_INDEX:
+            if symbol not in index_service.INDEX_CONFIG:
+                raise HTTPException(status_code=404, detail=f"Index '{symbol}' not configured")
+            await index_service.ensure_index_type_ids()
+            series = await run_upstream(index_service.get_history_series, symbol)
+        else:
+            # Kiểm tra trước khi nạp: mã bất kỳ không được tạo entry trong các cache lịch sử / biểu đồ / chỉ báo
+            if not is_supported_stock(symbol):
+                raise HTTPException(status_code=404, detail=f"Stock '{symbol}' not supported")
+            series = await run_upstream(get_stock_history_series, symbol)
+    except UpstreamError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    if series is None or series.size == 0:
+        raise HTTPException(status_code=404, detail=f"No history found for {kind} '{symbol}'")
+    return series
+
+@router_api.get("/chart/{kind}/{symbol}", summary="Nến OHLCV theo ngày/tuần/tháng/quý, có thể giảm còn N điểm (LTTB)")
+async def get_history_chart(
+    kind: str = Path(..., description="index hoặc stock"),
+    symbol: str = Path(..., description="Mã chỉ số (VNINDEX, ...) hoặc mã cổ phiếu"),
+    resolution: str = Query("D", description="D, W, M hoặc Q"),
+    points: Optional[int] = Query(None, ge=3, le=5000, description="Số điểm tối đa trả về (giảm điểm LTTB theo giá đóng cửa)"),
+    index_service: IndexService = Depends(get_index_service)
+) -> Dict[str, Any]:
+    resolution = resolution.upper()
+    if resolution not in RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"resolution phải là một trong {list(RESOLUTIONS)}")
+    symbol = symbol.upper()
+    series = await _load_history_series(kind, symbol, index_service)
+    return get_chart_service().get_chart(kind, symbol, series, resolution, points)
+
+@router_api.get("/indicator/{kind}/{symbol}/{indicator}", summary="Chỉ báo kỹ thuật (sma, ema, rsi, macd, bollinger, atr) tính trên lịch sử đã cache")
+async def get_technical_indicator(
+    kind: str = Path(..., description="index hoặc stock"),
+    symbol: str = Path(..., description="Mã chỉ số (VNINDEX, ...) hoặc mã cổ phiếu"),
+    indicator: str = Path(..., description="sma, ema, rsi, macd, bollinger hoặc atr"),
+    window: Optional[int] = Query(None, ge=1, le=1000, description="Chu kỳ (sma, ema, rsi, bollinger, atr)"),
+    fast: Optional[int] = Query(None, ge=1, le=1000, description="Chu kỳ EMA nhanh (macd)"),
+    slow: Optional[int] = Query(None, ge=1, le=1000, description="Chu kỳ EMA chậm (macd)"),
+    signal: Optional[int] = Query(None, ge=1, le=1000, description="Chu kỳ đường tín hiệu (macd)"),
+    k: Optional[float] = Query(None, gt=0, le=10, description="Số lần độ lệch chuẩn (bollinger)"),
+    limit: Optional[int] = Query(None, ge=1, description="Chỉ trả về N giá trị cuối"),
+    index_service: IndexService = Depends(get_index_service)
+) -> Dict[str, Any]:
+    indicator = indicator.lower()
+    try:
+        params = resolve_params(indicator, {"window": window, "fast": fast, "slow": slow, "signal": signal, "k": k})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    symbol = symbol.upper()
+    series = await _load_history_series(kind, symbol, index_service)
+    try:
+        return await run_upstream(get_indicator_engine().get_indicator, kind, symbol, series, indicator, params, limit)
+    except UpstreamError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+# ================= SYSTEM API =================
+@router_api.get("/system/upstream-executor", summary="Trạng thái thread pool gọi upstream (queue depth, timeout, ...)")
+async def get_upstream_executor_stats() -> Dict[str, Any]:
+    return get_upstream_executor().stats()
+
+@router_api.get("/priceboard/connections", summary="Trạng thái các kết nối bảng giá: frame đã bỏ, độ trễ theo từng kết nối")
+async def get_price_board_connections() -> Dict[str, Any]:
+    return get_price_board_broadcaster().stats()
+
+@router_api.get("/priceboard/history", summary="Lịch sử tick trong phiên của bảng giá (backfill / sparkline)")
+async def get_price_board_history(
+    symbols: Optional[str] = Query(None, description="Danh sách mã, phân tách bằng dấu phẩy. Bỏ trống = mọi mã"),
+    since: Optional[str] = Query(None, description="seq (số nguyên) hoặc thời điểm ISO 8601, chỉ trả tick sau mốc này")
+) -> Dict[str, Any]:
+    since_seq: Optional[int] = None
+    since_time: Optional[float] = None
+    if since:
+        if since.isdigit():
+            since_seq = int(since)
+        else:
+            try:
+                since_time = datetime.fromisoformat(since).timestamp()
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Tham số 'since' phải là seq hoặc thời điểm ISO 8601.")
+    store = get_tick_history_store()
+    watchlist = normalize_symbols(symbols) if symbols else None
+    history = store.get_history(watchlist, since_seq=since_seq, since_time=since_time)
+    latest_tick = get_price_board_broadcaster().latest_tick
+    return {
+        "session_date": store.session_date.isoformat() if store.session_date else None,
+        "latest_seq": latest_tick.seq if latest_tick is not None else None,
+        "symbols": history
+    }
+
+@router_api.get("/system/catalog", summary="Trạng thái catalog stocks / report_types / line_items trong bộ nhớ")
+async def get_catalog_status() -> Dict[str, Any]:
+    return get_reference_catalog().stats()
+
+@router_api.post("/system/catalog/refresh", summary="Nạp lại catalog tham chiếu ngay (vd: sau khi thêm mã / chỉ tiêu mới)")
+async def refresh_catalog() -> Dict[str, Any]:
+    catalog = get_reference_catalog()
+    try:
+        await catalog.load()
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Catalog refresh failed: {e}")
+    return catalog.stats()
+
+@router_api.get("/system/http-pool", summary="Thống kê HTTP pool dùng chung tới PostgREST / Supabase")
+async def get_http_pool_status() -> Dict[str, Any]:
+    return get_http_pool().stats()
+
+@router_api.get("/system/ingestion", summary="Trạng thái các job đồng bộ vnstock -> Supabase")
+async def get_ingestion_status() -> Dict[str, Any]:
+    return get_ingestion_scheduler().status()
+
+@router_api.post("/system/ingestion/{job_name}/run", summary="Chạy ngay một job đồng bộ (chạy nền)")
+async def trigger_ingestion_job(job_name: str) -> Dict[str, Any]:
+    scheduler = get_ingestion_scheduler()
+    job = scheduler.jobs.get(job_name)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Ingestion job '{job_name}' not found")
+    if not scheduler.trigger(job_name):
+        return {"job": job_name, "status": "already_running"}
+    return {"job": job_name, "status": "started"}
+
+# --- WebSocket Stock Updates ---
+async def _receive_price_board_messages(websocket: WebSocket, broadcaster: PriceBoardBroadcaster, subscriber: PriceBoardSubscriber):
+    """
+    Đọc message điều khiển từ client:
+      {"action": "resync"}
+      {"action": "subscribe", "symbols": ["VCB", "BID"]}   ("*" = mọi mã)
+      {"action": "unsubscribe", "symbols": ["BID"]}      ("*" bị từ chối bằng error frame)
+    Khi client ngắt kết nối, đóng outbox để vòng gửi dừng lại.
+    """
+    try:
+        while True:
+            raw_message = await websocket.receive_text()
+            try:
+                message = json.loads(raw_message)
+            except ValueError:
+                logger.warning(f"Ignoring non-JSON WebSocket message from {subscriber.client_label}: {raw_message[:200]}")
+                continue
+            action = message.get("action") if isinstance(message, dict) else None
+            if action == "resync":
+                broadcaster.request_resync(subscriber)
+            elif action in ("subscribe", "unsubscribe"):
+                raw_symbols = message.get("symbols")
+                symbols = normalize_symbols(raw_symbols) if isinstance(raw_symbols, (str, list)) else set()
+                if symbols is not None and not symbols:
+                    # Không áp dụng tập rỗng: client "mọi mã" sẽ thành watchlist trống và không nhận frame nào nữa
+                    subscriber.deliver({"error": f"'{action}' requires a non-empty 'symbols' list (or \"*\")"})
+                    continue
+                try:
+                    if action == "subscribe":
+                        broadcaster.add_symbols(subscriber, symbols)
+                    else:
+                        broadcaster.remove_symbols(subscriber, symbols)
+                except ValueError as e:
+                    subscriber.deliver({"error": str(e)})
+            else:
+                logger.warning(f"Unknown WebSocket message from {subscriber.client_label}: {message}")
+    except WebSocketDisconnect as e:
+        logger.info(f"WebSocket disconnected by client {subscriber.client_label}. Code: {e.code}. Reason: {e.reason}")
+    except Exception as e:
+        logger.warning(f"Stopped reading WebSocket messages from {subscriber.client_label}: {e}")
+    finally:
+        subscriber.outbox.close()
+
 def setup_stock_websocket_routes(app: FastAPI):
-    stock_model = StockModel()
+    broadcaster = get_price_board_broadcaster()
     @app.websocket("/ws/stock-updates")
-    async def websocket_stock_endpoint(websocket: WebSocket):
+    async def websocket_stock_endpoint(websocket: WebSocket, protocol: str = PROTOCOL_FULL, symbols: Optional[str] = None):
         await websocket.accept()
         client_host = websocket.client.host if websocket.client else "unknown"
         client_port = websocket.client.port if websocket.client else "unknown"
-        logger.info(f"WebSocket connection accepted from {client_host}:{client_port}")
+        if protocol not in SUPPORTED_PROTOCOLS:
+            logger.warning(f"Unsupported protocol '{protocol}' requested by {client_host}:{client_port}. Falling back to '{PROTOCOL_FULL}'.")
+            protocol = PROTOCOL_FULL
+        logger.info(f"WebSocket connection accepted from {client_host}:{client_port} (protocol={protocol})")
+        watchlist = normalize_symbols(symbols) if symbols else None
+        try:
+            subscriber = await broadcaster.subscribe(f"{client_host}:{client_port}", protocol, watchlist)
+        except ValueError as e:
+            logger.warning(f"Rejecting WebSocket subscription from {client_host}:{client_port}: {e}")
+            await websocket.send_json({"error": str(e)})
+            await websocket.close(code=1008)
+            return
+        receiver_task = asyncio.create_task(_receive_price_board_messages(websocket, broadcaster, subscriber))
+        send_timeout = getattr(settings, 'WEBSOCKET_SEND_TIMEOUT_SECONDS', 15.0)
+        close_code = 1000
         try:
             while True:
+                item = await subscriber.outbox.get()
+                if item is None:
+                    if subscriber.evicted:
+                        close_code = 1013
+                    break
                 if not (websocket.application_state == WebSocketState.CONNECTED and \
                         websocket.client_state == WebSocketState.CONNECTED):
-                    logger.info(f"WebSocket no longer connected for {client_host}:{client_port}. Breaking send loop.")
+                    logger.info(f"WebSocket disconnected before sending data to {client_host}:{client_port}. Breaking loop.")
                     break
-                data = await stock_model.fetch_stock_data()
-                if data is None:
-                    logger.warning(f"StockModel returned None for {client_host}:{client_port}. Sending keep-alive or error.")
-                    interval = getattr(settings, 'WEBSOCKET_STOCK_INTERVAL_SECONDS', 10)
-                    await asyncio.sleep(interval)
-                    continue
-                if websocket.application_state == WebSocketState.CONNECTED and \
-                   websocket.client_state == WebSocketState.CONNECTED:
-                    if isinstance(data, dict) and "error" in data:
-                        logger.warning(f"Error fetching stock data from model: {data['error']}. Sending to client {client_host}:{client_port}.")
-                        await websocket.send_json(data)
-                    elif isinstance(data, list) and not data:
-                        logger.info(f"StockModel returned empty list for {client_host}:{client_port}. Nothing to send.")
-                    else:
-                        await websocket.send_json(data)
+                if isinstance(item, tuple):
+                    text = subscriber.render(*item)
+                    if text is None:
+                        continue
                 else:
-                    logger.info(f"WebSocket disconnected before sending data to {client_host}:{client_port}. Breaking loop.")
+                    text = json.dumps(item, ensure_ascii=False)
+                try:
+                    await asyncio.wait_for(websocket.send_text(text), timeout=send_timeout)
+                except asyncio.TimeoutError:
+                    logger.warning(f"Send to {client_host}:{client_port} timed out after {send_timeout}s. Disconnecting slow consumer.")
+                    close_code = 1013
                     break
-                interval = getattr(settings, 'WEBSOCKET_STOCK_INTERVAL_SECONDS', 10)
-                await asyncio.sleep(interval)
+                subscriber.mark_sent()
         except WebSocketDisconnect as e:
             logger.info(f"WebSocket disconnected by client {client_host}:{client_port}. Code: {e.code}. Reason: {e.reason}")
         except asyncio.CancelledError:
@@ -187,9 +493,11 @@ def setup_stock_websocket_routes(app: FastAPI):
                     logger.error(f"Failed to send error message via WebSocket to {client_host}:{client_port}: {send_error}")
         finally:
             logger.info(f"Cleaning up WebSocket connection for {client_host}:{client_port}.")
+            receiver_task.cancel()
+            await broadcaster.unsubscribe(subscriber)
             if websocket.application_state != WebSocketState.DISCONNECTED:
                 try:
-                    await websocket.close(code=1000)
+                    await websocket.close(code=close_code)
                     logger.info(f"WebSocket connection explicitly closed for {client_host}:{client_port}.")
                 except RuntimeError as e:
                     logger.warning(f"RuntimeError while trying to close WebSocket for {client_host}:{client_port} (possibly already closed): {e}")
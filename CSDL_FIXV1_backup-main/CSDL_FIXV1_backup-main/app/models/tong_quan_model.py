@@ -39,10 +39,9 @@ class StockModel:
     def __init__(self):
         from vnstock import Vnstock
         self.stock_client = Vnstock()
-        self.symbols = ['VCB', 'BID', 'CTG', 'TCB', 'MBB', 'VPB', 'ACB', 'HDB', 'STB',
-                        'EIB', 'LPB', 'SHB', 'VIB', 'MSB', 'OCB', 'TPB', 'BAB', 'ABB',
-                        'BVB', 'KLB', 'NAB', 'PGB', 'SGB', 'VAB', 'VBB', 'SSB', 'SCB']
-    async def fetch_stock_data(self):
+        from app.config import settings
+        self.symbols = list(settings.BANK_SYMBOLS)
+    def fetch_stock_data(self):
         price_board = pd.DataFrame()
         logger = logging.getLogger(__name__)
         try:
@@ -0,0 +1,135 @@
+# app/services/catalog_service.py
+"""
+Catalog các bảng tham chiếu (stocks, report_types, line_items) giữ trong bộ nhớ:
+nạp khi khởi động, làm mới nền theo chu kỳ, tra cứu O(1) (symbol -> stock_id, line_item_id -> tên).
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from app.config import settings
+from app.models.information import client, HEADERS, SUPABASE_URL
+from app.services.query_service import aiter_rest_pages
+
+logger = logging.getLogger(__name__)
+
+Row = Dict[str, Any]
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    """Một lần nạp đầy đủ; được thay thế nguyên khối khi làm mới nên request không bao giờ thấy trạng thái nửa chừng."""
+    stocks: List[Row] = field(default_factory=list)
+    report_types: List[Row] = field(default_factory=list)
+    line_items: List[Row] = field(default_factory=list)
+    stock_id_by_symbol: Dict[str, int] = field(default_factory=dict)
+    line_item_name_by_id: Dict[int, str] = field(default_factory=dict)
+    line_items_by_report_type: Dict[int, List[Row]] = field(default_factory=dict)
+    loaded_at: Optional[float] = None
+
+    @classmethod
+    def build(cls, stocks: List[Row], report_types: List[Row], line_items: List[Row]) -> "CatalogSnapshot":
+        by_report_type: Dict[int, List[Row]] = {}
+        for item in line_items:
+            by_report_type.setdefault(item.get('report_type_id'), []).append(item)
+        return cls(
+            stocks=stocks,
+            report_types=report_types,
+            line_items=line_items,
+            stock_id_by_symbol={s['symbol']: s['stock_id'] for s in stocks if s.get('symbol')},
+            line_item_name_by_id={li['line_item_id']: li.get('line_item_name') for li in line_items},
+            line_items_by_report_type=by_report_type,
+            loaded_at=time.time()
+        )
+
+
+async def _fetch_table(table: str, order: str) -> List[Row]:
+    rows: List[Row] = []
+    async for page in aiter_rest_pages(client, f"{SUPABASE_URL}/rest/v1/{table}", {"select": "*"}, HEADERS, order):
+        rows.extend(page)
+    return rows
+
+
+class ReferenceCatalog:
+    def __init__(self, refresh_interval: float):
+        self.refresh_interval = refresh_interval
+        self._snapshot = CatalogSnapshot()
+        self._load_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self.last_error: Optional[str] = None
+        self.refresh_count = 0
+
+    @property
+    def snapshot(self) -> CatalogSnapshot:
+        return self._snapshot
+
+    @property
+    def loaded(self) -> bool:
+        return self._snapshot.loaded_at is not None
+
+    async def load(self, force: bool = True) -> None:
+        """Nạp lại cả ba bảng song song. Lỗi thì giữ snapshot cũ. `force=False`: bỏ qua nếu đã có snapshot."""
+        if self._load_lock is None:
+            self._load_lock = asyncio.Lock()
+        async with self._load_lock:
+            if not force and self.loaded:
+                return
+            try:
+                stocks, report_types, line_items = await asyncio.gather(
+                    _fetch_table("stocks", "stock_id.asc"),
+                    _fetch_table("report_types", "report_type_id.asc"),
+                    _fetch_table("line_items", "line_item_id.asc")
+                )
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Reference catalog load failed (keeping previous snapshot): {e}", exc_info=True)
+                raise
+            self._snapshot = CatalogSnapshot.build(stocks, report_types, line_items)
+            self.last_error = None
+            self.refresh_count += 1
+            logger.info(f"Reference catalog loaded: {len(stocks)} stocks, {len(report_types)} report types, {len(line_items)} line items.")
+
+    async def ensure_loaded(self) -> CatalogSnapshot:
+        """Snapshot hiện tại; nếu chưa nạp lần nào (khởi động lỗi / chưa xong) thì nạp ngay."""
+        if not self.loaded:
+            await self.load(force=False)
+        return self._snapshot
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            try:
+                await self.load()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                pass  # đã log trong load(); thử lại ở chu kỳ sau
+            await asyncio.sleep(self.refresh_interval)
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        return {
+            "loaded_at": snapshot.loaded_at,
+            "stocks": len(snapshot.stocks),
+            "report_types": len(snapshot.report_types),
+            "line_items": len(snapshot.line_items),
+            "refresh_interval_seconds": self.refresh_interval,
+            "refresh_count": self.refresh_count,
+            "last_error": self.last_error
+        }
+
+
+reference_catalog = ReferenceCatalog(settings.CATALOG_REFRESH_SECONDS)
+def get_reference_catalog() -> ReferenceCatalog:
+    return reference_catalog
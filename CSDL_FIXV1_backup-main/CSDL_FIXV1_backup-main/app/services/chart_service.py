@@ -0,0 +1,168 @@
+# app/services/chart_service.py
+"""
+Dữ liệu biểu đồ dài hạn cho chỉ số và cổ phiếu: gộp nến OHLCV theo tuần / tháng / quý và
+giảm điểm kiểu LTTB, tính bằng NumPy trên lịch sử đã cache (xem history_cache.py).
+"""
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import settings
+from app.services.history_cache import OhlcvSeries, OhlcvSnapshot, OHLCV_PRICE_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+KIND_INDEX = "index"
+KIND_STOCK = "stock"
+SUPPORTED_KINDS = (KIND_INDEX, KIND_STOCK)
+# D = nến ngày gốc; W/M/Q được tính sẵn cùng lúc cho mỗi version của chuỗi
+RESOLUTIONS = ('D', 'W', 'M', 'Q')
+BAR_COLUMNS = OHLCV_PRICE_COLUMNS + ('volume',)
+
+Bars = Dict[str, np.ndarray]
+
+
+def _period_keys(time: np.ndarray, resolution: str) -> np.ndarray:
+    days = time.astype('datetime64[D]').astype(np.int64)
+    if resolution == 'W':
+        # 1970-01-01 là thứ Năm: +3 để tuần bắt đầu từ thứ Hai
+        return (days + 3) // 7
+    months = time.astype('datetime64[M]').astype(np.int64)
+    if resolution == 'M':
+        return months
+    return months // 3
+
+
+def resample_ohlcv(snapshot: OhlcvSnapshot, resolution: str) -> Bars:
+    """
+    Gộp nến ngày thành nến W/M/Q: open đầu kỳ, close cuối kỳ, high/low lớn/nhỏ nhất (bỏ NaN),
+    volume cộng dồn. Nến được gắn với ngày giao dịch đầu tiên của kỳ.
+    """
+    time = snapshot.time
+    if resolution == 'D' or snapshot.size == 0:
+        return {'time': time.copy(), **{name: snapshot.column(name).copy() for name in BAR_COLUMNS}}
+    keys = _period_keys(time, resolution)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], snapshot.size] - 1
+    return {
+        'time': time[starts],
+        'open': snapshot.column('open')[starts],
+        'high': np.fmax.reduceat(snapshot.column('high'), starts),
+        'low': np.fmin.reduceat(snapshot.column('low'), starts),
+        'close': snapshot.column('close')[ends],
+        'volume': np.add.reduceat(np.nan_to_num(snapshot.column('volume')), starts)
+    }
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: chọn `threshold` điểm giữ được hình dạng đường giá.
+    Luôn giữ điểm đầu và cuối; mỗi bucket ở giữa chọn điểm tạo tam giác lớn nhất với
+    điểm đã chọn trước đó và trung bình bucket kế tiếp.
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+    buckets = threshold - 2
+    # Biên bucket bằng số nguyên, tăng ngặt vì n - 2 >= buckets
+    edges = (np.arange(buckets + 1) * (n - 2)) // buckets + 1
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    a = 0
+    for i in range(buckets):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = end, (edges[i + 2] if i + 2 <= buckets else n)
+        next_y = y[next_start:next_end]
+        avg_x = x[next_start:next_end].mean()
+        avg_y = np.nanmean(next_y) if np.isfinite(next_y).any() else y[a]
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        area = np.nan_to_num(area, nan=-1.0)
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    selected[-1] = n - 1
+    return selected
+
+
+def to_json_list(array: np.ndarray, decimals: int = 4) -> List[Any]:
+    values = array.astype(np.float64).round(decimals)
+    return [None if np.isnan(v) else float(v) for v in values]
+
+
+class ChartService:
+    """
+    Cache các nến đã gộp theo (kind, symbol, resolution) và kết quả LTTB theo số điểm,
+    gắn với (chuỗi, `OhlcvSeries.version`): chỉ tính lại khi chuỗi có dữ liệu mới hoặc bị nạp lại.
+    Mỗi request tính trên một `OhlcvSnapshot`, nên thread đồng bộ ghi thêm nến cùng lúc không làm lệch độ dài các cột.
+    Mỗi cache giữ tối đa `max_entries` mục, bỏ mục ít dùng nhất.
+    """
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._bars: "OrderedDict[Tuple[str, str], Tuple[OhlcvSeries, int, Dict[str, Bars]]]" = OrderedDict()
+        self._downsampled: "OrderedDict[Tuple[str, str, str, int], Tuple[OhlcvSeries, int, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, cache: OrderedDict, key: Hashable) -> Optional[tuple]:
+        with self._lock:
+            cached = cache.get(key)
+            if cached is not None:
+                cache.move_to_end(key)
+            return cached
+
+    def _store(self, cache: OrderedDict, key: Hashable, value: tuple) -> None:
+        with self._lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > self.max_entries:
+                cache.popitem(last=False)
+
+    @staticmethod
+    def _is_current(cached: Optional[tuple], series: OhlcvSeries, snapshot: OhlcvSnapshot) -> bool:
+        return cached is not None and cached[0] is series and cached[1] == snapshot.version
+
+    def _get_bars(self, kind: str, symbol: str, series: OhlcvSeries, snapshot: OhlcvSnapshot, resolution: str) -> Bars:
+        key = (kind, symbol)
+        cached = self._lookup(self._bars, key)
+        if not self._is_current(cached, series, snapshot):
+            by_resolution = {res: resample_ohlcv(snapshot, res) for res in RESOLUTIONS}
+            self._store(self._bars, key, (series, snapshot.version, by_resolution))
+            logger.debug(f"Chart bars recomputed for {kind}:{symbol} (version {snapshot.version}, {snapshot.size} daily rows).")
+            return by_resolution[resolution]
+        return cached[2][resolution]
+
+    def get_bars(self, kind: str, symbol: str, series: OhlcvSeries, resolution: str) -> Bars:
+        return self._get_bars(kind, symbol, series, series.snapshot(), resolution)
+
+    def get_chart(self, kind: str, symbol: str, series: OhlcvSeries, resolution: str = 'D',
+                  points: Optional[int] = None) -> Dict[str, Any]:
+        snapshot = series.snapshot()
+        bars = self._get_bars(kind, symbol, series, snapshot, resolution)
+        total_bars = len(bars['time'])
+        if points and points < total_bars:
+            key = (kind, symbol, resolution, points)
+            cached = self._lookup(self._downsampled, key)
+            if not self._is_current(cached, series, snapshot):
+                indices = lttb_indices(bars['time'].astype(np.int64), bars['close'], points)
+                self._store(self._downsampled, key, (series, snapshot.version, indices))
+            else:
+                indices = cached[2]
+            bars = {name: values[indices] for name, values in bars.items()}
+        return {
+            "kind": kind,
+            "symbol": symbol,
+            "resolution": resolution,
+            "total_bars": total_bars,
+            "points": len(bars['time']),
+            "time": np.datetime_as_string(bars['time'], unit='D').tolist(),
+            **{name: to_json_list(bars[name]) for name in OHLCV_PRICE_COLUMNS},
+            "volume": np.nan_to_num(bars['volume']).round().astype(np.int64).tolist()
+        }
+
+
+chart_service = ChartService(settings.CHART_CACHE_MAX_ENTRIES)
+def get_chart_service() -> ChartService:
+    return chart_service
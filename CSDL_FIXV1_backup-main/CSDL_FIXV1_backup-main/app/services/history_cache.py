@@ -0,0 +1,240 @@
+# app/services/history_cache.py
+"""
+Cache lịch sử OHLCV theo ngày trong bộ nhớ, lưu dạng cột NumPy. Nạp toàn bộ một lần,
+sau đó chỉ đọc lại từ ngày cuối cùng đã cache: phiên cuối (có thể đang giao dịch) được cập nhật, phiên mới được nối thêm.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Hashable, Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+OHLCV_PRICE_COLUMNS = ('open', 'high', 'low', 'close')
+
+
+def _readonly(view: np.ndarray) -> np.ndarray:
+    view.flags.writeable = False
+    return view
+
+
+@dataclass(frozen=True)
+class OhlcvSnapshot:
+    """
+    Ảnh chụp nhất quán (size, time, các cột) của một OhlcvSeries. Các mảng là view chỉ đọc,
+    không bị thay đổi bởi append / ghi đè về sau (xem OhlcvSeries.append_frame).
+    """
+    version: int
+    rewritten_version: int
+    size: int
+    time: np.ndarray
+    columns: Dict[str, np.ndarray]
+
+    def column(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+
+class OhlcvSeries:
+    """
+    Chuỗi OHLCV theo ngày, tăng dần theo thời gian. Mảng được cấp phát dư và nhân đôi khi đầy,
+    nên append có chi phí khấu hao O(1) trên mỗi dòng.
+    Ghi (thread của upstream executor) và đọc (event loop) có thể chạy song song: mọi thay đổi diễn ra
+    dưới lock, code đọc nhiều cột lấy `snapshot()` thay vì đọc `size` / `time` / `column()` riêng lẻ.
+    """
+    def __init__(self, capacity: int = 256):
+        capacity = max(1, capacity)
+        self._lock = threading.Lock()
+        self._time = np.empty(capacity, dtype='datetime64[D]')
+        self._columns: Dict[str, np.ndarray] = {
+            name: np.empty(capacity, dtype=np.float64) for name in OHLCV_PRICE_COLUMNS + ('volume',)
+        }
+        self.size = 0
+        # Tăng mỗi lần có dữ liệu mới, để các cache dẫn xuất (resample, chỉ báo) biết khi nào cần tính lại
+        self.version = 0
+        # Version gần nhất mà một dòng đã có bị ghi đè: kết quả tính từ version cũ hơn không thể chỉ nối thêm
+        self.rewritten_version = 0
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "OhlcvSeries":
+        series = cls(capacity=max(256, len(df) * 2 if df is not None else 0))
+        series.append_frame(df)
+        return series
+
+    def snapshot(self) -> OhlcvSnapshot:
+        with self._lock:
+            size = self.size
+            return OhlcvSnapshot(
+                self.version, self.rewritten_version, size, _readonly(self._time[:size]),
+                {name: _readonly(array[:size]) for name, array in self._columns.items()}
+            )
+
+    @property
+    def time(self) -> np.ndarray:
+        return self.snapshot().time
+
+    def column(self, name: str) -> np.ndarray:
+        return self.snapshot().column(name)
+
+    @property
+    def last_time(self) -> Optional[np.datetime64]:
+        with self._lock:
+            return self._time[self.size - 1] if self.size else None
+
+    @property
+    def last_date_str(self) -> Optional[str]:
+        last_time = self.last_time
+        return str(last_time) if last_time is not None else None
+
+    def _ensure_capacity(self, needed: int) -> None:
+        capacity = len(self._time)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        new_time = np.empty(capacity, dtype='datetime64[D]')
+        new_time[:self.size] = self._time[:self.size]
+        self._time = new_time
+        for name, array in self._columns.items():
+            grown = np.empty(capacity, dtype=np.float64)
+            grown[:self.size] = array[:self.size]
+            self._columns[name] = grown
+
+    def append_frame(self, df: Optional[pd.DataFrame]) -> int:
+        """
+        Nối các dòng có `time` lớn hơn ngày cuối cùng đang có; dòng trùng ngày cuối (phiên chưa đóng cửa
+        lúc nạp trước) ghi đè dòng cuối nếu giá trị đã đổi. Trả về số dòng đã nối hoặc cập nhật.
+        """
+        if df is None or df.empty or 'time' not in df.columns:
+            return 0
+        times = pd.to_datetime(df['time']).to_numpy(dtype='datetime64[D]')
+        order = np.argsort(times, kind='stable')
+        times = times[order]
+        values = {
+            name: pd.to_numeric(df[name], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)[order]
+            if name in df.columns else np.full(len(times), np.nan)
+            for name in self._columns
+        }
+        # Giữ dòng cuối của mỗi ngày trong chính frame mới
+        last_of_day = np.ones(len(times), dtype=bool)
+        if len(times) > 1:
+            last_of_day[:-1] = times[1:] != times[:-1]
+        with self._lock:
+            changed = 0
+            if self.size:
+                last_time = self._time[self.size - 1]
+                current = np.flatnonzero(last_of_day & (times == last_time))
+                if len(current) and self._replace_last({name: column[current[-1]] for name, column in values.items()}):
+                    changed += 1
+                mask = last_of_day & (times > last_time)
+            else:
+                mask = last_of_day
+            count = int(mask.sum())
+            if count:
+                # Chỉ ghi vào vùng sau `size` (hoặc mảng mới khi nới capacity): snapshot đã phát ra không đổi
+                self._ensure_capacity(self.size + count)
+                end = self.size + count
+                self._time[self.size:end] = times[mask]
+                for name, array in self._columns.items():
+                    array[self.size:end] = values[name][mask]
+                self.size = end
+                changed += count
+            if changed:
+                self.version += 1
+                if count < changed:
+                    self.rewritten_version = self.version
+            return changed
+
+    def _replace_last(self, row: Dict[str, float]) -> bool:
+        last = self.size - 1
+        if all(np.array_equal(self._columns[name][last], value, equal_nan=True) for name, value in row.items()):
+            return False
+        # Copy-on-write: snapshot cũ vẫn giữ giá trị trước khi ghi đè (chỉ xảy ra một lần mỗi lần đồng bộ)
+        for name, value in row.items():
+            column = self._columns[name].copy()
+            column[last] = value
+            self._columns[name] = column
+        return True
+
+    def tail_frame(self, n: int) -> pd.DataFrame:
+        """DataFrame n dòng cuối, cùng định dạng với dữ liệu đọc từ Supabase (time dạng 'YYYY-MM-DD')."""
+        snapshot = self.snapshot()
+        return self._frame(snapshot, max(snapshot.size - n, 0))
+
+    def to_frame(self) -> pd.DataFrame:
+        return self._frame(self.snapshot(), 0)
+
+    @staticmethod
+    def _frame(snapshot: OhlcvSnapshot, start: int) -> pd.DataFrame:
+        data = {'time': np.datetime_as_string(snapshot.time[start:], unit='D')}
+        for name in OHLCV_PRICE_COLUMNS:
+            data[name] = snapshot.column(name)[start:].copy()
+        data['volume'] = pd.Series(snapshot.column('volume')[start:]).round().astype('Int64')
+        return pd.DataFrame(data)
+
+
+class HistoryCache:
+    """
+    Map key -> OhlcvSeries, an toàn khi nhiều thread của upstream executor cùng refresh.
+    `loader(key, after_date)` trả về các dòng mới hơn `after_date` (None = toàn bộ lịch sử); refresh đọc lại
+    từ ngày cuối đã cache để nhận giá đóng cửa của phiên được nạp khi còn đang giao dịch.
+    Lần nạp rỗng không được cache; giữ tối đa `max_series` chuỗi, bỏ chuỗi ít dùng nhất (cùng lock của nó).
+    """
+    def __init__(self, loader: Callable[[Hashable, Optional[str]], pd.DataFrame], max_series: Optional[int] = None):
+        self._loader = loader
+        self.max_series = max_series
+        self._series: "OrderedDict[Hashable, OhlcvSeries]" = OrderedDict()
+        self._locks: Dict[Hashable, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock_for(self, key: Hashable) -> threading.Lock:
+        with self._locks_guard:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.Lock()
+            return lock
+
+    def get(self, key: Hashable) -> Optional[OhlcvSeries]:
+        return self._series.get(key)
+
+    def _store(self, key: Hashable, series: OhlcvSeries) -> None:
+        with self._locks_guard:
+            self._series[key] = series
+            self._series.move_to_end(key)
+            while self.max_series is not None and len(self._series) > self.max_series:
+                evicted, _ = self._series.popitem(last=False)
+                self._locks.pop(evicted, None)
+                logger.info(f"History cache evicted {evicted} (max {self.max_series} series).")
+
+    def refresh(self, key: Hashable) -> OhlcvSeries:
+        with self._lock_for(key):
+            series = self._series.get(key)
+            if series is None:
+                series = OhlcvSeries.from_frame(self._loader(key, None))
+                if series.size == 0:
+                    # Không cache kết quả rỗng (mã chưa có dữ liệu / không tồn tại)
+                    with self._locks_guard:
+                        self._locks.pop(key, None)
+                    logger.info(f"History cache found no rows for {key}; not cached.")
+                    return series
+                self._store(key, series)
+                logger.info(f"History cache loaded {series.size} rows for {key}.")
+            else:
+                self._store(key, series)
+                day_before_last = str(series.last_time - np.timedelta64(1, 'D'))
+                changed = series.append_frame(self._loader(key, day_before_last))
+                if changed:
+                    logger.info(f"History cache updated {changed} rows for {key} (now {series.size}).")
+            return series
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        with self._locks_guard:
+            if key is None:
+                self._series.clear()
+                self._locks.clear()
+            else:
+                self._series.pop(key, None)
+                self._locks.pop(key, None)
@@ -0,0 +1,216 @@
+# app/services/http_pool.py
+"""
+Lớp HTTP dùng chung cho mọi truy cập PostgREST/Supabase: một httpx.AsyncClient (truy vấn REST trực tiếp)
+và một httpx.Client (truyền vào các client supabase-py chạy trên upstream executor), cùng giới hạn kết nối,
+keep-alive, HTTP/2, timeout và chính sách thử lại. Vòng đời do lifespan của FastAPI quản lý (đóng khi tắt ứng dụng).
+"""
+import asyncio
+import importlib.util
+import logging
+import random
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+
+from app.config import get_stock_supabase_client, get_supabase_client, settings
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+# 429 / lỗi gateway: thường là tạm thời phía Supabase, thử lại an toàn với lời gọi đọc
+RETRYABLE_STATUS_CODES = frozenset({429, 502, 503, 504})
+
+
+def http2_available() -> bool:
+    return settings.HTTP2_ENABLED and importlib.util.find_spec("h2") is not None
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY_SECONDS
+    )
+
+
+def _timeout(read: Optional[float] = None) -> httpx.Timeout:
+    return httpx.Timeout(
+        connect=settings.HTTP_CONNECT_TIMEOUT_SECONDS,
+        read=settings.HTTP_READ_TIMEOUT_SECONDS if read is None else read,
+        write=settings.HTTP_WRITE_TIMEOUT_SECONDS,
+        pool=settings.HTTP_POOL_TIMEOUT_SECONDS
+    )
+
+
+def _pool_connections(client: Optional[Any]) -> Optional[Dict[str, int]]:
+    """
+    Số kết nối đang mở / rảnh của pool. httpx không công khai trạng thái này nên phải đọc từ httpcore;
+    nếu cấu trúc nội bộ thay đổi thì trả về None thay vì làm hỏng endpoint thống kê.
+    """
+    if client is None:
+        return None
+    try:
+        transport = client._transport
+        connections = list(getattr(transport, "wrapped", transport)._pool.connections)
+        idle = sum(1 for conn in connections if conn.is_idle())
+    except Exception:
+        return None
+    return {"open": len(connections), "idle": idle, "active": len(connections) - idle}
+
+
+class _RetryingTransport(httpx.BaseTransport):
+    """
+    Transport của client đồng bộ: supabase-py tự gửi request nên không đi qua `HttpPool.request`,
+    thử lại được đặt ở tầng transport với cùng chính sách (chỉ lời gọi đọc, cùng lỗi / mã trạng thái, cùng backoff).
+    """
+    def __init__(self, pool: "HttpPool", wrapped: httpx.HTTPTransport):
+        self.pool = pool
+        self.wrapped = wrapped
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        attempts = self.pool.retry_attempts if request.method.upper() in IDEMPOTENT_METHODS else 1
+        for attempt in range(attempts):
+            self.pool._begin()
+            try:
+                response = self.wrapped.handle_request(request)
+            except (httpx.TransportError, httpx.TimeoutException) as e:
+                if attempt + 1 >= attempts:
+                    self.pool._count("failed")
+                    raise
+                logger.warning(f"{request.method} {request.url} failed ({type(e).__name__}: {e}), retrying ({attempt + 1}/{attempts - 1}).")
+            else:
+                if response.status_code not in RETRYABLE_STATUS_CODES or attempt + 1 >= attempts:
+                    return response
+                response.close()
+                logger.warning(f"{request.method} {request.url} returned {response.status_code}, retrying ({attempt + 1}/{attempts - 1}).")
+            finally:
+                self.pool._end()
+            self.pool._count("retries")
+            time.sleep(self.pool._backoff(attempt))
+        raise RuntimeError("unreachable")
+
+    def close(self) -> None:
+        self.wrapped.close()
+
+
+class HttpPool:
+    """
+    Client được tạo khi dùng lần đầu. `request`/`get` (async) và mọi request của client đồng bộ thử lại lời gọi
+    đọc (GET/HEAD/OPTIONS) khi lỗi mạng, timeout hoặc 429/502/503/504, chờ theo backoff luỹ thừa có jitter
+    ngẫu nhiên; lời gọi ghi không thử lại.
+    """
+    def __init__(self, retry_attempts: int, retry_backoff: float, retry_max_backoff: float):
+        self.retry_attempts = max(retry_attempts, 1)
+        self.retry_backoff = retry_backoff
+        self.retry_max_backoff = retry_max_backoff
+        self.http2 = http2_available()
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._sync_client: Optional[httpx.Client] = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._counters: Dict[str, int] = {
+            "requests": 0, "retries": 0, "failed": 0, "peak_in_flight": 0
+        }
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(limits=_limits(), timeout=_timeout(), http2=self.http2)
+            logger.info(f"Async HTTP pool started (http2={self.http2}, max_connections={settings.HTTP_MAX_CONNECTIONS}).")
+        return self._async_client
+
+    @property
+    def sync_client(self) -> httpx.Client:
+        """Client đồng bộ dùng chung cho supabase-py (thread-safe, dùng từ các thread của upstream executor)."""
+        if self._sync_client is None:
+            with self._lock:
+                if self._sync_client is None:
+                    transport = _RetryingTransport(self, httpx.HTTPTransport(limits=_limits(), http2=self.http2))
+                    self._sync_client = httpx.Client(transport=transport, timeout=_timeout(), follow_redirects=True)
+                    logger.info(f"Sync HTTP pool started (http2={self.http2}, max_connections={settings.HTTP_MAX_CONNECTIONS}).")
+        return self._sync_client
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter: tránh các request lỗi cùng lúc thử lại cùng một thời điểm
+        return random.uniform(0, min(self.retry_max_backoff, self.retry_backoff * (2 ** attempt)))
+
+    def _begin(self) -> None:
+        with self._lock:
+            self._in_flight += 1
+            self._counters["requests"] += 1
+            self._counters["peak_in_flight"] = max(self._counters["peak_in_flight"], self._in_flight)
+
+    def _end(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    async def request(self, method: str, url: str, *, timeout: Optional[float] = None, **kwargs: Any) -> httpx.Response:
+        """Gửi request qua pool. `timeout` (giây) ghi đè timeout đọc mặc định cho riêng lời gọi này."""
+        if timeout is not None:
+            kwargs["timeout"] = _timeout(read=timeout)
+        attempts = self.retry_attempts if method.upper() in IDEMPOTENT_METHODS else 1
+        for attempt in range(attempts):
+            self._begin()
+            try:
+                response = await self.async_client.request(method, url, **kwargs)
+            except (httpx.TransportError, httpx.TimeoutException) as e:
+                if attempt + 1 >= attempts:
+                    self._count("failed")
+                    raise
+                logger.warning(f"{method} {url} failed ({type(e).__name__}: {e}), retrying ({attempt + 1}/{attempts - 1}).")
+            else:
+                if response.status_code not in RETRYABLE_STATUS_CODES or attempt + 1 >= attempts:
+                    return response
+                await response.aclose()
+                logger.warning(f"{method} {url} returned {response.status_code}, retrying ({attempt + 1}/{attempts - 1}).")
+            finally:
+                self._end()
+            self._count("retries")
+            await asyncio.sleep(self._backoff(attempt))
+        raise RuntimeError("unreachable")
+
+    async def get(self, url: str, **kwargs: Any) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters, in_flight=self._in_flight)
+        return {
+            "http2": self.http2,
+            "max_connections": settings.HTTP_MAX_CONNECTIONS,
+            "max_keepalive_connections": settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            "keepalive_expiry_seconds": settings.HTTP_KEEPALIVE_EXPIRY_SECONDS,
+            "retry_attempts": self.retry_attempts,
+            **counters,
+            "async_connections": _pool_connections(self._async_client),
+            "sync_connections": _pool_connections(self._sync_client)
+        }
+
+    async def aclose(self) -> None:
+        with self._lock:
+            async_client, self._async_client = self._async_client, None
+            sync_client, self._sync_client = self._sync_client, None
+        # Các client supabase-py đã cache giữ sync_client: bỏ chúng để lần dùng sau tạo lại trên client mới
+        get_supabase_client.cache_clear()
+        get_stock_supabase_client.cache_clear()
+        if async_client is not None:
+            await async_client.aclose()
+        if sync_client is not None:
+            sync_client.close()
+        logger.info("HTTP pool closed.")
+
+
+http_pool = HttpPool(
+    retry_attempts=settings.HTTP_RETRY_ATTEMPTS,
+    retry_backoff=settings.HTTP_RETRY_BACKOFF_SECONDS,
+    retry_max_backoff=settings.HTTP_RETRY_MAX_BACKOFF_SECONDS
+)
+
+def get_http_pool() -> HttpPool:
+    return http_pool
@@ -0,0 +1,237 @@
+# app/services/indicator_service.py
+"""
+Chỉ báo kỹ thuật (SMA, EMA, RSI, MACD, Bollinger, ATR) tính bằng NumPy trên lịch sử OHLCV đã cache.
+Kết quả được cache theo (kind, symbol, indicator, tham số); khi chuỗi có nến mới chỉ tính phần nến mới
+từ trạng thái đã lưu (giá trị làm mượt cuối, cửa sổ giá cuối) thay vì tính lại toàn bộ.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from app.config import settings
+from app.services.history_cache import OhlcvSeries, OhlcvSnapshot
+from app.services.chart_service import to_json_list
+
+logger = logging.getLogger(__name__)
+
+Columns = Dict[str, np.ndarray]
+State = Dict[str, Any]
+# fn(cột của các nến mới, tham số, trạng thái trước đó hoặc None = tính toàn bộ) -> (kết quả cho các nến đó, trạng thái mới)
+IndicatorFunc = Callable[[Columns, Dict[str, float], Optional[State]], Tuple[Columns, State]]
+
+
+# ==== HÀM CƠ SỞ ====
+def _rolling(values: np.ndarray, window: int, tail: np.ndarray, reducer: Callable[..., np.ndarray]) -> np.ndarray:
+    """Giá trị cửa sổ trượt cho `values`, dùng `tail` (tối đa window-1 giá trị ngay trước đó) làm phần đầu cửa sổ."""
+    data = np.concatenate([tail, values])
+    out = np.full(len(data), np.nan)
+    if len(data) >= window:
+        out[window - 1:] = reducer(sliding_window_view(data, window), axis=1)
+    return out[len(tail):]
+
+
+def _ewm(values: np.ndarray, alpha: float, prev: Optional[float] = None) -> np.ndarray:
+    """Làm mượt hàm mũ y_t = alpha*x_t + (1-alpha)*y_{t-1}; không có `prev` thì khởi đầu bằng giá trị đầu tiên."""
+    if prev is None:
+        return pd.Series(values).ewm(alpha=alpha, adjust=False).mean().to_numpy()
+    return pd.Series(np.concatenate([[prev], values])).ewm(alpha=alpha, adjust=False).mean().to_numpy()[1:]
+
+
+def _mask_warmup(values: np.ndarray, start_index: int, warmup: int) -> np.ndarray:
+    """Đặt NaN cho các vị trí (theo chỉ số toàn chuỗi) chưa đủ `warmup` nến."""
+    masked = int(np.clip(warmup - start_index, 0, len(values)))
+    if masked:
+        values[:masked] = np.nan
+    return values
+
+
+def _window_tail(values: np.ndarray, window: int, state: Optional[State]) -> Tuple[np.ndarray, np.ndarray]:
+    tail = state['tail'] if state else np.empty(0)
+    keep = max(window - 1, 0)
+    combined = np.concatenate([tail, values])
+    return tail, combined[-keep:] if keep else combined[:0]
+
+
+# ==== CHỈ BÁO ====
+def _sma(cols: Columns, params: Dict[str, float], state: Optional[State]) -> Tuple[Columns, State]:
+    window = int(params['window'])
+    tail, new_tail = _window_tail(cols['close'], window, state)
+    return {'sma': _rolling(cols['close'], window, tail, np.mean)}, {'tail': new_tail}
+
+
+def _bollinger(cols: Columns, params: Dict[str, float], state: Optional[State]) -> Tuple[Columns, State]:
+    window, k = int(params['window']), float(params['k'])
+    tail, new_tail = _window_tail(cols['close'], window, state)
+    middle = _rolling(cols['close'], window, tail, np.mean)
+    std = _rolling(cols['close'], window, tail, np.std)
+    return {'middle': middle, 'upper': middle + k * std, 'lower': middle - k * std}, {'tail': new_tail}
+
+
+def _ema(cols: Columns, params: Dict[str, float], state: Optional[State]) -> Tuple[Columns, State]:
+    window = int(params['window'])
+    count = state['count'] if state else 0
+    ema = _ewm(cols['close'], 2.0 / (window + 1), state['ema'] if state else None)
+    new_state = {'ema': ema[-1], 'count': count + len(ema)}
+    return {'ema': _mask_warmup(ema.copy(), count, window - 1)}, new_state
+
+
+def _macd(cols: Columns, params: Dict[str, float], state: Optional[State]) -> Tuple[Columns, State]:
+    fast, slow, signal = int(params['fast']), int(params['slow']), int(params['signal'])
+    count = state['count'] if state else 0
+    ema_fast = _ewm(cols['close'], 2.0 / (fast + 1), state['fast'] if state else None)
+    ema_slow = _ewm(cols['close'], 2.0 / (slow + 1), state['slow'] if state else None)
+    macd = ema_fast - ema_slow
+    signal_line = _ewm(macd, 2.0 / (signal + 1), state['signal'] if state else None)
+    new_state = {'fast': ema_fast[-1], 'slow': ema_slow[-1], 'signal': signal_line[-1], 'count': count + len(macd)}
+    histogram = macd - signal_line
+    return {
+        'macd': _mask_warmup(macd, count, slow - 1),
+        'signal': _mask_warmup(signal_line.copy(), count, slow + signal - 2),
+        'histogram': _mask_warmup(histogram, count, slow + signal - 2)
+    }, new_state
+
+
+def _rsi(cols: Columns, params: Dict[str, float], state: Optional[State]) -> Tuple[Columns, State]:
+    window = int(params['window'])
+    close = cols['close']
+    count = state['count'] if state else 0
+    previous = np.concatenate([[state['close']] if state else [np.nan], close[:-1]])
+    change = close - previous
+    if not state:
+        # Nến đầu tiên chưa có thay đổi giá: bắt đầu làm mượt từ nến thứ hai
+        change = change[1:]
+    gain, loss = np.clip(change, 0, None), np.clip(-change, 0, None)
+    avg_gain = _ewm(gain, 1.0 / window, state['gain'] if state else None)
+    avg_loss = _ewm(loss, 1.0 / window, state['loss'] if state else None)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsi = np.where(avg_loss == 0, 100.0, 100.0 - 100.0 / (1.0 + avg_gain / avg_loss))
+    if not state:
+        rsi = np.concatenate([[np.nan], rsi])
+    new_state = {'close': close[-1], 'gain': avg_gain[-1], 'loss': avg_loss[-1], 'count': count + len(close)} if len(avg_gain) else None
+    return {'rsi': _mask_warmup(rsi, count, window)}, new_state
+
+
+def _atr(cols: Columns, params: Dict[str, float], state: Optional[State]) -> Tuple[Columns, State]:
+    window = int(params['window'])
+    high, low, close = cols['high'], cols['low'], cols['close']
+    count = state['count'] if state else 0
+    previous = np.concatenate([[state['close']] if state else [np.nan], close[:-1]])
+    true_range = np.fmax(high - low, np.fmax(np.abs(high - previous), np.abs(low - previous)))
+    atr = _ewm(true_range, 1.0 / window, state['atr'] if state else None)
+    new_state = {'close': close[-1], 'atr': atr[-1], 'count': count + len(close)}
+    return {'atr': _mask_warmup(atr.copy(), count, window - 1)}, new_state
+
+
+@dataclass(frozen=True)
+class IndicatorSpec:
+    func: IndicatorFunc
+    defaults: Dict[str, float]
+    columns: Tuple[str, ...] = ('close',)
+
+
+INDICATORS: Dict[str, IndicatorSpec] = {
+    'sma': IndicatorSpec(_sma, {'window': 20}),
+    'ema': IndicatorSpec(_ema, {'window': 20}),
+    'rsi': IndicatorSpec(_rsi, {'window': 14}),
+    'macd': IndicatorSpec(_macd, {'fast': 12, 'slow': 26, 'signal': 9}),
+    'bollinger': IndicatorSpec(_bollinger, {'window': 20, 'k': 2.0}),
+    'atr': IndicatorSpec(_atr, {'window': 14}, ('high', 'low', 'close')),
+}
+
+
+def resolve_params(indicator: str, overrides: Dict[str, Optional[float]]) -> Dict[str, float]:
+    """Tham số đầy đủ của chỉ báo (mặc định + giá trị truyền vào). Ném ValueError nếu không hợp lệ."""
+    spec = INDICATORS.get(indicator)
+    if spec is None:
+        raise ValueError(f"Unknown indicator '{indicator}'. Supported: {sorted(INDICATORS)}")
+    params = dict(spec.defaults)
+    for name, value in overrides.items():
+        if value is None:
+            continue
+        if name not in params:
+            raise ValueError(f"Indicator '{indicator}' does not accept parameter '{name}'")
+        params[name] = value
+    for name, value in params.items():
+        if name == 'k':
+            continue
+        if value != int(value) or value < 1:
+            raise ValueError(f"Parameter '{name}' must be a positive integer")
+        params[name] = int(value)
+    if indicator == 'macd' and params['fast'] >= params['slow']:
+        raise ValueError("MACD 'fast' must be smaller than 'slow'")
+    return params
+
+
+@dataclass
+class _CachedIndicator:
+    series: OhlcvSeries
+    size: int
+    version: int
+    outputs: Columns
+    state: Optional[State]
+
+
+class IndicatorEngine:
+    """Cache kết quả theo (kind, symbol, indicator, tham số), tối đa `max_entries` mục (bỏ mục ít dùng nhất)."""
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[Tuple[str, str, str, Tuple[Tuple[str, float], ...]], _CachedIndicator]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def compute(self, kind: str, symbol: str, series: OhlcvSeries, indicator: str, params: Dict[str, float]) -> Columns:
+        return self._compute(kind, symbol, series, series.snapshot(), indicator, params)
+
+    def _compute(self, kind: str, symbol: str, series: OhlcvSeries, snapshot: OhlcvSnapshot,
+                 indicator: str, params: Dict[str, float]) -> Columns:
+        spec = INDICATORS[indicator]
+        key = (kind, symbol, indicator, tuple(sorted(params.items())))
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+            size, version = snapshot.size, snapshot.version
+            if cached is not None and cached.series is series and cached.version == version:
+                return cached.outputs
+            # Chỉ tính tiếp từ trạng thái đã lưu khi các nến đã tính không bị ghi đè (phiên cuối được cập nhật)
+            if cached is not None and cached.series is series and cached.state is not None and 0 < cached.size < size \
+                    and cached.version >= snapshot.rewritten_version:
+                new_cols = {name: snapshot.column(name)[cached.size:] for name in spec.columns}
+                outputs, state = spec.func(new_cols, params, cached.state)
+                outputs = {name: np.concatenate([cached.outputs[name], values]) for name, values in outputs.items()}
+                logger.debug(f"Indicator {indicator}{params} for {kind}:{symbol} updated with {size - cached.size} new bars.")
+            else:
+                if size == 0:
+                    return {}
+                outputs, state = spec.func({name: snapshot.column(name) for name in spec.columns}, params, None)
+                logger.debug(f"Indicator {indicator}{params} for {kind}:{symbol} computed over {size} bars.")
+            self._cache[key] = _CachedIndicator(series, size, version, outputs, state)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+            return outputs
+
+    def get_indicator(self, kind: str, symbol: str, series: OhlcvSeries, indicator: str,
+                      params: Dict[str, float], limit: Optional[int] = None) -> Dict[str, Any]:
+        snapshot = series.snapshot()
+        outputs = self._compute(kind, symbol, series, snapshot, indicator, params)
+        size = len(next(iter(outputs.values()))) if outputs else 0
+        start = max(size - limit, 0) if limit else 0
+        return {
+            "kind": kind,
+            "symbol": symbol,
+            "indicator": indicator,
+            "params": params,
+            "time": np.datetime_as_string(snapshot.time[start:size], unit='D').tolist(),
+            **{name: to_json_list(values[start:]) for name, values in outputs.items()}
+        }
+
+
+indicator_engine = IndicatorEngine(settings.INDICATOR_CACHE_MAX_ENTRIES)
+def get_indicator_engine() -> IndicatorEngine:
+    return indicator_engine
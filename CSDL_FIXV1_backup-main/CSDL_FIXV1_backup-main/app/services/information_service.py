@@ -1,96 +1,276 @@
+import json
 import logging
+from bisect import bisect_left
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
+
+import pandas as pd
+
 from app.models.information import client, HEADERS, SUPABASE_URL
+from app.config import settings
+from app.services.query_service import aiter_rest_pages, aiter_in_chunks
+from app.services.catalog_service import reference_catalog
 from fastapi.templating import Jinja2Templates
 
 
 
 logger = logging.getLogger(__name__)
 
+# stocks / report_types / line_items được phục vụ từ catalog trong bộ nhớ (xem catalog_service.py)
 async def get_all_stocks():
-    res = await client.get(f"{SUPABASE_URL}/rest/v1/stocks", headers=HEADERS)
-    return res.json()
+    return (await reference_catalog.ensure_loaded()).stocks
 
 async def get_all_report_types():
-    res = await client.get(f"{SUPABASE_URL}/rest/v1/report_types", headers=HEADERS)
-    return res.json()
+    return (await reference_catalog.ensure_loaded()).report_types
 
 async def get_line_items_by_report_type(report_type_id: int):
-    res = await client.get(
-        f"{SUPABASE_URL}/rest/v1/line_items?report_type_id=eq.{report_type_id}",
-        headers=HEADERS
-    )
-    return res.json()
-
-async def fetch_financial_data(symbol: str, report_type_id: int, period: str):
-    # Get stock_id
-    stock_res = await client.get(
-        f"{SUPABASE_URL}/rest/v1/stocks?symbol=eq.{symbol}", headers=HEADERS
-    )
-    stock_data = stock_res.json()
-    if not stock_data:
+    return (await reference_catalog.ensure_loaded()).line_items_by_report_type.get(report_type_id, [])
+
+FORMAT_RECORDS = "records"
+FORMAT_COMPACT = "compact"
+FINANCIAL_DATA_FORMATS = (FORMAT_RECORDS, FORMAT_COMPACT)
+FINANCIAL_DATA_YEARS = range(2020, 2025)
+QUARTERS = ("Q1", "Q2", "Q3", "Q4")
+# Giá trị `symbols` đại diện cho toàn bộ settings.BANK_SYMBOLS
+ALL_BANKS = "banks"
+
+
+def _period_columns(period: str, years: range = FINANCIAL_DATA_YEARS) -> List[str]:
+    if period == "quarterly":
+        return [f"{y}{q}" for y in years for q in QUARTERS]
+    return [str(y) for y in years]
+
+
+def _financial_data_params(report_type_id: int, period: str, years: range, select: str) -> Dict[str, str]:
+    """Tham số PostgREST cho financial_data lọc theo kỳ báo cáo qua embedded inner join financial_reports."""
+    params = {
+        "select": select,
+        "financial_reports.report_type_id": f"eq.{report_type_id}",
+        "financial_reports.year": f"in.({','.join(map(str, years))})"
+    }
+    if period == "quarterly":
+        params["financial_reports.quarter"] = f"in.({','.join(QUARTERS)})"
+    return params
+
+
+def _collect(columns: Dict[str, list], page: List[Dict[str, Any]]) -> None:
+    """Gom một trang kết quả (đã embed financial_reports) theo cột, để xoay một lần bằng pandas."""
+    for fd in page:
+        report = fd['financial_reports']
+        for name, values in columns.items():
+            values.append(fd[name] if name in fd else report[name])
+
+
+def _period_frame(columns: Dict[str, list], period: str) -> pd.DataFrame:
+    df = pd.DataFrame(columns)
+    df['period'] = df['year'].astype(str)
+    if period == "quarterly":
+        df['period'] += df['quarter']
+    df['value'] = pd.to_numeric(df['value'], errors='coerce')
+    return df
+
+
+def _pivot_financial_data(columns: Dict[str, list], line_item_id_to_name: Dict[int, str], period: str,
+                          years: range = FINANCIAL_DATA_YEARS) -> pd.DataFrame:
+    """Xoay (line_item, kỳ, value) thành bảng chỉ tiêu × kỳ; thứ tự chỉ tiêu theo lần xuất hiện đầu tiên, trùng ô thì lấy giá trị sau cùng."""
+    df = _period_frame(columns, period)
+    df['item'] = df['line_item_id'].map(line_item_id_to_name).fillna("Unknown")
+    table = df.drop_duplicates(['item', 'period'], keep='last').pivot(index='item', columns='period', values='value')
+    return table.reindex(index=pd.unique(df['item']), columns=_period_columns(period, years))
+
+
+def _json_values(table: pd.DataFrame) -> List[List[Any]]:
+    return table.astype(object).where(table.notna(), None).to_numpy().tolist()
+
+
+def _to_records(table: pd.DataFrame) -> List[Dict[str, Any]]:
+    return [{"item": item, **dict(zip(table.columns, row))} for item, row in zip(table.index, _json_values(table))]
+
+
+def _to_compact(table: pd.DataFrame, period: str) -> Dict[str, Any]:
+    return {
+        "period": period,
+        "columns": list(table.columns),
+        "items": list(table.index),
+        "values": _json_values(table)
+    }
+
+
+def financial_year_range(year_from: Optional[int], year_to: Optional[int]) -> range:
+    """Khoảng năm [year_from, year_to] (mặc định 2020–2024). Ném ValueError nếu ngược hoặc dài quá FINANCIAL_DATA_MAX_YEARS."""
+    year_from = FINANCIAL_DATA_YEARS.start if year_from is None else year_from
+    year_to = FINANCIAL_DATA_YEARS.stop - 1 if year_to is None else year_to
+    if year_from > year_to:
+        raise ValueError("year_from must not be greater than year_to")
+    if year_to - year_from + 1 > settings.FINANCIAL_DATA_MAX_YEARS:
+        raise ValueError(f"At most {settings.FINANCIAL_DATA_MAX_YEARS} years per request")
+    return range(year_from, year_to + 1)
+
+
+def _stock_data_params(stock_id: int, report_type_id: int, period: str, years: range) -> Dict[str, str]:
+    # financial_reports -> financial_data trong một truy vấn: lọc kỳ báo cáo qua embedded inner join
+    params = _financial_data_params(report_type_id, period, years, "line_item_id,value,financial_reports!inner(year,quarter)")
+    params["financial_reports.stock_id"] = f"eq.{stock_id}"
+    return params
+
+
+def _empty_columns() -> Dict[str, list]:
+    return {"line_item_id": [], "value": [], "year": [], "quarter": []}
+
+
+async def resolve_stock_id(symbol: str) -> Optional[int]:
+    stock_id = (await reference_catalog.ensure_loaded()).stock_id_by_symbol.get(symbol)
+    if stock_id is None:
         logger.error(f"Symbol {symbol} not found")
+    return stock_id
+
+
+async def fetch_financial_data(symbol: str, report_type_id: int, period: str, format: str = FORMAT_RECORDS,
+                               year_from: Optional[int] = None, year_to: Optional[int] = None):
+    """
+    Bảng báo cáo tài chính chỉ tiêu × kỳ của một mã, cho các năm [year_from, year_to] (mặc định 2020–2024).
+    `format="records"`: mỗi chỉ tiêu một object {"item", "<kỳ>": value, ...} (dạng trang information dùng).
+    `format="compact"`: {"columns": [kỳ...], "items": [chỉ tiêu...], "values": [[...], ...]} — tên kỳ chỉ gửi một lần, ô trống là null.
+    """
+    try:
+        years = financial_year_range(year_from, year_to)
+    except ValueError as e:
+        return {"error": str(e)}
+    stock_id = await resolve_stock_id(symbol)
+    if stock_id is None:
         return {"error": "Symbol not found"}
-    stock_id = stock_data[0]['stock_id']
-
-    # Get line items
-    li_res = await client.get(
-        f"{SUPABASE_URL}/rest/v1/line_items?report_type_id=eq.{report_type_id}",
-        headers=HEADERS
-    )
-    line_items = li_res.json()
-    line_item_id_to_name = {li['line_item_id']: li['line_item_name'] for li in line_items}
-
-    # Conditions
-    year_condition = "&year=gte.2020&year=lte.2024"
-    quarter_condition = "&quarter=in.(Q1,Q2,Q3,Q4)" if period == "quarterly" else ""
-
-    # Get financial_reports
-    query_url = (
-        f"{SUPABASE_URL}/rest/v1/financial_reports"
-        f"?stock_id=eq.{stock_id}&report_type_id=eq.{report_type_id}"
-        f"{year_condition}{quarter_condition}"
-    )
-    fr_res = await client.get(query_url, headers=HEADERS)
-    reports = fr_res.json()
-    if not reports:
+
+    columns = _empty_columns()
+    async for page in aiter_rest_pages(
+        client,
+        f"{SUPABASE_URL}/rest/v1/financial_data",
+        params=_stock_data_params(stock_id, report_type_id, period, years),
+        headers=HEADERS,
+        order="report_id.asc,line_item_id.asc"
+    ):
+        _collect(columns, page)
+    if not columns['line_item_id']:
         return {"error": "No reports found"}
 
-    report_id_to_time = {
-        r['report_id']: f"{r['year']}Q{r['quarter'][1]}" if period == "quarterly" else str(r['year'])
-        for r in reports
-    }
+    catalog = await reference_catalog.ensure_loaded()
+    table = _pivot_financial_data(columns, catalog.line_item_name_by_id, period, years)
+    if format == FORMAT_COMPACT:
+        return _to_compact(table, period)
+    return _to_records(table)
 
-    report_ids = [r['report_id'] for r in reports]
-    report_ids_str = ','.join(map(str, report_ids))
-
-    # Get financial_data
-    fd_res = await client.get(
-        f"{SUPABASE_URL}/rest/v1/financial_data?report_id=in.({report_ids_str})",
-        headers=HEADERS
-    )
-    financial_data = fd_res.json()
-
-    # Merge data
-    result = {}
-    for fd in financial_data:
-        line_item = line_item_id_to_name.get(fd['line_item_id'], "Unknown")
-        time_key = report_id_to_time.get(fd['report_id'])
-        if not time_key:
-            continue
-        result.setdefault(line_item, {})[time_key] = fd['value']
-
-    # Format response
-    response = []
-    for item, values in result.items():
-        row = {"item": item}
-        if period == "yearly":
-            for y in range(2020, 2025):
-                row[str(y)] = values.get(str(y))
-        else:
-            for y in range(2020, 2025):
-                for q in range(1, 5):
-                    key = f"{y}Q{q}"
-                    row[key] = values.get(key)
-        response.append(row)
 
-    return response
+def _ndjson(rows: Iterable[Any]) -> bytes:
+    return "".join(json.dumps(row, ensure_ascii=False, separators=(',', ':')) + "\n" for row in rows).encode('utf-8')
+
+
+async def stream_financial_data(stock_id: int, report_type_id: int, period: str, years: range,
+                                format: str = FORMAT_RECORDS) -> AsyncIterator[bytes]:
+    """
+    Như fetch_financial_data nhưng phát NDJSON trong lúc đọc: dữ liệu được sắp theo line_item_id nên mỗi
+    trang đọc xong thì các chỉ tiêu đã đủ kỳ được xoay và gửi ngay; chỉ giữ lại chỉ tiêu cuối trang (có thể
+    còn tiếp ở trang sau), bộ nhớ không tăng theo độ dài khoảng năm.
+    `format="records"`: mỗi dòng một object như dạng records. `format="compact"`: dòng đầu
+    {"period", "columns"}, các dòng sau {"item", "values"}.
+    Thứ tự chỉ tiêu theo line_item_id (không theo thứ tự xuất hiện như fetch_financial_data).
+    """
+    catalog = await reference_catalog.ensure_loaded()
+    names = catalog.line_item_name_by_id
+
+    def encode(columns: Dict[str, list]) -> bytes:
+        if not columns['line_item_id']:
+            return b""
+        table = _pivot_financial_data(columns, names, period, years)
+        if format == FORMAT_COMPACT:
+            return _ndjson({"item": item, "values": row} for item, row in zip(table.index, _json_values(table)))
+        return _ndjson(_to_records(table))
+
+    if format == FORMAT_COMPACT:
+        yield _ndjson([{"period": period, "columns": _period_columns(period, years)}])
+    pending = _empty_columns()
+    row_count = 0
+    async for page in aiter_rest_pages(
+        client,
+        f"{SUPABASE_URL}/rest/v1/financial_data",
+        params=_stock_data_params(stock_id, report_type_id, period, years),
+        headers=HEADERS,
+        order="line_item_id.asc,report_id.asc"
+    ):
+        row_count += len(page)
+        _collect(pending, page)
+        # Chỉ tiêu cuối trang có thể còn dữ liệu ở trang sau: giữ lại, gửi phần trước nó
+        split = bisect_left(pending['line_item_id'], pending['line_item_id'][-1])
+        complete = {name: values[:split] for name, values in pending.items()}
+        pending = {name: values[split:] for name, values in pending.items()}
+        chunk = encode(complete)
+        if chunk:
+            yield chunk
+    chunk = encode(pending)
+    if chunk:
+        yield chunk
+    logger.debug(f"Streamed financial data for stock {stock_id}: {row_count} rows over {len(years)} years.")
+
+
+async def fetch_financial_comparison(symbols: List[str], report_type_id: int, line_item_ids: List[int],
+                                     period: str, year_from: int, year_to: int) -> Dict[str, Any]:
+    """
+    So sánh các chỉ tiêu giữa nhiều mã: mỗi line item một ma trận mã × kỳ (ô trống là null).
+    `symbols=["banks"]` = toàn bộ BANK_SYMBOLS. Mã được tra trong catalog; dữ liệu của mọi mã
+    được đọc bằng một truy vấn embedded join (chia lô theo stock_id nếu danh sách mã lớn).
+    """
+    try:
+        years = financial_year_range(year_from, year_to)
+    except ValueError as e:
+        return {"error": str(e)}
+    if not line_item_ids:
+        return {"error": "At least one line item is required"}
+    if symbols == [ALL_BANKS]:
+        symbols = list(settings.BANK_SYMBOLS)
+    catalog = await reference_catalog.ensure_loaded()
+    symbols = list(dict.fromkeys(symbols))
+    missing = [s for s in symbols if s not in catalog.stock_id_by_symbol]
+    symbols = [s for s in symbols if s in catalog.stock_id_by_symbol]
+    if not symbols:
+        logger.error(f"None of the symbols {missing} were found")
+        return {"error": "Symbol not found", "missing_symbols": missing}
+    stock_ids = [catalog.stock_id_by_symbol[s] for s in symbols]
+    line_item_ids = list(dict.fromkeys(line_item_ids))
+
+    params = _financial_data_params(report_type_id, period, years,
+                                    "line_item_id,value,financial_reports!inner(stock_id,year,quarter)")
+    params["line_item_id"] = f"in.({','.join(map(str, line_item_ids))})"
+
+    columns: Dict[str, list] = {"stock_id": [], "line_item_id": [], "value": [], "year": [], "quarter": []}
+    async for rows in aiter_in_chunks(
+        client,
+        f"{SUPABASE_URL}/rest/v1/financial_data",
+        params=params,
+        headers=HEADERS,
+        column="financial_reports.stock_id",
+        ids=stock_ids,
+        order="report_id.asc,line_item_id.asc"
+    ):
+        _collect(columns, rows)
+
+    period_columns = _period_columns(period, years)
+    df = _period_frame(columns, period)
+    df['symbol'] = df['stock_id'].map(dict(zip(stock_ids, symbols)))
+    df = df.drop_duplicates(['line_item_id', 'symbol', 'period'], keep='last')
+    groups = dict(tuple(df.groupby('line_item_id'))) if len(df) else {}
+    line_items = []
+    for line_item_id in line_item_ids:
+        group = groups.get(line_item_id)
+        if group is None:
+            table = pd.DataFrame(index=symbols, columns=period_columns, dtype=float)
+        else:
+            table = group.pivot(index='symbol', columns='period', values='value').reindex(index=symbols, columns=period_columns)
+        line_items.append({
+            "line_item_id": line_item_id,
+            "item": catalog.line_item_name_by_id.get(line_item_id, "Unknown"),
+            "values": _json_values(table)
+        })
+    return {
+        "period": period,
+        "columns": period_columns,
+        "symbols": symbols,
+        "missing_symbols": missing,
+        "line_items": line_items
+    }
@@ -0,0 +1,169 @@
+# app/services/ingestion_scheduler.py
+"""
+Scheduler chạy nền các job đồng bộ vnstock -> Supabase (chỉ số, giá cổ phiếu) theo lịch giao dịch,
+để các API đọc chỉ phục vụ dữ liệu đã lưu.
+"""
+import asyncio
+import logging
+from datetime import datetime, time, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Việt Nam không đổi giờ mùa hè, nên dùng offset cố định UTC+7
+VN_TZ = timezone(timedelta(hours=7))
+TRADING_SESSION_START = time(9, 0)
+TRADING_SESSION_END = time(15, 0)
+
+
+def vn_now() -> datetime:
+    return datetime.now(VN_TZ)
+
+
+def is_trading_day(moment: datetime) -> bool:
+    return moment.weekday() < 5 and moment.strftime('%Y-%m-%d') not in settings.MARKET_HOLIDAYS
+
+
+def is_trading_hours(moment: datetime) -> bool:
+    return is_trading_day(moment) and TRADING_SESSION_START <= moment.time() <= TRADING_SESSION_END
+
+
+class IngestionJob:
+    """
+    Một job đồng bộ. `func` là coroutine function; lock bảo đảm tại một thời điểm chỉ có một lần chạy.
+    Trong giờ giao dịch chạy theo `trading_interval` (và một lần ngay sau giờ đóng cửa), ngoài giờ theo `off_hours_interval`;
+    ngày nghỉ chỉ chạy nếu từ lúc khởi động chưa chạy thành công lần nào.
+    """
+    def __init__(self, name: str, func: Callable[[], Awaitable[Any]], trading_interval: float, off_hours_interval: float):
+        self.name = name
+        self.func = func
+        self.trading_interval = trading_interval
+        self.off_hours_interval = off_hours_interval
+        self.lock = asyncio.Lock()
+        self.last_started_at: Optional[datetime] = None
+        self.last_success_at: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+        self.last_result: Any = None
+        self.run_count = 0
+        self.failure_count = 0
+
+    def next_delay(self, moment: datetime) -> float:
+        if not is_trading_hours(moment):
+            return self.off_hours_interval
+        # Không chờ qua giờ đóng cửa quá INGESTION_POST_CLOSE_DELAY_SECONDS: lần chạy đó ghi đè nến của phiên bằng giá đóng cửa
+        closing_run = datetime.combine(moment.date(), TRADING_SESSION_END, moment.tzinfo) \
+            + timedelta(seconds=settings.INGESTION_POST_CLOSE_DELAY_SECONDS)
+        return min(self.trading_interval, max((closing_run - moment).total_seconds(), 1.0))
+
+    def should_run(self, moment: datetime) -> bool:
+        return is_trading_day(moment) or self.last_success_at is None
+
+    def status(self) -> Dict[str, Any]:
+        def iso(value: Optional[datetime]) -> Optional[str]:
+            return value.isoformat(timespec='seconds') if value else None
+        return {
+            "name": self.name,
+            "running": self.lock.locked(),
+            "last_started_at": iso(self.last_started_at),
+            "last_success_at": iso(self.last_success_at),
+            "last_error": self.last_error,
+            "last_result": self.last_result,
+            "run_count": self.run_count,
+            "failure_count": self.failure_count,
+            "trading_interval_seconds": self.trading_interval,
+            "off_hours_interval_seconds": self.off_hours_interval
+        }
+
+
+class IngestionScheduler:
+    def __init__(self):
+        self._jobs: Dict[str, IngestionJob] = {}
+        self._tasks: List[asyncio.Task] = []
+        # Các lần chạy thủ công: giữ tham chiếu để task không bị GC giữa chừng và được huỷ khi stop()
+        self._manual_runs: Dict[str, asyncio.Task] = {}
+
+    def register(self, job: IngestionJob) -> None:
+        self._jobs[job.name] = job
+
+    @property
+    def jobs(self) -> Dict[str, IngestionJob]:
+        return self._jobs
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        logger.info(f"Starting ingestion scheduler with jobs: {list(self._jobs)}")
+        self._tasks = [asyncio.create_task(self._job_loop(job)) for job in self._jobs.values()]
+
+    async def stop(self) -> None:
+        tasks, self._tasks = self._tasks + list(self._manual_runs.values()), []
+        self._manual_runs.clear()
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+            logger.info("Ingestion scheduler stopped.")
+
+    async def run_job(self, name: str) -> bool:
+        """Chạy job ngay. Trả về False nếu job đang chạy (bỏ qua, không xếp hàng)."""
+        job = self._jobs[name]
+        if job.lock.locked():
+            logger.info(f"Ingestion job '{name}' is already running. Skipping.")
+            return False
+        async with job.lock:
+            job.last_started_at = vn_now()
+            job.run_count += 1
+            try:
+                job.last_result = await job.func()
+                job.last_success_at = vn_now()
+                job.last_error = None
+                logger.info(f"Ingestion job '{name}' finished: {job.last_result}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                job.failure_count += 1
+                job.last_error = str(e)
+                logger.error(f"Ingestion job '{name}' failed: {e}", exc_info=True)
+        return True
+
+    def trigger(self, name: str) -> bool:
+        """Chạy job ngay ở nền (không chờ). Trả về False nếu job đang chạy."""
+        if self._jobs[name].lock.locked() or name in self._manual_runs:
+            return False
+        task = asyncio.create_task(self.run_job(name))
+        self._manual_runs[name] = task
+        task.add_done_callback(lambda done: self._on_manual_run_done(name, done))
+        return True
+
+    def _on_manual_run_done(self, name: str, task: asyncio.Task) -> None:
+        if self._manual_runs.get(name) is task:
+            del self._manual_runs[name]
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Manual run of ingestion job '{name}' failed: {task.exception()}", exc_info=task.exception())
+
+    async def _job_loop(self, job: IngestionJob) -> None:
+        await asyncio.sleep(settings.INGESTION_STARTUP_DELAY_SECONDS)
+        while True:
+            moment = vn_now()
+            if job.should_run(moment):
+                await self.run_job(job.name)
+            else:
+                logger.debug(f"Ingestion job '{job.name}' skipped: {moment.date()} is not a trading day.")
+            await asyncio.sleep(job.next_delay(vn_now()))
+
+    def status(self) -> Dict[str, Any]:
+        moment = vn_now()
+        return {
+            "running": bool(self._tasks),
+            "now": moment.isoformat(timespec='seconds'),
+            "trading_day": is_trading_day(moment),
+            "trading_hours": is_trading_hours(moment),
+            "jobs": [job.status() for job in self._jobs.values()]
+        }
+
+
+ingestion_scheduler = IngestionScheduler()
+def get_ingestion_scheduler() -> IngestionScheduler:
+    return ingestion_scheduler
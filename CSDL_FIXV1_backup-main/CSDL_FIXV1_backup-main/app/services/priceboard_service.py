@@ -0,0 +1,471 @@
+# app/services/priceboard_service.py
+"""
+Bảng giá realtime: một producer dùng chung poll vnstock và phát snapshot cho mọi client /ws/stock-updates
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from app.config import settings
+from app.models.tong_quan_model import StockModel
+from app.services.upstream_executor import run_upstream, UpstreamError
+from app.services.tick_history_service import TickHistoryStore, get_tick_history_store
+
+logger = logging.getLogger(__name__)
+
+# Giao thức của websocket: "full" gửi nguyên danh sách mỗi lần có thay đổi (như cũ),
+# "delta" gửi snapshot kèm seq khi kết nối, sau đó chỉ gửi các trường thay đổi theo từng mã.
+PROTOCOL_FULL = "full"
+PROTOCOL_DELTA = "delta"
+SUPPORTED_PROTOCOLS = (PROTOCOL_FULL, PROTOCOL_DELTA)
+ALL_SYMBOLS = "*"
+
+# Item trong outbox của subscriber: (tick, changes, removed). changes/removed = None nghĩa là dùng nguyên tick
+# (client nhận mọi mã); ngược lại là phần đã lọc theo watchlist của client.
+QueueItem = Tuple["PriceBoardTick", Optional[Dict[str, Dict[str, Any]]], Optional[List[str]]]
+
+
+class PriceBoardTick:
+    """
+    Một lần poll có thay đổi: snapshot đầy đủ, các trường thay đổi theo mã so với tick trước và các mã bị mất.
+    Frame JSON được encode một lần rồi dùng chung cho mọi client.
+    """
+    __slots__ = ('seq', 'ts', 'records', 'board', 'positions', 'changes', 'removed', '_encoded')
+
+    def __init__(self, seq: int, records: List[Dict[str, Any]], changes: Dict[str, Dict[str, Any]], removed: List[str]):
+        self.seq = seq
+        self.ts = time.time()
+        self.records = records
+        self.board = {record['symbol']: record for record in records if record.get('symbol')}
+        self.positions = {symbol: i for i, symbol in enumerate(self.board)}
+        self.changes = changes
+        self.removed = removed
+        self._encoded: Dict[str, str] = {}
+
+    def records_for(self, symbols: Set[str]) -> List[Dict[str, Any]]:
+        watched = [symbol for symbol in symbols if symbol in self.board]
+        watched.sort(key=self.positions.__getitem__)
+        return [self.board[symbol] for symbol in watched]
+
+    def encode(self, kind: str) -> str:
+        text = self._encoded.get(kind)
+        if text is None:
+            if kind == "full":
+                payload: Any = self.records
+            elif kind == "snapshot":
+                payload = {"type": "snapshot", "seq": self.seq, "data": self.records}
+            else:
+                payload = {"type": "delta", "seq": self.seq, "prev_seq": self.seq - 1, "changes": self.changes, "removed": self.removed}
+            text = encode_frame(payload)
+            self._encoded[kind] = text
+        return text
+
+
+def encode_frame(payload: Any) -> str:
+    return json.dumps(payload, separators=(',', ':'), ensure_ascii=False)
+
+
+def normalize_symbols(raw: Union[str, Iterable[str], None]) -> Optional[Set[str]]:
+    """
+    Chuẩn hoá danh sách mã client gửi lên ("VCB,BID" hoặc ["vcb", "bid"]). "*" nghĩa là mọi mã (trả về None).
+    """
+    if raw is None:
+        return set()
+    if isinstance(raw, str):
+        raw = raw.split(",")
+    symbols = {str(symbol).strip().upper() for symbol in raw if str(symbol).strip()}
+    if ALL_SYMBOLS in symbols:
+        return None
+    return symbols
+
+
+def compute_price_board_changes(
+    previous: Dict[str, Dict[str, Any]],
+    current: Dict[str, Dict[str, Any]]
+) -> Tuple[Dict[str, Dict[str, Any]], List[str]]:
+    """
+    So sánh hai bảng giá (symbol -> record). Trả về các trường thay đổi theo mã và danh sách mã bị mất.
+    """
+    changes: Dict[str, Dict[str, Any]] = {}
+    for symbol, record in current.items():
+        prior = previous.get(symbol)
+        if prior is None:
+            diff = {k: v for k, v in record.items() if k != 'symbol'}
+        else:
+            diff = {k: v for k, v in record.items() if k != 'symbol' and prior.get(k) != v}
+        if diff:
+            changes[symbol] = diff
+    removed = [symbol for symbol in previous if symbol not in current]
+    return changes, removed
+
+
+class PriceBoardOutbox:
+    """
+    Hàng đợi gửi có giới hạn của một kết nối. Khi đầy, bỏ toàn bộ item đang chờ và chỉ giữ item mới nhất,
+    nên bộ nhớ cho mỗi client luôn bị chặn bởi `maxsize` dù client chậm tới đâu.
+    """
+    def __init__(self, maxsize: int):
+        self.maxsize = max(1, maxsize)
+        self._items: Deque[Any] = deque()
+        self._event = asyncio.Event()
+        self.closed = False
+        self.dropped = 0
+
+    def qsize(self) -> int:
+        return len(self._items)
+
+    def put_nowait(self, item: Any) -> bool:
+        """Trả về False nếu outbox tràn và các item cũ đã bị bỏ."""
+        if self.closed:
+            return True
+        overflowed = len(self._items) >= self.maxsize
+        if overflowed:
+            self.dropped += len(self._items)
+            self._items.clear()
+        self._items.append(item)
+        self._event.set()
+        return not overflowed
+
+    async def get(self) -> Any:
+        """Trả về None khi outbox đã đóng (client ngắt kết nối hoặc bị loại)."""
+        while not self._items:
+            if self.closed:
+                return None
+            self._event.clear()
+            await self._event.wait()
+        if self.closed:
+            return None
+        return self._items.popleft()
+
+    def close(self) -> None:
+        self.closed = True
+        self._items.clear()
+        self._event.set()
+
+
+class PriceBoardSubscriber:
+    """
+    Một kết nối websocket đang nhận bảng giá. Producer đẩy tick vào outbox,
+    handler của websocket lấy ra, render theo giao thức và watchlist của client rồi gửi đi.
+    `symbols` = None nghĩa là client nhận mọi mã (frame dùng chung, encode một lần).
+    """
+    def __init__(
+        self,
+        client_label: str,
+        protocol: str = PROTOCOL_FULL,
+        symbols: Optional[Set[str]] = None,
+        outbox_size: int = 4
+    ):
+        self.client_label = client_label
+        self.protocol = protocol
+        self.symbols = symbols
+        self.last_seq: Optional[int] = None
+        self.outbox = PriceBoardOutbox(outbox_size)
+        self.connected_at = time.monotonic()
+        self.last_sent_at: Optional[float] = None
+        self.sent_seq: Optional[int] = None
+        self.sent_frames = 0
+        # Số lần outbox tràn liên tiếp kể từ lần gửi thành công gần nhất
+        self.consecutive_overflows = 0
+        self.evicted = False
+
+    def deliver(self, item: Any) -> None:
+        if not self.outbox.put_nowait(item):
+            # Đã bỏ frame: delta kế tiếp không còn nối tiếp được, phải gửi lại snapshot
+            self.last_seq = None
+            self.consecutive_overflows += 1
+
+    def mark_sent(self) -> None:
+        self.last_sent_at = time.monotonic()
+        self.sent_seq = self.last_seq if self.last_seq is not None else self.sent_seq
+        self.sent_frames += 1
+        self.consecutive_overflows = 0
+
+    def stats(self, current_seq: int) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "client": self.client_label,
+            "protocol": self.protocol,
+            "watchlist_size": len(self.symbols) if self.symbols is not None else None,
+            "queued_frames": self.outbox.qsize(),
+            "sent_frames": self.sent_frames,
+            "dropped_frames": self.outbox.dropped,
+            "consecutive_overflows": self.consecutive_overflows,
+            "lag_ticks": current_seq - self.sent_seq if self.sent_seq is not None else None,
+            "seconds_since_last_send": round(now - self.last_sent_at, 3) if self.last_sent_at is not None else None,
+            "connected_seconds": round(now - self.connected_at, 3)
+        }
+
+    def render(
+        self,
+        tick: PriceBoardTick,
+        changes: Optional[Dict[str, Dict[str, Any]]] = None,
+        removed: Optional[List[str]] = None
+    ) -> Optional[str]:
+        if self.last_seq is not None and tick.seq <= self.last_seq:
+            return None
+        if self.symbols is None:
+            if self.protocol == PROTOCOL_FULL:
+                text = tick.encode("full")
+            elif self.last_seq is None or tick.seq != self.last_seq + 1:
+                text = tick.encode("snapshot")
+            else:
+                text = tick.encode("delta")
+        elif self.protocol == PROTOCOL_FULL:
+            text = encode_frame(tick.records_for(self.symbols))
+        elif self.last_seq is None or changes is None:
+            text = encode_frame({"type": "snapshot", "seq": tick.seq, "data": tick.records_for(self.symbols)})
+        else:
+            # Client chỉ nhận tick có mã mình theo dõi, nên prev_seq là seq đã gửi gần nhất chứ không phải seq - 1
+            text = encode_frame({
+                "type": "delta", "seq": tick.seq, "prev_seq": self.last_seq,
+                "changes": changes, "removed": removed or []
+            })
+        self.last_seq = tick.seq
+        return text
+
+
+class PriceBoardBroadcaster:
+    """
+    Poll `StockModel.fetch_stock_data()` đúng một lần mỗi chu kỳ, bất kể số client.
+    Producer tự khởi động khi có subscriber đầu tiên và dừng khi subscriber cuối cùng rời đi.
+    """
+    def __init__(
+        self,
+        stock_model: Optional[StockModel] = None,
+        interval_seconds: Optional[float] = None,
+        tick_history: Optional[TickHistoryStore] = None
+    ):
+        self._stock_model = stock_model
+        self.tick_history = tick_history if tick_history is not None else get_tick_history_store()
+        self.interval_seconds = interval_seconds if interval_seconds is not None else \
+            getattr(settings, 'WEBSOCKET_STOCK_INTERVAL_SECONDS', 10)
+        self._subscribers: Set[PriceBoardSubscriber] = set()
+        # Subscriber nhận mọi mã, và index mã -> các subscriber có mã đó trong watchlist
+        self._unfiltered_subscribers: Set[PriceBoardSubscriber] = set()
+        self._symbol_index: Dict[str, Set[PriceBoardSubscriber]] = {}
+        self.max_symbols_per_client = getattr(settings, 'WEBSOCKET_MAX_SYMBOLS_PER_CLIENT', 1000)
+        self.outbox_size = getattr(settings, 'WEBSOCKET_OUTBOX_SIZE', 4)
+        self.max_consecutive_overflows = getattr(settings, 'WEBSOCKET_MAX_CONSECUTIVE_OVERFLOWS', 3)
+        self.evicted_count = 0
+        # Frame đã bỏ của các kết nối đã đóng; cộng với số của kết nối đang mở để ra tổng
+        self._closed_dropped_frames = 0
+        self._producer_task: Optional[asyncio.Task] = None
+        self._board: Dict[str, Dict[str, Any]] = {}
+        self._seq = 0
+        self.latest_tick: Optional[PriceBoardTick] = None
+        self.poll_count = 0
+
+    @property
+    def latest_snapshot(self) -> Optional[List[Dict[str, Any]]]:
+        return self.latest_tick.records if self.latest_tick is not None else None
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    @property
+    def is_running(self) -> bool:
+        return self._producer_task is not None and not self._producer_task.done()
+
+    def _fetch_snapshot(self):
+        # Chạy trên upstream executor: cả khởi tạo Vnstock lẫn price_board đều blocking
+        if self._stock_model is None:
+            self._stock_model = StockModel()
+        return self._stock_model.fetch_stock_data()
+
+    async def subscribe(
+        self,
+        client_label: str,
+        protocol: str = PROTOCOL_FULL,
+        symbols: Optional[Set[str]] = None
+    ) -> PriceBoardSubscriber:
+        subscriber = PriceBoardSubscriber(client_label, protocol, outbox_size=self.outbox_size)
+        self._set_watchlist(subscriber, symbols)
+        self._subscribers.add(subscriber)
+        if self.latest_tick is not None:
+            subscriber.deliver((self.latest_tick, None, None))
+        if not self.is_running:
+            logger.info(f"Starting shared price board producer (first subscriber: {client_label}).")
+            self._producer_task = asyncio.create_task(self._run_producer())
+        logger.info(f"Price board subscriber added: {client_label}. Total subscribers: {self.subscriber_count}")
+        return subscriber
+
+    async def unsubscribe(self, subscriber: PriceBoardSubscriber) -> None:
+        if subscriber not in self._subscribers:
+            return
+        self._subscribers.discard(subscriber)
+        self._unindex(subscriber)
+        subscriber.outbox.close()
+        self._closed_dropped_frames += subscriber.outbox.dropped
+        logger.info(f"Price board subscriber removed: {subscriber.client_label}. Total subscribers: {self.subscriber_count}")
+        if not self._subscribers:
+            await self.stop()
+
+    def request_resync(self, subscriber: PriceBoardSubscriber) -> None:
+        """
+        Client phát hiện hụt seq: lần gửi kế tiếp sẽ là snapshot đầy đủ.
+        """
+        logger.info(f"Resync requested by {subscriber.client_label} (last_seq={subscriber.last_seq}).")
+        subscriber.last_seq = None
+        if self.latest_tick is not None:
+            subscriber.deliver((self.latest_tick, None, None))
+
+    def add_symbols(self, subscriber: PriceBoardSubscriber, symbols: Optional[Set[str]]) -> None:
+        if symbols is None or subscriber.symbols is None:
+            # Lần subscribe đầu tiên thu hẹp từ "mọi mã" về đúng watchlist được gửi lên
+            watchlist = symbols
+        else:
+            watchlist = subscriber.symbols | symbols
+        self._set_watchlist(subscriber, watchlist)
+        self.request_resync(subscriber)
+
+    def remove_symbols(self, subscriber: PriceBoardSubscriber, symbols: Optional[Set[str]]) -> None:
+        if symbols is None:
+            # Bỏ "mọi mã" sẽ để lại watchlist trống: client vẫn kết nối nhưng không nhận frame nào nữa
+            raise ValueError("'unsubscribe' does not accept \"*\"; list the symbols to remove")
+        if subscriber.symbols is None:
+            watchlist = set(self._board) - symbols
+        else:
+            watchlist = subscriber.symbols - symbols
+        self._set_watchlist(subscriber, watchlist)
+        self.request_resync(subscriber)
+
+    def _set_watchlist(self, subscriber: PriceBoardSubscriber, symbols: Optional[Set[str]]) -> None:
+        if symbols is not None and len(symbols) > self.max_symbols_per_client:
+            raise ValueError(f"Watchlist too large: {len(symbols)} symbols (max {self.max_symbols_per_client}).")
+        self._unindex(subscriber)
+        subscriber.symbols = symbols
+        if symbols is None:
+            self._unfiltered_subscribers.add(subscriber)
+            return
+        for symbol in symbols:
+            self._symbol_index.setdefault(symbol, set()).add(subscriber)
+        logger.debug(f"Watchlist of {subscriber.client_label} set to {len(symbols)} symbols.")
+
+    def _unindex(self, subscriber: PriceBoardSubscriber) -> None:
+        if subscriber.symbols is None:
+            self._unfiltered_subscribers.discard(subscriber)
+            return
+        for symbol in subscriber.symbols:
+            watchers = self._symbol_index.get(symbol)
+            if watchers is not None:
+                watchers.discard(subscriber)
+                if not watchers:
+                    del self._symbol_index[symbol]
+
+    async def stop(self) -> None:
+        task = self._producer_task
+        self._producer_task = None
+        self._board = {}
+        self.latest_tick = None
+        if task is None or task.done():
+            return
+        logger.info("Stopping shared price board producer.")
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Price board producer exited with error during stop: {e}", exc_info=True)
+
+    def stats(self) -> Dict[str, Any]:
+        current_seq = self.latest_tick.seq if self.latest_tick is not None else self._seq
+        connections = [subscriber.stats(current_seq) for subscriber in self._subscribers]
+        return {
+            "running": self.is_running,
+            "seq": current_seq,
+            "poll_count": self.poll_count,
+            "subscriber_count": self.subscriber_count,
+            "evicted_count": self.evicted_count,
+            "dropped_frames_total": self._closed_dropped_frames + sum(c["dropped_frames"] for c in connections),
+            "connections": connections
+        }
+
+    def _deliver(self, subscriber: PriceBoardSubscriber, item: Any) -> None:
+        subscriber.deliver(item)
+        if subscriber.consecutive_overflows > self.max_consecutive_overflows and not subscriber.evicted:
+            # Client tụt lại quá lâu: đóng outbox, handler sẽ ngắt kết nối
+            logger.warning(f"Evicting slow price board consumer {subscriber.client_label} "
+                           f"({subscriber.consecutive_overflows} consecutive overflows, {subscriber.outbox.dropped} frames dropped).")
+            subscriber.evicted = True
+            subscriber.outbox.close()
+            self.evicted_count += 1
+
+    def _publish_error(self, error: Dict[str, Any]) -> None:
+        for subscriber in list(self._subscribers):
+            self._deliver(subscriber, error)
+
+    def _publish_tick(self, tick: PriceBoardTick) -> None:
+        # Chỉ duyệt các mã thay đổi và người đang theo dõi chúng: chi phí tỉ lệ với watchlist, không với cả universe
+        changes_by_subscriber: Dict[PriceBoardSubscriber, Dict[str, Dict[str, Any]]] = {}
+        removed_by_subscriber: Dict[PriceBoardSubscriber, List[str]] = {}
+        for symbol, diff in tick.changes.items():
+            for subscriber in self._symbol_index.get(symbol, ()):
+                changes_by_subscriber.setdefault(subscriber, {})[symbol] = diff
+        for symbol in tick.removed:
+            for subscriber in self._symbol_index.get(symbol, ()):
+                removed_by_subscriber.setdefault(subscriber, []).append(symbol)
+        for subscriber in list(self._unfiltered_subscribers):
+            self._deliver(subscriber, (tick, None, None))
+        for subscriber in changes_by_subscriber.keys() | removed_by_subscriber.keys():
+            self._deliver(subscriber, (
+                tick,
+                changes_by_subscriber.get(subscriber, {}),
+                removed_by_subscriber.get(subscriber, [])
+            ))
+
+    def _apply_snapshot(self, records: List[Dict[str, Any]]) -> Optional[PriceBoardTick]:
+        board = {record['symbol']: record for record in records if record.get('symbol')}
+        changes, removed = compute_price_board_changes(self._board, board)
+        if self.latest_tick is not None and not changes and not removed:
+            return None
+        self._board = board
+        self._seq += 1
+        self.latest_tick = PriceBoardTick(self._seq, records, changes, removed)
+        # Chỉ ghi tick cho các mã có thay đổi
+        self.tick_history.record(self._seq, self.latest_tick.ts, (board[symbol] for symbol in changes))
+        return self.latest_tick
+
+    async def _run_producer(self) -> None:
+        logger.info(f"Price board producer running every {self.interval_seconds}s.")
+        try:
+            while self._subscribers:
+                try:
+                    try:
+                        data = await run_upstream(self._fetch_snapshot)
+                    except UpstreamError as e:
+                        data = {"error": str(e)}
+                    self.poll_count += 1
+                    if data is None:
+                        logger.warning("StockModel returned None. Nothing to broadcast this tick.")
+                    elif isinstance(data, list) and not data:
+                        logger.info("StockModel returned empty list. Nothing to broadcast this tick.")
+                    elif isinstance(data, dict):
+                        logger.warning(f"Error fetching stock data from model: {data.get('error')}. Broadcasting to {self.subscriber_count} subscribers.")
+                        self._publish_error(data)
+                    else:
+                        tick = self._apply_snapshot(data)
+                        if tick is None:
+                            logger.debug("Price board unchanged since last tick. Nothing to broadcast.")
+                        else:
+                            self._publish_tick(tick)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Unexpected error in price board producer: {e}", exc_info=True)
+                await asyncio.sleep(self.interval_seconds)
+        except asyncio.CancelledError:
+            logger.info("Price board producer cancelled.")
+            raise
+        finally:
+            logger.info(f"Price board producer stopped after {self.poll_count} polls.")
+
+
+price_board_broadcaster = PriceBoardBroadcaster()
+def get_price_board_broadcaster() -> PriceBoardBroadcaster:
+    return price_board_broadcaster
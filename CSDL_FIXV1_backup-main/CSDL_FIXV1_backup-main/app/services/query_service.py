@@ -0,0 +1,195 @@
+# app/services/query_service.py
+"""
+Đọc bảng lớn từ Supabase/PostgREST theo trang, trả về generator từng lô dòng.
+Một `.execute()` không có range sẽ bị cắt ở giới hạn max-rows của PostgREST (mặc định 1000 dòng) mà không báo lỗi.
+Danh sách id lớn cho bộ lọc `in` được chia thành các lô có giới hạn và chạy song song (iter_in_chunks / aiter_in_chunks).
+"""
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, TypeVar
+
+import pandas as pd
+
+from app.config import settings
+from app.services.http_pool import HttpPool
+
+logger = logging.getLogger(__name__)
+
+Row = Dict[str, Any]
+T = TypeVar("T")
+
+
+def iter_pages(
+    build_query: Callable[[], Any],
+    keyset: Optional[str] = None,
+    desc: bool = False,
+    after: Any = None,
+    page_size: Optional[int] = None
+) -> Iterator[List[Row]]:
+    """
+    Duyệt kết quả của một query supabase-py theo trang.
+
+    `build_query()` phải trả về builder mới đã có select + filter (chưa order/range).
+    - Có `keyset`: phân trang theo khoá (cột duy nhất, có index), mỗi trang lọc `keyset > giá trị cuối`
+      (hoặc `<` khi desc). `after` là mốc bắt đầu (không bao gồm). Không lệch trang khi bảng đang được ghi thêm.
+    - Không có `keyset`: phân trang theo range offset; khi đó builder phải tự order theo cột ổn định.
+    `page_size` không được lớn hơn max-rows của PostgREST, nếu không trang ngắn sẽ bị hiểu là trang cuối.
+    """
+    size = page_size or settings.SUPABASE_PAGE_SIZE
+    page_count = 0
+    if keyset is not None:
+        last = after
+        while True:
+            query = build_query()
+            if last is not None:
+                query = query.lt(keyset, last) if desc else query.gt(keyset, last)
+            rows = query.order(keyset, desc=desc).limit(size).execute().data or []
+            if rows:
+                page_count += 1
+                yield rows
+            if len(rows) < size:
+                break
+            last = rows[-1][keyset]
+    else:
+        offset = 0
+        while True:
+            rows = build_query().range(offset, offset + size - 1).execute().data or []
+            if rows:
+                page_count += 1
+                yield rows
+            if len(rows) < size:
+                break
+            offset += size
+    logger.debug(f"Paginated read finished after {page_count} pages (page_size={size}).")
+
+
+def iter_rows(build_query: Callable[[], Any], **kwargs: Any) -> Iterator[Row]:
+    for page in iter_pages(build_query, **kwargs):
+        yield from page
+
+
+def read_frame(build_query: Callable[[], Any], **kwargs: Any) -> pd.DataFrame:
+    """Đọc hết các trang vào một DataFrame (mỗi trang được chuyển thành DataFrame rồi nối một lần)."""
+    frames = [pd.DataFrame(page) for page in iter_pages(build_query, **kwargs)]
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+
+async def aiter_rest_pages(
+    client: HttpPool,
+    url: str,
+    params: Dict[str, Any],
+    headers: Dict[str, str],
+    order: str,
+    page_size: Optional[int] = None
+) -> AsyncIterator[List[Row]]:
+    """
+    Phiên bản async cho truy vấn PostgREST trực tiếp qua HTTP pool: phân trang bằng limit/offset
+    với `order` cố định (vd: "report_id.asc,line_item_id.asc").
+    """
+    size = page_size or settings.SUPABASE_PAGE_SIZE
+    offset = 0
+    while True:
+        page_params = {**params, "order": order, "limit": size, "offset": offset}
+        res = await client.get(url, params=page_params, headers=headers)
+        res.raise_for_status()
+        rows = res.json()
+        if rows:
+            yield rows
+        if len(rows) < size:
+            break
+        offset += size
+
+
+# ==== BỘ LỌC `in` THEO LÔ ====
+def chunk_ids(ids: Iterable[Any], chunk_size: Optional[int] = None) -> List[List[Any]]:
+    """Bỏ trùng, sắp xếp và chia id thành các lô, để URL `in.(...)` luôn nằm dưới giới hạn độ dài của PostgREST/proxy."""
+    size = chunk_size or settings.SUPABASE_IN_CHUNK_SIZE
+    unique = sorted(set(ids))
+    return [unique[i:i + size] for i in range(0, len(unique), size)]
+
+
+_chunk_executor: Optional[ThreadPoolExecutor] = None
+_chunk_executor_lock = threading.Lock()
+
+def _get_chunk_executor() -> ThreadPoolExecutor:
+    # Pool riêng: các lô được gửi từ bên trong upstream executor, dùng chung pool đó có thể tự chặn lẫn nhau
+    global _chunk_executor
+    if _chunk_executor is None:
+        with _chunk_executor_lock:
+            if _chunk_executor is None:
+                _chunk_executor = ThreadPoolExecutor(max_workers=settings.SUPABASE_IN_MAX_CONCURRENCY, thread_name_prefix="supabase-in")
+    return _chunk_executor
+
+
+def iter_in_chunks(
+    build_query: Callable[[], Any],
+    column: str,
+    ids: Iterable[Any],
+    chunk_size: Optional[int] = None,
+    **page_kwargs: Any
+) -> Iterator[List[Row]]:
+    """
+    Chạy `build_query().in_(column, lô)` cho từng lô id (tối đa SUPABASE_IN_MAX_CONCURRENCY lô cùng lúc),
+    mỗi lô được đọc theo trang như iter_pages. Trả về các dòng theo từng lô, theo thứ tự lô hoàn thành.
+    """
+    chunks = chunk_ids(ids, chunk_size)
+    if not chunks:
+        return
+    def read_chunk(chunk: List[Any]) -> List[Row]:
+        return [row for page in iter_pages(lambda: build_query().in_(column, chunk), **page_kwargs) for row in page]
+    if len(chunks) == 1:
+        yield read_chunk(chunks[0])
+        return
+    logger.debug(f"Reading {len(chunks)} chunks of '{column}' ids.")
+    futures = [_get_chunk_executor().submit(read_chunk, chunk) for chunk in chunks]
+    try:
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def map_concurrent(func: Callable[[Any], T], items: Iterable[Any]) -> List[T]:
+    """Gọi `func` cho từng phần tử trên pool của các lô `in` (tối đa SUPABASE_IN_MAX_CONCURRENCY cùng lúc), giữ nguyên thứ tự."""
+    items = list(items)
+    if len(items) <= 1:
+        return [func(item) for item in items]
+    futures = [_get_chunk_executor().submit(func, item) for item in items]
+    try:
+        return [future.result() for future in futures]
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+async def aiter_in_chunks(
+    client: HttpPool,
+    url: str,
+    params: Dict[str, Any],
+    headers: Dict[str, str],
+    column: str,
+    ids: Iterable[Any],
+    order: str,
+    chunk_size: Optional[int] = None
+) -> AsyncIterator[List[Row]]:
+    """Phiên bản async của iter_in_chunks cho truy vấn PostgREST qua HTTP pool (giới hạn đồng thời bằng semaphore)."""
+    chunks = chunk_ids(ids, chunk_size)
+    if not chunks:
+        return
+    semaphore = asyncio.Semaphore(settings.SUPABASE_IN_MAX_CONCURRENCY)
+    async def read_chunk(chunk: List[Any]) -> List[Row]:
+        async with semaphore:
+            chunk_params = {**params, column: f"in.({','.join(map(str, chunk))})"}
+            return [row async for page in aiter_rest_pages(client, url, chunk_params, headers, order) for row in page]
+    tasks = [asyncio.create_task(read_chunk(chunk)) for chunk in chunks]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,164 @@
+# app/services/result_cache.py
+"""
+Cache kết quả trong bộ nhớ cho các truy vấn tổng hợp ít thay đổi (số liệu báo cáo tài chính theo quý),
+kèm hook invalidation theo tag: khi có báo cáo mới được nạp, gọi `invalidate_tag(TAG_FINANCIAL_REPORTS)`
+để xoá mọi cache phụ thuộc và chạy lại các hook làm ấm.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TAG_FINANCIAL_REPORTS = "financial_reports"
+
+_MISSING = object()
+
+
+class ResultCache:
+    """
+    Map key -> giá trị, tuỳ chọn TTL và số mục tối đa (`max_entries`, bỏ mục ít dùng nhất).
+    `get_or_load` bảo đảm mỗi key chỉ có một lần nạp tại một thời điểm (các thread khác chờ kết quả
+    thay vì cùng gọi DB); kết quả của lần nạp bắt đầu trước một lần invalidate không được ghi vào cache.
+    """
+    def __init__(self, name: str, ttl_seconds: Optional[float] = None, tags: Iterable[str] = (),
+                 max_entries: Optional[int] = None):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        # Tăng mỗi lần invalidate; get_or_load so sánh trước / sau khi nạp để bỏ giá trị đã cũ
+        self._generation = 0
+        self._lock = threading.Lock()
+        # key -> [lock, số thread đang dùng]; xoá khi không còn ai chờ nên map không lớn dần theo số key
+        self._key_locks: Dict[Hashable, List[Any]] = {}
+        self.hits = 0
+        self.misses = 0
+        for tag in tags:
+            register_invalidation_hook(tag, self.invalidate)
+
+    def _is_fresh(self, stored_at: float) -> bool:
+        return self.ttl_seconds is None or time.monotonic() - stored_at < self.ttl_seconds
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._is_fresh(entry[0]):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+        return default
+
+    @property
+    def generation(self) -> int:
+        with self._lock:
+            return self._generation
+
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None) -> bool:
+        """Ghi giá trị; có `generation` (đọc trước khi nạp) thì bỏ qua nếu cache đã bị invalidate từ đó. Trả về True nếu đã ghi."""
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return False
+            self._store(key, value)
+            return True
+
+    def _store(self, key: Hashable, value: Any) -> None:
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while self.max_entries is not None and len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            key_lock[1] += 1
+        try:
+            with key_lock[0]:
+                value = self.get(key, _MISSING)
+                if value is not _MISSING:
+                    return value
+                with self._lock:
+                    self.misses += 1
+                    generation = self._generation
+                value = loader()
+                if not self.set(key, value, generation):
+                    logger.info(f"Result cache '{self.name}' dropped a load of {key} that raced with an invalidation.")
+                return value
+        finally:
+            with self._lock:
+                key_lock[1] -= 1
+                if key_lock[1] == 0 and self._key_locks.get(key) is key_lock:
+                    del self._key_locks[key]
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+        logger.info(f"Result cache '{self.name}' invalidated{'' if key is None else f' for {key}'}.")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "name": self.name,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+class JsonPayload(NamedTuple):
+    """Kết quả đã serialize sẵn cùng ETag mạnh (hash nội dung), để trả thẳng và trả lời 304."""
+    body: bytes
+    etag: str
+
+
+def make_json_payload(data: Any) -> JsonPayload:
+    body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return JsonPayload(body, f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """So khớp If-None-Match (danh sách ETag hoặc "*"); theo RFC 9110 dùng so sánh yếu nên bỏ tiền tố W/."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*' or candidate.removeprefix('W/') == etag:
+            return True
+    return False
+
+
+# ==== HOOK INVALIDATION THEO TAG ====
+_hooks: Dict[str, List[Callable[[], Any]]] = {}
+_hooks_lock = threading.Lock()
+
+
+def register_invalidation_hook(tag: str, hook: Callable[[], Any]) -> None:
+    """Đăng ký hàm (không tham số) được gọi khi dữ liệu gắn `tag` thay đổi, theo thứ tự đăng ký."""
+    with _hooks_lock:
+        _hooks.setdefault(tag, []).append(hook)
+
+
+def invalidate_tag(tag: str) -> int:
+    """Gọi mọi hook của `tag`. Lỗi của một hook được log và không chặn các hook còn lại. Trả về số hook đã gọi."""
+    with _hooks_lock:
+        hooks = list(_hooks.get(tag, []))
+    for hook in hooks:
+        try:
+            hook()
+        except Exception as e:
+            logger.error(f"Invalidation hook {getattr(hook, '__qualname__', hook)} for '{tag}' failed: {e}", exc_info=True)
+    logger.info(f"Invalidated '{tag}': {len(hooks)} hooks called.")
+    return len(hooks)
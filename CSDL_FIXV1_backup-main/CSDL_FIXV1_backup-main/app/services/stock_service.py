@@ -0,0 +1,128 @@
+# app/services/stock_service.py
+"""
+Đồng bộ giá giao dịch theo ngày của các mã từ vnstock vào bảng 'transaction_price' (project Supabase của trang cổ phiếu)
+"""
+import logging
+import time
+from datetime import timedelta
+from typing import Dict, Iterable, Optional
+
+import pandas as pd
+from vnstock import Vnstock
+
+from app.config import get_stock_supabase_client, settings
+from app.services.history_cache import HistoryCache, OhlcvSeries
+from app.services.ingestion_scheduler import vn_now
+from app.services.query_service import read_frame
+
+logger = logging.getLogger(__name__)
+
+TRANSACTION_PRICE_COLUMNS = ['time', 'open', 'high', 'low', 'close', 'volume']
+
+# symbol -> stock_id, bảng 'stocks' gần như không đổi
+_stock_ids: Dict[str, int] = {}
+# symbol -> thời điểm tra không thấy; hỏi lại DB sau STOCK_ID_MISS_TTL_SECONDS
+_stock_id_misses: Dict[str, float] = {}
+
+
+def get_stock_id(symbol: str) -> Optional[int]:
+    stock_id = _stock_ids.get(symbol)
+    if stock_id is None:
+        missed_at = _stock_id_misses.get(symbol)
+        if missed_at is not None and time.monotonic() - missed_at < settings.STOCK_ID_MISS_TTL_SECONDS:
+            return None
+        stock_res = get_stock_supabase_client().table("stocks").select("stock_id").eq("symbol", symbol).limit(1).execute()
+        if not stock_res.data:
+            _stock_id_misses[symbol] = time.monotonic()
+            return None
+        _stock_id_misses.pop(symbol, None)
+        stock_id = _stock_ids[symbol] = stock_res.data[0]["stock_id"]
+    return stock_id
+
+
+def is_supported_stock(symbol: str) -> bool:
+    """Chỉ các mã ngân hàng được đồng bộ vào 'transaction_price'."""
+    return symbol in settings.BANK_SYMBOLS
+
+
+def sync_transaction_prices(symbol: str) -> int:
+    """
+    Ghi phiên cuối cùng đã có (có thể được lưu khi còn đang giao dịch) và các phiên mới hơn vào 'transaction_price'
+    cho một mã. Trả về số dòng đã ghi. Chỉ chạy trong ingestion scheduler (job có lock riêng), không nằm trên đường xử lý request.
+    """
+    stock_id = get_stock_id(symbol)
+    if stock_id is None:
+        logger.warning(f"Symbol {symbol} not found in 'stocks'. Skipping price sync.")
+        return 0
+
+    supabase = get_stock_supabase_client()
+    latest_res = supabase.table("transaction_price") \
+        .select("time") \
+        .eq("stock_id", stock_id) \
+        .order("time", desc=True) \
+        .limit(1) \
+        .execute()
+    if latest_res.data:
+        # Lấy lại cả phiên cuối đã lưu: nếu lần trước chạy trong phiên thì dòng đó mới là nến chưa đóng cửa
+        start_date = str(latest_res.data[0]["time"])[:10]
+    else:
+        start_date = (vn_now() - timedelta(days=settings.STOCK_SYNC_INITIAL_LOOKBACK_DAYS)).strftime('%Y-%m-%d')
+    today = vn_now().strftime('%Y-%m-%d')
+    df = Vnstock().stock(symbol=symbol, source='VCI').quote.history(start=start_date, end=today)
+    if df is None or df.empty:
+        logger.info(f"No prices from vnstock for {symbol} from {start_date} to {today}.")
+        return 0
+    if 'time' not in df.columns and isinstance(df.index, pd.DatetimeIndex):
+        df = df.reset_index()
+    df = df[[col for col in TRANSACTION_PRICE_COLUMNS if col in df.columns]].copy()
+    df['time'] = pd.to_datetime(df['time']).dt.strftime('%Y-%m-%d')
+    df = df[df['time'] >= start_date].drop_duplicates(subset='time', keep='last').sort_values('time')
+    if df.empty:
+        return 0
+    df.insert(0, 'stock_id', stock_id)
+    records = df.astype(object).where(pd.notnull(df), None).to_dict(orient='records')
+    # ON CONFLICT DO UPDATE: phiên đã có được ghi đè bằng số liệu mới nhất, lần chạy chồng nhau không tạo dòng trùng
+    response = supabase.table("transaction_price") \
+        .upsert(records, on_conflict="stock_id,time", ignore_duplicates=False) \
+        .execute()
+    saved = len(response.data) if response.data else 0
+    logger.info(f"Upserted {saved} price rows for {symbol} into 'transaction_price' ({start_date}..{records[-1]['time']}).")
+    return saved
+
+
+def sync_all_transaction_prices(symbols: Iterable[str]) -> Dict[str, int]:
+    results: Dict[str, int] = {}
+    failures: Dict[str, str] = {}
+    for symbol in symbols:
+        try:
+            results[symbol] = sync_transaction_prices(symbol)
+        except Exception as e:
+            logger.error(f"Price sync failed for {symbol}: {e}", exc_info=True)
+            failures[symbol] = str(e)
+    if failures:
+        raise RuntimeError(f"Price sync failed for {len(failures)} symbols: {failures}")
+    return results
+
+
+# ==== LỊCH SỬ GIÁ (đọc từ 'transaction_price') ====
+def _load_transaction_prices(symbol: str, after_date: Optional[str]) -> pd.DataFrame:
+    stock_id = get_stock_id(symbol)
+    if stock_id is None:
+        logger.warning(f"Symbol {symbol} not found in 'stocks'. No price history.")
+        return pd.DataFrame()
+    supabase = get_stock_supabase_client()
+    return read_frame(
+        lambda: supabase.table("transaction_price").select(", ".join(TRANSACTION_PRICE_COLUMNS)).eq("stock_id", stock_id),
+        keyset="time",
+        after=after_date
+    )
+
+
+# Lịch sử giá theo mã, nạp một lần rồi chỉ nối thêm các phiên mới
+stock_history_cache = HistoryCache(_load_transaction_prices, max_series=settings.HISTORY_CACHE_MAX_SERIES)
+
+def get_stock_history_series(symbol: str) -> Optional[OhlcvSeries]:
+    """Lịch sử đã cache của một mã; None nếu mã không được hỗ trợ (không nạp, không tạo entry cache)."""
+    if not is_supported_stock(symbol):
+        return None
+    return stock_history_cache.refresh(symbol)
@@ -0,0 +1,140 @@
+# app/services/tick_history_service.py
+"""
+Lưu các tick bảng giá trong phiên (giá, khối lượng, thay đổi, thời điểm) vào ring buffer NumPy theo từng mã,
+để client kết nối lại hoặc biểu đồ sparkline trong ngày có thể backfill mà không phải poll lại vnstock.
+"""
+import logging
+import threading
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from app.config import settings
+from app.services.ingestion_scheduler import VN_TZ
+
+logger = logging.getLogger(__name__)
+
+TICK_FIELDS = ('seq', 'ts', 'price', 'volume', 'price_change', 'percent_change')
+
+
+class SymbolTickBuffer:
+    """
+    Ring buffer kích thước cố định cho một mã: append O(1), bộ nhớ không đổi (~36 byte/tick).
+    Khi đầy, tick cũ nhất bị ghi đè. seq và ts tăng dần nên có thể tìm bằng searchsorted.
+    """
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.seq = np.zeros(capacity, dtype=np.int64)
+        self.ts = np.zeros(capacity, dtype=np.float64)
+        self.price = np.full(capacity, np.nan, dtype=np.float32)
+        self.volume = np.zeros(capacity, dtype=np.int64)
+        self.price_change = np.full(capacity, np.nan, dtype=np.float32)
+        self.percent_change = np.full(capacity, np.nan, dtype=np.float32)
+        self._head = 0  # vị trí sẽ ghi tiếp theo
+        self.count = 0
+
+    def append(self, seq: int, ts: float, price: Optional[float], volume: Optional[float],
+               price_change: Optional[float], percent_change: Optional[float]) -> None:
+        i = self._head
+        self.seq[i] = seq
+        self.ts[i] = ts
+        self.price[i] = np.nan if price is None else price
+        self.volume[i] = 0 if volume is None else volume
+        self.price_change[i] = np.nan if price_change is None else price_change
+        self.percent_change[i] = np.nan if percent_change is None else percent_change
+        self._head = (i + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def _segments(self) -> List[slice]:
+        # Thứ tự logic (cũ -> mới) gồm tối đa hai đoạn liên tiếp trong mảng vật lý
+        if self.count < self.capacity:
+            return [slice(0, self.count)]
+        return [slice(self._head, self.capacity), slice(0, self._head)]
+
+    def since(self, key: str, value: float) -> Dict[str, np.ndarray]:
+        """Các tick có `key` (seq hoặc ts) lớn hơn `value`, theo thứ tự thời gian."""
+        column = self.seq if key == 'seq' else self.ts
+        parts: List[slice] = []
+        for segment in self._segments():
+            start = int(np.searchsorted(column[segment], value, side='right'))
+            if segment.start + start < segment.stop:
+                parts.append(slice(segment.start + start, segment.stop))
+        result: Dict[str, np.ndarray] = {}
+        for field in TICK_FIELDS:
+            array = getattr(self, field)
+            result[field] = np.concatenate([array[part] for part in parts]) if parts else array[:0]
+        return result
+
+
+def _to_json_list(array: np.ndarray) -> List[Any]:
+    if array.dtype.kind == 'f':
+        values = array.astype(np.float64).round(4)
+        return [None if np.isnan(v) else float(v) for v in values]
+    return array.tolist()
+
+
+class TickHistoryStore:
+    """
+    Ring buffer của mọi mã trong phiên hiện tại. Sang ngày mới thì xoá toàn bộ và bắt đầu phiên mới.
+    """
+    def __init__(self, capacity_per_symbol: int):
+        self.capacity_per_symbol = capacity_per_symbol
+        self._buffers: Dict[str, SymbolTickBuffer] = {}
+        self._session_date: Optional[date] = None
+        self._lock = threading.Lock()
+
+    @property
+    def session_date(self) -> Optional[date]:
+        return self._session_date
+
+    def _roll_session(self, now: datetime) -> None:
+        if self._session_date != now.date():
+            if self._buffers:
+                logger.info(f"New trading session {now.date()}: clearing intraday tick history of {len(self._buffers)} symbols.")
+            self._buffers = {}
+            self._session_date = now.date()
+
+    def record(self, seq: int, ts: float, records: Iterable[Dict[str, Any]]) -> None:
+        with self._lock:
+            # Phiên theo ngày giờ Việt Nam, không theo múi giờ của server
+            self._roll_session(datetime.fromtimestamp(ts, VN_TZ))
+            for record in records:
+                symbol = record.get('symbol')
+                if not symbol:
+                    continue
+                buffer = self._buffers.get(symbol)
+                if buffer is None:
+                    buffer = self._buffers[symbol] = SymbolTickBuffer(self.capacity_per_symbol)
+                buffer.append(
+                    seq, ts,
+                    record.get('current_price'), record.get('volume'),
+                    record.get('price_change'), record.get('percent_change')
+                )
+
+    def get_history(self, symbols: Optional[Iterable[str]] = None, since_seq: Optional[int] = None,
+                    since_time: Optional[float] = None) -> Dict[str, Dict[str, List[Any]]]:
+        if since_time is not None:
+            key, value = 'ts', since_time
+        else:
+            key, value = 'seq', since_seq if since_seq is not None else -1
+        with self._lock:
+            selected = list(self._buffers) if symbols is None else [s for s in symbols if s in self._buffers]
+            slices = {symbol: self._buffers[symbol].since(key, value) for symbol in selected}
+        result: Dict[str, Dict[str, List[Any]]] = {}
+        for symbol, columns in slices.items():
+            result[symbol] = {
+                'seq': columns['seq'].tolist(),
+                'time': [datetime.fromtimestamp(t).isoformat(timespec='seconds') for t in columns['ts']],
+                'price': _to_json_list(columns['price']),
+                'volume': columns['volume'].tolist(),
+                'price_change': _to_json_list(columns['price_change']),
+                'percent_change': _to_json_list(columns['percent_change'])
+            }
+        return result
+
+
+tick_history_store = TickHistoryStore(getattr(settings, 'TICK_HISTORY_CAPACITY_PER_SYMBOL', 2048))
+def get_tick_history_store() -> TickHistoryStore:
+    return tick_history_store
@@ -5,92 +5,131 @@ Tổng hợp các service: tong_von_hoa_service.py, financial_service.py, index_
 # ==== IMPORT CHUNG ====
 from supabase import Client
 from fastapi import Depends, HTTPException
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
+from functools import lru_cache
+from dataclasses import dataclass
+import asyncio
 import logging
+import time
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 from starlette.websockets import WebSocketState
 from fastapi.templating import Jinja2Templates
 from app.config import get_supabase_client, settings
 from app.models.tong_quan_model import MarketCapItem, FinancialDataPoint, StockModel
+from app.services.upstream_executor import run_upstream, UpstreamError
+from app.services.history_cache import HistoryCache, OhlcvSeries
+from app.services.ingestion_scheduler import vn_now
+from app.services.query_service import iter_pages, map_concurrent, read_frame
+from app.services.result_cache import ResultCache, JsonPayload, TAG_FINANCIAL_REPORTS, make_json_payload, register_invalidation_hook
 from vnstock import Vnstock
 
 logger = logging.getLogger(__name__)
 
 # ==== TỔNG VỐN HÓA SERVICE (from tong_von_hoa_service.py) ====
+# Tổng theo (year, quarter, line_item_id): số liệu quý gần như không đổi, chỉ xoá khi có báo cáo mới được nạp
+total_capital_cache = ResultCache("total_capital", tags=(TAG_FINANCIAL_REPORTS,), max_entries=settings.FINANCIAL_CACHE_MAX_ENTRIES)
+
+def _query_total_capital(year: int, quarter: str, line_item_id: int) -> float:
+    supabase = get_supabase_client()
+    logger.info(f"Service: Calculating total capital for year={year}, quarter='{quarter}', line_item_id={line_item_id}")
+    # Một round trip: lọc financial_data theo kỳ báo cáo qua embedded inner join thay vì lấy report_id trước
+    values: List[Any] = []
+    for page in iter_pages(
+        lambda: supabase.table("financial_data")
+            .select("report_id, value, financial_reports!inner(year, quarter)")
+            .eq("line_item_id", line_item_id)
+            .eq("financial_reports.year", year)
+            .eq("financial_reports.quarter", quarter),
+        keyset="report_id"
+    ):
+        values.extend(item.get('value') for item in page)
+    if not values:
+        logger.warning(f"Không tìm thấy dữ liệu tài chính (financial_data) cho line_item_id {line_item_id}, năm {year}, quý {quarter}.")
+        return 0.0
+    numeric = pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+    invalid = int(np.isnan(numeric).sum()) - sum(value is None for value in values)
+    if invalid:
+        logger.warning(f"Bỏ qua {invalid} giá trị không hợp lệ trong financial_data (line_item_id={line_item_id}).")
+    total_value = float(np.nansum(numeric))
+    logger.info(f"Calculated total_value: {total_value} from {len(values)} items.")
+    return total_value
+
 def calculate_total_capital_for_all_stocks(
     year: int,
     quarter: str,
     line_item_id: int
 ) -> float:
-    supabase = get_supabase_client()
-    total_value = 0.0
-    logger.info(f"Service: Calculating total capital for year={year}, quarter='{quarter}', line_item_id={line_item_id}")
     try:
-        reports_response = supabase.table("financial_reports") \
-            .select("report_id") \
-            .eq("year", year) \
-            .eq("quarter", quarter) \
-            .execute()
-        if hasattr(reports_response, 'error') and reports_response.error:
-            logger.error(f"Supabase error fetching reports: {reports_response.error}")
-            raise Exception(f"Supabase error fetching reports: {reports_response.error.message}")
-        if not reports_response.data:
-            logger.warning(f"Không tìm thấy báo cáo tài chính cho năm {year} và quý {quarter}.")
-            return 0.0
-        report_ids = [report['report_id'] for report in reports_response.data]
-        if not report_ids:
-            logger.warning("Danh sách report_id trống sau khi query financial_reports.")
-            return 0.0
-        logger.debug(f"Found {len(report_ids)} report_ids: {report_ids[:5]}...")
-        financial_data_response = supabase.table("financial_data") \
-            .select("value") \
-            .in_("report_id", report_ids) \
-            .eq("line_item_id", line_item_id) \
-            .execute()
-        if hasattr(financial_data_response, 'error') and financial_data_response.error:
-            logger.error(f"Supabase error fetching financial_data: {financial_data_response.error}")
-            raise Exception(f"Supabase error fetching financial_data: {financial_data_response.error.message}")
-        if financial_data_response.data:
-            for item in financial_data_response.data:
-                if item.get('value') is not None:
-                    try:
-                        total_value += float(item['value'])
-                    except ValueError:
-                        logger.warning(f"Giá trị không hợp lệ được bỏ qua trong financial_data: {item.get('value')}")
-            logger.info(f"Calculated total_value: {total_value} from {len(financial_data_response.data)} items.")
-        else:
-            logger.warning(f"Không tìm thấy dữ liệu tài chính (financial_data) cho line_item_id {line_item_id} trong các report_ids đã chọn.")
+        return total_capital_cache.get_or_load(
+            (year, quarter, line_item_id),
+            lambda: _query_total_capital(year, quarter, line_item_id)
+        )
     except Exception as e:
         logger.exception(f"Đã xảy ra lỗi trong quá trình tính toán tổng nguồn vốn: {e}")
-        raise 
-    return total_value
+        raise
+
+def get_cached_total_capital(year: int, quarter: str, line_item_id: int) -> Optional[float]:
+    """Giá trị đã cache (None nếu chưa có), để endpoint trả ngay mà không cần chuyển sang thread pool."""
+    return total_capital_cache.get((year, quarter, line_item_id))
+
+def warm_total_capital_cache() -> None:
+    """Nạp sẵn tổng nguồn vốn cho kỳ mặc định (gọi lúc khởi động và sau mỗi lần invalidation)."""
+    calculate_total_capital_for_all_stocks(
+        settings.DEFAULT_YEAR_TONG_NGUON_VON,
+        settings.DEFAULT_QUARTER_TONG_NGUON_VON,
+        settings.DEFAULT_LINE_ITEM_ID_TONG_NGUON_VON
+    )
+
+register_invalidation_hook(TAG_FINANCIAL_REPORTS, warm_total_capital_cache)
 
 # ==== FINANCIAL SERVICE (from financial_service.py) ====
+# Dữ liệu biểu đồ theo (line_item_id, year, quarter): danh sách {symbol, value} của mọi mã, lấy từ RPC
+# get_financial_data_for_chart (có lọc phía DB). Endpoint một line item và endpoint batch dùng chung cache
+# và chung RPC nên luôn trả cùng số liệu cho cùng một key.
+chart_data_cache = ResultCache("financial_chart_data", tags=(TAG_FINANCIAL_REPORTS,), max_entries=settings.FINANCIAL_CACHE_MAX_ENTRIES)
+ChartDataKey = Tuple[int, int, str]
+
 class FinancialService:
     def __init__(self, db_client: Client = Depends(get_supabase_client)):
         self.db = db_client
         logger.debug("FinancialService initialized with Supabase client.")
-    async def get_chart_data(self, line_item_id: int) -> List[FinancialDataPoint]:
+
+    def _call_chart_rpc(self, line_item_id: int, year: int, quarter: str) -> List[Dict[str, Any]]:
         rpc_function_name = 'get_financial_data_for_chart'
         rpc_params = {
             'p_line_item_id': line_item_id,
-            'p_year': 2024,
-            'p_quarter': 'Q4'
+            'p_year': year,
+            'p_quarter': quarter
         }
-        logger.info(f"Service: Calling RPC '{rpc_function_name}' for line_item_id={line_item_id}")
+        logger.info(f"Service: Calling RPC '{rpc_function_name}' for line_item_id={line_item_id}, {year}{quarter}")
+        response = self.db.rpc(rpc_function_name, rpc_params).execute()
+        if hasattr(response, 'error') and response.error:
+            logger.error(f"Service: Supabase RPC error response: {response.error}")
+            error_details = response.error.get('message', 'Unknown database error')
+            raise HTTPException(
+                status_code=500,
+                detail=f"Database RPC Error: {error_details}"
+            )
+        data = response.data if response.data else []
+        logger.info(f"Service: RPC call successful. Received {len(data)} data points for line_item_id={line_item_id}.")
+        return data
+
+    async def get_chart_data(self, line_item_id: int, year: Optional[int] = None, quarter: Optional[str] = None) -> List[FinancialDataPoint]:
+        year = year or settings.DEFAULT_YEAR_TONG_NGUON_VON
+        quarter = quarter or settings.DEFAULT_QUARTER_TONG_NGUON_VON
+        key = (line_item_id, year, quarter)
+        cached = chart_data_cache.get(key)
+        if cached is not None:
+            return cached
         try:
-            response = self.db.rpc(rpc_function_name, rpc_params).execute()
-            if hasattr(response, 'error') and response.error:
-                logger.error(f"Service: Supabase RPC error response: {response.error}")
-                error_details = response.error.get('message', 'Unknown database error')
-                raise HTTPException(
-                    status_code=500,
-                    detail=f"Database RPC Error: {error_details}"
-                )
-            data = response.data if response.data else []
-            logger.info(f"Service: RPC call successful. Received {len(data)} data points for line_item_id={line_item_id}.")
-            return data
+            return await run_upstream(chart_data_cache.get_or_load, key, lambda: self._call_chart_rpc(line_item_id, year, quarter))
+        except HTTPException:
+            raise
+        except UpstreamError as e:
+            logger.warning(f"Service: Upstream executor error during RPC call for line_item_id={line_item_id}: {e}")
+            raise HTTPException(status_code=e.status_code, detail=str(e))
         except Exception as e:
             logger.exception(f"Service: Unexpected error during RPC call for line_item_id={line_item_id}: {e}")
             raise HTTPException(
@@ -98,21 +137,91 @@ class FinancialService:
                 detail=f"Internal Server Error while fetching financial data"
             )
 
+    def _load_chart_data(self, key: ChartDataKey) -> List[Dict[str, Any]]:
+        return chart_data_cache.get_or_load(key, lambda: self._call_chart_rpc(*key))
+
+    def get_chart_data_batch(self, line_item_ids: List[int], periods: List[Tuple[int, str]]) -> Dict[ChartDataKey, List[Dict[str, Any]]]:
+        """
+        Dữ liệu biểu đồ cho mọi cặp (line_item, kỳ), theo đúng thứ tự line_item_ids x periods.
+        Mỗi key chưa có trong chart_data_cache được nạp qua đúng RPC của get_chart_data (các key chạy song song).
+        """
+        keys = list(dict.fromkeys((line_item_id, year, quarter) for line_item_id in line_item_ids for year, quarter in periods))
+        found: Dict[ChartDataKey, List[Dict[str, Any]]] = {}
+        missing: List[ChartDataKey] = []
+        for key in keys:
+            cached = chart_data_cache.get(key)
+            if cached is None:
+                missing.append(key)
+            else:
+                found[key] = cached
+        if missing:
+            found.update(zip(missing, map_concurrent(self._load_chart_data, missing)))
+            logger.info(f"Service: Batched chart data loaded {len(missing)} of {len(keys)} (line_item, period) keys via RPC.")
+        return {key: found[key] for key in keys}
+
 # ==== INDEX SERVICE (from index_service.py) ====
+MINI_CHART_POINTS = 30
+# Dư ra so với MINI_CHART_POINTS để vẫn đủ điểm sau khi bỏ các dòng thiếu close
+INDEX_DISPLAY_TAIL_ROWS = MINI_CHART_POINTS * 2
+INDEX_HISTORY_COLUMNS = ['time', 'open', 'high', 'low', 'close', 'volume']
 class IndexService:
     def __init__(self):
-        try:
-            self.supabase: Client = get_supabase_client()
-            logger.info("IndexService initialized and Supabase client obtained.")
-        except Exception as e:
-            logger.error(f"IndexService failed to initialize Supabase client: {e}", exc_info=True)
-            raise
         self.INDEX_CONFIG: Dict[str, Dict[str, any]] = settings.INDEX_CONFIG.copy()
         if not self.INDEX_CONFIG:
             logger.warning("INDEX_CONFIG is empty in settings. Index processing might not work as expected.")
         else:
             logger.info(f"IndexService loaded INDEX_CONFIG: {list(self.INDEX_CONFIG.keys())}")
-        self._initialize_index_type_ids()
+        # Map index_type -> id được nạp một lần, làm mới nền theo TTL (xem ensure_index_type_ids)
+        self.index_types_ttl_seconds: float = settings.INDEX_TYPES_TTL_SECONDS
+        self._index_types_loaded_at: Optional[float] = None
+        self._index_types_load_lock: Optional[asyncio.Lock] = None
+        self._index_types_refresh_task: Optional[asyncio.Task] = None
+        self.index_timeout_seconds: float = settings.INDEX_FETCH_TIMEOUT_SECONDS
+        self.index_deadline_seconds: float = settings.INDEX_FETCH_DEADLINE_SECONDS
+        self.index_sync_timeout_seconds: float = settings.INDEX_SYNC_TIMEOUT_SECONDS
+        # Thời điểm đồng bộ vnstock -> DB thành công gần nhất của từng chỉ số (do ingestion scheduler ghi)
+        self.last_synced_at: Dict[str, datetime] = {}
+        # Kết quả hiển thị tốt gần nhất của từng chỉ số, dùng khi chỉ số đó lỗi / quá hạn
+        self._last_good_results: Dict[str, Dict[str, any]] = {}
+        # Lịch sử index_history theo index_type_id, nạp một lần rồi chỉ nối thêm dòng mới
+        self._history_cache = HistoryCache(
+            lambda index_type_id, after_date: self._get_all_data_from_db(index_type_id, f"index_type_id={index_type_id}", after_date),
+            max_series=settings.HISTORY_CACHE_MAX_SERIES
+        )
+
+    async def ensure_index_type_ids(self) -> None:
+        """
+        Lần đầu (hoặc sau invalidate) nạp đồng bộ; khi quá TTL thì vẫn dùng map hiện tại
+        và làm mới ở nền, để request không phải chờ thêm một round trip tới 'index_types'.
+        """
+        if self._index_types_loaded_at is None:
+            if self._index_types_load_lock is None:
+                self._index_types_load_lock = asyncio.Lock()
+            async with self._index_types_load_lock:
+                if self._index_types_loaded_at is None:
+                    await run_upstream(self._initialize_index_type_ids)
+            return
+        is_stale = time.monotonic() - self._index_types_loaded_at > self.index_types_ttl_seconds
+        refresh_running = self._index_types_refresh_task is not None and not self._index_types_refresh_task.done()
+        if is_stale and not refresh_running:
+            logger.info("index_types map is older than TTL. Refreshing in background.")
+            self._index_types_refresh_task = asyncio.create_task(self._refresh_index_type_ids())
+
+    async def _refresh_index_type_ids(self) -> None:
+        try:
+            await run_upstream(self._initialize_index_type_ids)
+        except Exception as e:
+            logger.error(f"Background refresh of index_type_ids failed: {e}", exc_info=True)
+
+
+    @property
+    def supabase(self) -> Client:
+        # Không giữ client: get_supabase_client tạo muộn và tạo lại sau khi HTTP pool đóng
+        return get_supabase_client()
+    def invalidate_index_types(self) -> None:
+        """Buộc request kế tiếp nạp lại map index_type -> id từ bảng 'index_types'."""
+        logger.info("index_types map invalidated.")
+        self._index_types_loaded_at = None
 
     def _initialize_index_type_ids(self):
         if not self.INDEX_CONFIG:
@@ -134,6 +243,7 @@ class IndexService:
                         updated_configs +=1
                     else:
                         logger.warning(f"No 'index_type_id' found for index_type '{index_type_from_config}' (config: {index_name}) in 'index_types' table.")
+                self._index_types_loaded_at = time.monotonic()
                 if updated_configs > 0:
                     logger.info(f"Successfully updated {updated_configs} index_type_ids from database.")
                 else:
@@ -143,7 +253,7 @@ class IndexService:
         except Exception as e:
             logger.error(f"Exception while fetching or processing 'index_types' data: {e}", exc_info=True)
 
-    def _fetch_from_vnstock(self, symbol: str, source: str, start_date: str, end_date: str) -> pd.DataFrame:
+    def _fetch_from_vnstock(self, symbol: str, source: str, start_date: str, end_date: str, raise_errors: bool = False) -> pd.DataFrame:
         logger.info(f"Fetching data from vnstock3 for {symbol} (source: {source}) from {start_date} to {end_date}")
         try:
             stock_data_fetcher = Vnstock().stock(symbol=symbol, source=source)
@@ -171,115 +281,75 @@ class IndexService:
             return df_filtered
         except Exception as vnstock_error:
             logger.error(f"Error fetching data from vnstock3 for {symbol}: {vnstock_error}", exc_info=True)
+            if raise_errors:
+                raise
             return pd.DataFrame()
 
-    def _get_latest_date_from_db(self, index_type_id: int) -> Optional[str]:
-        if index_type_id is None:
-            logger.warning("index_type_id is None, cannot fetch latest date from DB.")
-            return None
-        logger.debug(f"Fetching latest date from DB for index_type_id: {index_type_id}")
-        latest_date_to_start_fetch = None
-        try:
-            response = self.supabase.table('index_history')\
-                .select('time')\
-                .eq('index_type_id', index_type_id)\
-                .order('time', desc=True)\
-                .limit(1)\
-                .execute()
-            if hasattr(response, 'error') and response.error:
-                logger.error(f"DB Error fetching latest date for index_type_id {index_type_id}: {response.error}")
-                return None
-            if response.data:
-                latest_date_in_db_str = response.data[0]['time']
-                latest_date_obj = datetime.strptime(latest_date_in_db_str, '%Y-%m-%d')
-                next_day_obj = latest_date_obj + timedelta(days=1)
-                latest_date_to_start_fetch = next_day_obj.strftime('%Y-%m-%d')
-                logger.info(f"Latest date in DB for index_type_id {index_type_id} is {latest_date_in_db_str}. Next fetch starts from: {latest_date_to_start_fetch}")
-            else:
-                logger.info(f"No existing data in DB for index_type_id {index_type_id}. Will fetch from default start date.")
-        except Exception as query_error:
-            logger.error(f"Exception while fetching latest date for index_type_id {index_type_id}: {query_error}", exc_info=True)
-        return latest_date_to_start_fetch
-
-    def _save_to_supabase(self, df_new: pd.DataFrame, index_type_id: int, index_type_name: str) -> int:
+    def _save_to_supabase(self, df_new: pd.DataFrame, index_type_id: int, index_type_name: str) -> Dict[str, int]:
+        """
+        Upsert theo lô vào 'index_history' theo khoá (index_type_id, time); dòng đã tồn tại được ghi đè
+        (phiên đang giao dịch được cập nhật đến giá đóng cửa).
+        Trả về số dòng đã ghi ('upserted'), không hợp lệ ('invalid') và lỗi ('failed').
+        """
+        counts = {'upserted': 0, 'invalid': 0, 'failed': 0}
         if df_new.empty:
             logger.info(f"No new data to save for {index_type_name} (ID: {index_type_id}).")
-            return 0
+            return counts
         if index_type_id is None:
             logger.error(f"Cannot save data for {index_type_name} because index_type_id is None.")
-            return 0
+            return counts
         logger.info(f"Preparing to save {len(df_new)} new records for {index_type_name} (ID: {index_type_id}) to Supabase.")
-        records_to_insert: List[Dict[str, any]] = []
-        for _, row in df_new.iterrows():
-            try:
-                record = {
-                    'index_type_id': int(index_type_id),
-                    'time': row['time'],
-                    'open': float(row['open']) if pd.notna(row.get('open')) else None,
-                    'high': float(row['high']) if pd.notna(row.get('high')) else None,
-                    'low': float(row['low']) if pd.notna(row.get('low')) else None,
-                    'close': float(row['close']) if pd.notna(row.get('close')) else None,
-                    'volume': int(row['volume']) if pd.notna(row.get('volume')) else None
-                }
-                if record['time'] is None or record['close'] is None:
-                    logger.warning(f"Skipping record for {index_type_name} due to missing time/close: {row.to_dict()}")
-                    continue
-                records_to_insert.append(record)
-            except Exception as convert_error:
-                logger.error(f"Error converting data for row in {index_type_name} (Date: {row.get('time', 'N/A')}): {convert_error}. Row: {row.to_dict()}", exc_info=True)
-                continue
-        if not records_to_insert:
+        df = df_new.reindex(columns=INDEX_HISTORY_COLUMNS)
+        df['time'] = pd.to_datetime(df['time'], errors='coerce').dt.strftime('%Y-%m-%d')
+        for col in ['open', 'high', 'low', 'close']:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+        df['volume'] = pd.to_numeric(df['volume'], errors='coerce').round().astype('Int64')
+        valid_mask = df['time'].notna() & df['close'].notna()
+        counts['invalid'] = int((~valid_mask).sum())
+        if counts['invalid']:
+            logger.warning(f"Skipping {counts['invalid']} records for {index_type_name} due to missing time/close.")
+        df = df[valid_mask].drop_duplicates(subset='time', keep='last')
+        if df.empty:
             logger.info(f"No valid records to insert for {index_type_name} after conversion/validation.")
-            return 0
-        saved_count = 0
-        try:
-            min_date = df_new['time'].min()
-            max_date = df_new['time'].max()
-            existing_response = self.supabase.table('index_history')\
-                                    .select('time')\
-                                    .eq('index_type_id', index_type_id)\
-                                    .gte('time', min_date)\
-                                    .lte('time', max_date)\
-                                    .execute()
-            existing_dates = set()
-            if hasattr(existing_response, 'data') and existing_response.data:
-                existing_dates = {rec['time'] for rec in existing_response.data}
-            final_records_to_insert = [rec for rec in records_to_insert if rec['time'] not in existing_dates]
-            if not final_records_to_insert:
-                logger.info(f"All {len(records_to_insert)} new records for {index_type_name} already exist in the database.")
-                return 0
-            logger.info(f"Attempting to insert {len(final_records_to_insert)} genuinely new records for {index_type_name}.")
-            response = self.supabase.table('index_history').insert(final_records_to_insert).execute()
-            if hasattr(response, 'error') and response.error:
-                logger.error(f"Error inserting batch data into 'index_history' for {index_type_name}: {response.error}")
-            elif response.data:
-                saved_count = len(response.data)
-                logger.info(f"Successfully saved {saved_count} new records to 'index_history' for {index_type_name}.")
-            else:
-                 logger.info(f"Batch insert for {index_type_name} executed, assuming success (no data returned in response, no error). Count: {len(final_records_to_insert)}")
-                 saved_count = len(final_records_to_insert)
-        except Exception as insert_error:
-            logger.error(f"Unexpected exception during batch insert for {index_type_name}: {insert_error}", exc_info=True)
-        return saved_count
+            return counts
+        df.insert(0, 'index_type_id', int(index_type_id))
+        records: List[Dict[str, any]] = df.astype(object).where(df.notna(), None).to_dict(orient='records')
+        chunk_size = settings.INDEX_UPSERT_CHUNK_SIZE
+        for start in range(0, len(records), chunk_size):
+            chunk = records[start:start + chunk_size]
+            try:
+                # ON CONFLICT DO UPDATE: lần chạy sau trong cùng phiên thay nến chưa đóng cửa bằng số liệu mới nhất
+                response = self.supabase.table('index_history')\
+                    .upsert(chunk, on_conflict='index_type_id,time', ignore_duplicates=False)\
+                    .execute()
+                counts['upserted'] += len(response.data) if response.data else 0
+            except Exception as upsert_error:
+                counts['failed'] += len(chunk)
+                logger.error(f"Error upserting chunk of {len(chunk)} rows ({chunk[0]['time']}..{chunk[-1]['time']}) into 'index_history' for {index_type_name}: {upsert_error}", exc_info=True)
+        logger.info(f"Upsert into 'index_history' for {index_type_name} finished: {counts}")
+        return counts
 
-    def _get_all_data_from_db(self, index_type_id: int, index_type_name: str) -> pd.DataFrame:
+    def _get_all_data_from_db(self, index_type_id: int, index_type_name: str, after_date: Optional[str] = None) -> pd.DataFrame:
         if index_type_id is None:
             logger.warning(f"index_type_id is None for {index_type_name}, cannot fetch data from DB.")
             return pd.DataFrame()
-        logger.info(f"Fetching all data from DB for {index_type_name} (ID: {index_type_id})")
+        if after_date is None:
+            logger.info(f"Fetching all data from DB for {index_type_name} (ID: {index_type_id})")
+        else:
+            logger.debug(f"Fetching rows after {after_date} from DB for {index_type_name} (ID: {index_type_id})")
         try:
-            response = self.supabase.table('index_history')\
-                .select('time, open, high, low, close, volume')\
-                .eq('index_type_id', index_type_id)\
-                .order('time', desc=False)\
-                .execute()
-            if hasattr(response, 'error') and response.error:
-                logger.error(f"DB Error fetching all data for {index_type_name} (ID: {index_type_id}): {response.error}")
-                return pd.DataFrame()
-            if not response.data:
-                logger.warning(f"No data found in 'index_history' for {index_type_name} (ID: {index_type_id})")
+            # Phân trang theo khoá 'time' (duy nhất trong một index_type_id), bắt đầu sau after_date
+            df_supabase = read_frame(
+                lambda: self.supabase.table('index_history')
+                    .select('time, open, high, low, close, volume')
+                    .eq('index_type_id', index_type_id),
+                keyset='time',
+                after=after_date
+            )
+            if df_supabase.empty:
+                if after_date is None:
+                    logger.warning(f"No data found in 'index_history' for {index_type_name} (ID: {index_type_id})")
                 return pd.DataFrame()
-            df_supabase = pd.DataFrame(response.data)
             for col in ['open', 'high', 'low', 'close']:
                 if col in df_supabase.columns:
                     df_supabase[col] = pd.to_numeric(df_supabase[col], errors='coerce')
@@ -288,45 +358,91 @@ class IndexService:
             if 'time' in df_supabase.columns:
                 df_supabase['time'] = pd.to_datetime(df_supabase['time']).dt.strftime('%Y-%m-%d')
             df_supabase = df_supabase.sort_values('time').reset_index(drop=True)
-            logger.info(f"Successfully fetched {len(df_supabase)} total rows from 'index_history' for {index_type_name} (ID: {index_type_id}).")
+            logger.info(f"Successfully fetched {len(df_supabase)} rows from 'index_history' for {index_type_name} (ID: {index_type_id}).")
             return df_supabase
         except Exception as query_error:
             logger.error(f"Exception fetching all data for {index_type_name} (ID: {index_type_id}): {query_error}", exc_info=True)
             return pd.DataFrame()
 
-    def get_and_update_index_data(self, index_symbol: str, index_type_name: str, source_api: str) -> pd.DataFrame:
+    def sync_index_data(self, index_symbol: str) -> Dict[str, int]:
+        """
+        Lấy dữ liệu mới từ vnstock và ghi vào 'index_history'. Chỉ được gọi bởi ingestion scheduler,
+        không nằm trên đường xử lý request. Trả về số dòng đã ghi / bỏ qua (xem _save_to_supabase).
+        """
         config = self.INDEX_CONFIG.get(index_symbol)
         if not config:
-            logger.error(f"No configuration found for index_symbol: {index_symbol}. Cannot process.")
-            return pd.DataFrame()
+            logger.error(f"No configuration found for index_symbol: {index_symbol}. Cannot sync.")
+            return {}
+        index_type_name = config.get('index_type')
+        source_api = config.get('source', 'VCI')
         index_type_id = config.get('index_type_id')
         if index_type_id is None:
-            logger.error(f"index_type_id is not initialized for {index_symbol} (type: {index_type_name}). Check 'index_types' table and config. Skipping update for this index.")
-            return self._get_all_data_from_db(None, index_type_name)
-        logger.info(f"Processing index: {index_symbol} (Type: {index_type_name}, ID: {index_type_id}, Source: {source_api})")
-        start_date_for_fetch = self._get_latest_date_from_db(index_type_id)
+            raise RuntimeError(f"index_type_id is not initialized for {index_symbol} (type: {index_type_name}). Check 'index_types' table and config.")
+        logger.info(f"Syncing index: {index_symbol} (Type: {index_type_name}, ID: {index_type_id}, Source: {source_api})")
+        # Fetch vnstock bắt đầu từ chính ngày cuối đã lưu: nếu lần trước chạy trong phiên thì dòng đó chưa phải giá đóng cửa
+        history = self._history_cache.refresh(index_type_id)
+        start_date_for_fetch = None
+        if history.size:
+            start_date_for_fetch = history.last_date_str
+            logger.info(f"Latest cached date for index_type_id {index_type_id} is {history.last_date_str}. Re-fetching from that session.")
         if start_date_for_fetch is None:
             default_start_date = '2024-01-01'
             if settings.INDEX_CONFIG and index_symbol in settings.INDEX_CONFIG and 'default_start_date' in settings.INDEX_CONFIG[index_symbol]:
                 default_start_date = settings.INDEX_CONFIG[index_symbol]['default_start_date']
             start_date_for_fetch = default_start_date
             logger.info(f"No existing data or failed to get latest date for {index_symbol}. Using default/configured start date: {start_date_for_fetch}")
-        current_date_str = datetime.now().strftime('%Y-%m-%d')
+        current_date_str = vn_now().strftime('%Y-%m-%d')
+        save_counts: Dict[str, int] = {}
         df_new_from_api = pd.DataFrame()
         if start_date_for_fetch <= current_date_str:
-            df_new_from_api = self._fetch_from_vnstock(index_symbol, source_api, start_date_for_fetch, current_date_str)
+            df_new_from_api = self._fetch_from_vnstock(index_symbol, source_api, start_date_for_fetch, current_date_str, raise_errors=True)
         else:
             logger.info(f"Start date {start_date_for_fetch} is after current date {current_date_str}. No new data to fetch for {index_symbol}.")
         if not df_new_from_api.empty:
             for col_numeric in ['open', 'high', 'low', 'close', 'volume']:
                 if col_numeric in df_new_from_api.columns:
                     df_new_from_api[col_numeric] = pd.to_numeric(df_new_from_api[col_numeric], errors='coerce')
-            num_saved = self._save_to_supabase(df_new_from_api, index_type_id, index_type_name)
-            logger.info(f"{num_saved} new records saved for {index_symbol}.")
+            save_counts = self._save_to_supabase(df_new_from_api, index_type_id, index_type_name)
+            logger.info(f"{save_counts.get('upserted', 0)} records upserted for {index_symbol}.")
+            if save_counts.get('upserted'):
+                self._history_cache.refresh(index_type_id)
         else:
             logger.info(f"No new data fetched from API for {index_symbol} to save.")
-        df_all_from_db = self._get_all_data_from_db(index_type_id, index_type_name)
-        return df_all_from_db
+        self.last_synced_at[index_symbol] = datetime.now()
+        return save_counts
+
+    async def sync_all_indices(self) -> Dict[str, Dict[str, int]]:
+        """Job của ingestion scheduler: đồng bộ song song mọi chỉ số đã cấu hình."""
+        await self.ensure_index_type_ids()
+        symbols = list(self.INDEX_CONFIG.keys())
+        results = await asyncio.gather(
+            *(run_upstream(self.sync_index_data, symbol, timeout=self.index_sync_timeout_seconds) for symbol in symbols),
+            return_exceptions=True
+        )
+        failures = {symbol: result for symbol, result in zip(symbols, results) if isinstance(result, BaseException)}
+        if failures:
+            raise RuntimeError(f"Index sync failed for {', '.join(f'{s}: {e}' for s, e in failures.items())}")
+        return dict(zip(symbols, results))
+
+    def get_index_data(self, index_symbol: str, index_type_name: str) -> pd.DataFrame:
+        """Đường đọc của API: chỉ dùng dữ liệu đã lưu (cache + các dòng mới trong DB), không gọi vnstock."""
+        config = self.INDEX_CONFIG.get(index_symbol)
+        if not config:
+            logger.error(f"No configuration found for index_symbol: {index_symbol}. Cannot process.")
+            return pd.DataFrame()
+        index_type_id = config.get('index_type_id')
+        if index_type_id is None:
+            logger.error(f"index_type_id is not initialized for {index_symbol} (type: {index_type_name}). Check 'index_types' table and config.")
+            return self._get_all_data_from_db(None, index_type_name)
+        history = self._history_cache.refresh(index_type_id)
+        return history.tail_frame(INDEX_DISPLAY_TAIL_ROWS)
+
+    def get_history_series(self, index_symbol: str) -> Optional[OhlcvSeries]:
+        """Toàn bộ lịch sử đã cache của một chỉ số (None nếu chưa cấu hình / chưa có index_type_id)."""
+        config = self.INDEX_CONFIG.get(index_symbol)
+        if not config or config.get('index_type_id') is None:
+            return None
+        return self._history_cache.refresh(config['index_type_id'])
 
     def process_index_data_for_display(self, df: pd.DataFrame, symbol: str) -> Dict[str, any]:
         if df is None or df.empty:
@@ -349,14 +465,14 @@ class IndexService:
                 'message': f'Not enough valid data points to calculate changes for {symbol} after cleaning.',
                 'name': symbol, 'category': 'index', 'latest_close': None,
                 'change': None, 'change_percent': None,
-                'mini_chart_data': df[['time', 'close']].tail(30).to_dict(orient='records')
+                'mini_chart_data': df[['time', 'close']].tail(MINI_CHART_POINTS).to_dict(orient='records')
             }
         try:
             latest_close = float(df_cleaned['close'].iloc[-1])
             previous_close = float(df_cleaned['close'].iloc[-2]) if len(df_cleaned) > 1 else latest_close
             change = round(latest_close - previous_close, 2)
             change_percent = round((change / previous_close) * 100, 3) if previous_close != 0 else 0.0
-            mini_chart_data_df = df_cleaned[['time', 'close']].tail(30)
+            mini_chart_data_df = df_cleaned[['time', 'close']].tail(MINI_CHART_POINTS)
             mini_chart_data_df['close'] = mini_chart_data_df['close'].apply(lambda x: None if pd.isna(x) else x)
             mini_chart_data: List[Dict[str, any]] = mini_chart_data_df.to_dict(orient='records')
             return {
@@ -371,7 +487,7 @@ class IndexService:
         except IndexError:
              logger.warning(f"IndexError during display processing for {symbol}, likely due to insufficient data points after cleaning. Len: {len(df_cleaned)}")
              latest_close_val = float(df_cleaned['close'].iloc[-1]) if not df_cleaned.empty else None
-             raw_mini_chart = df_cleaned[['time', 'close']].tail(30).to_dict(orient='records') if not df_cleaned.empty else []
+             raw_mini_chart = df_cleaned[['time', 'close']].tail(MINI_CHART_POINTS).to_dict(orient='records') if not df_cleaned.empty else []
              return {
                 'status': 'warning',
                 'message': f'Insufficient data points to calculate changes for {symbol}.',
@@ -382,7 +498,7 @@ class IndexService:
             }
         except Exception as e:
             logger.error(f"Error processing display data for {symbol}: {e}", exc_info=True)
-            raw_data_fallback = df[['time', 'close']].tail(30).to_dict(orient='records') if not df.empty else []
+            raw_data_fallback = df[['time', 'close']].tail(MINI_CHART_POINTS).to_dict(orient='records') if not df.empty else []
             return {
                 'status': 'error',
                 'message': f'Error processing display data for {symbol}: {str(e)}',
@@ -390,41 +506,193 @@ class IndexService:
                 'change': None, 'change_percent': None, 'mini_chart_data': raw_data_fallback
             }
 
+    def _last_synced_at_iso(self, index_symbol: str) -> Optional[str]:
+        synced_at = self.last_synced_at.get(index_symbol)
+        return synced_at.isoformat(timespec='seconds') if synced_at else None
+
+    def _stale_or_error_result(self, index_symbol: str, reason: str) -> Dict[str, any]:
+        last_good = self._last_good_results.get(index_symbol)
+        if last_good is not None:
+            logger.warning(f"Serving stale data for {index_symbol}: {reason}")
+            return {**last_good, 'status': 'stale', 'message': f'Serving last known data for {index_symbol}: {reason}'}
+        return {
+            'status': 'error',
+            'message': f'System error processing {index_symbol}: {reason}',
+            'name': index_symbol, 'category': 'index', 'latest_close': None,
+            'change': None, 'change_percent': None, 'mini_chart_data': [],
+            'last_synced_at': self._last_synced_at_iso(index_symbol)
+        }
+
+    async def _process_index(self, index_symbol: str, config_details: Dict[str, any]) -> Dict[str, any]:
+        index_type_name = config_details.get('index_type')
+        if not index_type_name:
+            logger.error(f"Missing 'index_type' in config for {index_symbol}. Skipping.")
+            return {'status': 'error', 'message': 'Configuration error: missing index_type.'}
+        logger.info(f"--- Processing index: {index_symbol} ---")
+        try:
+            df_all_data_for_index = await run_upstream(
+                self.get_index_data, index_symbol, index_type_name,
+                timeout=self.index_timeout_seconds
+            )
+            display_data = self.process_index_data_for_display(df_all_data_for_index, index_symbol)
+            display_data['last_synced_at'] = self._last_synced_at_iso(index_symbol)
+            if display_data.get('status') == 'success':
+                self._last_good_results[index_symbol] = display_data
+            logger.info(f"Successfully processed data for {index_symbol}. Status: {display_data.get('status')}")
+            return display_data
+        except UpstreamError as e:
+            return self._stale_or_error_result(index_symbol, str(e))
+        except Exception as e:
+            logger.exception(f"CRITICAL error while processing index {index_symbol}: {e}")
+            return self._stale_or_error_result(index_symbol, str(e))
+        finally:
+            logger.info(f"--- Finished processing index: {index_symbol} ---")
+
     async def fetch_and_process_all_indices(self) -> Dict[str, Dict[str, any]]:
         if not self.INDEX_CONFIG:
             logger.warning("INDEX_CONFIG is empty. No indices to process.")
             return {}
-        logger.info(f"Starting to fetch and process all configured indices: {list(self.INDEX_CONFIG.keys())}")
+        await self.ensure_index_type_ids()
+        logger.info(f"Starting to fetch and process all configured indices concurrently: {list(self.INDEX_CONFIG.keys())}")
+        tasks: Dict[str, asyncio.Task] = {
+            index_symbol: asyncio.create_task(self._process_index(index_symbol, config_details))
+            for index_symbol, config_details in self.INDEX_CONFIG.items()
+        }
+        # Mỗi chỉ số có timeout riêng; deadline chung chặn tổng thời gian của endpoint
+        _, pending = await asyncio.wait(tasks.values(), timeout=self.index_deadline_seconds)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
         processed_results: Dict[str, Dict[str, any]] = {}
-        for index_symbol, config_details in self.INDEX_CONFIG.items():
-            index_type_name = config_details.get('index_type')
-            source_api = config_details.get('source', 'VCI')
-            if not index_type_name:
-                logger.error(f"Missing 'index_type' in config for {index_symbol}. Skipping.")
-                processed_results[index_symbol] = {'status': 'error', 'message': 'Configuration error: missing index_type.'}
-                continue
-            logger.info(f"--- Processing index: {index_symbol} ---")
-            try:
-                df_all_data_for_index = self.get_and_update_index_data(index_symbol, index_type_name, source_api)
-                display_data = self.process_index_data_for_display(df_all_data_for_index, index_symbol)
-                processed_results[index_symbol] = display_data
-                logger.info(f"Successfully processed data for {index_symbol}. Status: {display_data.get('status')}")
-            except Exception as e:
-                logger.exception(f"CRITICAL error while processing index {index_symbol}: {e}")
-                processed_results[index_symbol] = {
-                    'status': 'error',
-                    'message': f'System error processing {index_symbol}: {str(e)}',
-                    'name': index_symbol, 'category': 'index', 'latest_close': None,
-                    'change': None, 'change_percent': None, 'mini_chart_data': []
-                }
-            logger.info(f"--- Finished processing index: {index_symbol} ---")
-        logger.info(f"Completed fetching and processing for all {len(self.INDEX_CONFIG)} indices.")
+        for index_symbol, task in tasks.items():
+            if task in pending:
+                processed_results[index_symbol] = self._stale_or_error_result(
+                    index_symbol, f'deadline of {self.index_deadline_seconds}s exceeded'
+                )
+            else:
+                processed_results[index_symbol] = task.result()
+        logger.info(f"Completed fetching and processing for all {len(self.INDEX_CONFIG)} indices ({len(pending)} past deadline).")
         return processed_results
 
+@lru_cache()
+def get_index_service() -> IndexService:
+    return IndexService()
+
 # ==== MARKET DATA SERVICE (from market_data_service.py) ====
+MARKET_CAP_DEFAULT_PARAMS: Dict[str, Any] = {
+    "line_item_id": 88,
+    "year": 2024,
+    "quarter": "Q4",
+    "min_stock_id": 1,
+    "max_stock_id": 27
+}
+# Response treemap đã serialize + ETag theo bộ tham số; TTL chỉ là lưới an toàn, nguồn chính là invalidation
+market_cap_cache = ResultCache("market_cap", ttl_seconds=settings.MARKET_CAP_CACHE_TTL_SECONDS, tags=(TAG_FINANCIAL_REPORTS,))
+# Ma trận (kỳ x mã) theo line_item_id và các response series đã serialize theo (line_item_id, top);
+# key do client chọn nên giới hạn số mục (LRU), TTL một ngày không đủ để chặn cache lớn dần
+market_cap_series_cache = ResultCache("market_cap_series", ttl_seconds=settings.MARKET_CAP_CACHE_TTL_SECONDS, tags=(TAG_FINANCIAL_REPORTS,),
+                                      max_entries=settings.MARKET_CAP_SERIES_CACHE_MAX_ENTRIES)
+market_cap_series_payload_cache = ResultCache("market_cap_series_payload", ttl_seconds=settings.MARKET_CAP_CACHE_TTL_SECONDS, tags=(TAG_FINANCIAL_REPORTS,),
+                                              max_entries=settings.FINANCIAL_CACHE_MAX_ENTRIES)
+
+@dataclass
+class MarketCapSeries:
+    """Giá trị của một line item cho mọi kỳ (hàng, tăng dần) và mọi mã (cột); NaN = không có số liệu."""
+    periods: List[str]
+    symbols: List[str]
+    values: np.ndarray
+
+    def top_n(self, n: int) -> List[List[Tuple[str, float]]]:
+        """N mã lớn nhất của từng kỳ: argpartition O(S) rồi chỉ sắp xếp N phần tử được chọn."""
+        result: List[List[Tuple[str, float]]] = []
+        for row in self.values:
+            valid = np.flatnonzero(~np.isnan(row))
+            k = min(n, len(valid))
+            if k == 0:
+                result.append([])
+                continue
+            chosen = valid[np.argpartition(-row[valid], k - 1)[:k]] if k < len(valid) else valid
+            chosen = chosen[np.argsort(-row[chosen], kind='stable')]
+            result.append([(self.symbols[i], float(row[i])) for i in chosen])
+        return result
+
 class MarketDataService:
-    def __init__(self):
-        self.supabase: Client = get_supabase_client()
+    @property
+    def supabase(self) -> Client:
+        # Singleton tạo lúc import: lấy client khi dùng để import không phụ thuộc cấu hình Supabase
+        return get_supabase_client()
+
+    @staticmethod
+    def _payload_key(line_item_id: int, year: int, quarter: str, min_stock_id: int, max_stock_id: int) -> Tuple:
+        return (line_item_id, year, quarter, min_stock_id, max_stock_id)
+
+    def get_cached_market_cap_payload(self, **params: Any) -> Optional[JsonPayload]:
+        return market_cap_cache.get(self._payload_key(**params))
+
+    def get_market_cap_payload(self, **params: Any) -> JsonPayload:
+        """Response JSON của get_market_cap kèm ETag, tính một lần cho mỗi bộ tham số."""
+        return market_cap_cache.get_or_load(
+            self._payload_key(**params),
+            lambda: make_json_payload([item.model_dump() for item in self.get_market_cap(**params)])
+        )
+
+    def warm_market_cap_cache(self) -> None:
+        self.get_market_cap_payload(**MARKET_CAP_DEFAULT_PARAMS)
+        self.get_market_cap_series_payload(settings.DEFAULT_LINE_ITEM_ID_TONG_NGUON_VON)
+
+    def _query_market_cap_series(self, line_item_id: int) -> MarketCapSeries:
+        """Một truy vấn (theo trang) cho mọi kỳ và mọi mã, dựng ma trận kỳ x mã bằng NumPy."""
+        rows: List[Tuple[int, str, str, Any]] = []
+        for page in iter_pages(
+            lambda: self.supabase.table("financial_data")
+                .select("report_id, value, financial_reports!inner(year, quarter, stocks!inner(symbol))")
+                .eq("line_item_id", line_item_id),
+            keyset="report_id"
+        ):
+            for item in page:
+                report_info = item.get('financial_reports') or {}
+                stock_info = report_info.get('stocks') or {}
+                if stock_info.get('symbol') and report_info.get('year') is not None and report_info.get('quarter'):
+                    rows.append((report_info['year'], report_info['quarter'], stock_info['symbol'], item.get('value')))
+        if not rows:
+            return MarketCapSeries([], [], np.empty((0, 0)))
+        df = pd.DataFrame(rows, columns=['year', 'quarter', 'symbol', 'value'])
+        df['value'] = pd.to_numeric(df['value'], errors='coerce')
+        # Giống get_market_cap: chỉ tính giá trị dương
+        df.loc[df['value'] <= 0, 'value'] = np.nan
+        df['period'] = df['year'].astype(str) + df['quarter'].astype(str)
+        matrix = df.pivot_table(index='period', columns='symbol', values='value', aggfunc='last').sort_index()
+        logger.info(f"Market cap series for line_item_id={line_item_id}: {matrix.shape[0]} periods x {matrix.shape[1]} symbols.")
+        return MarketCapSeries(matrix.index.tolist(), matrix.columns.tolist(), matrix.to_numpy(dtype=np.float64))
+
+    def get_market_cap_series(self, line_item_id: int) -> MarketCapSeries:
+        return market_cap_series_cache.get_or_load(line_item_id, lambda: self._query_market_cap_series(line_item_id))
+
+    def get_cached_market_cap_series_payload(self, line_item_id: int, top: Optional[int] = None) -> Optional[JsonPayload]:
+        return market_cap_series_payload_cache.get((line_item_id, top))
+
+    def get_market_cap_series_payload(self, line_item_id: int, top: Optional[int] = None) -> JsonPayload:
+        """
+        Toàn bộ lịch sử theo kỳ của một line item. Không có `top`: ma trận kỳ x mã đầy đủ;
+        có `top`: N mã lớn nhất mỗi kỳ kèm thứ hạng. Mỗi kỳ đều có tổng toàn thị trường.
+        """
+        def build() -> JsonPayload:
+            series = self.get_market_cap_series(line_item_id)
+            totals = [float(total) for total in np.nansum(series.values, axis=1)] if series.values.size else [0.0] * len(series.periods)
+            data: Dict[str, Any] = {"line_item_id": line_item_id, "periods": series.periods, "totals": totals}
+            if top is None:
+                data["symbols"] = series.symbols
+                data["values"] = [[None if np.isnan(v) else float(v) for v in row] for row in series.values]
+            else:
+                data["top"] = top
+                data["rankings"] = [
+                    [{"rank": rank, "symbol": symbol, "value": value} for rank, (symbol, value) in enumerate(ranking, start=1)]
+                    for ranking in series.top_n(top)
+                ]
+            return make_json_payload(data)
+        return market_cap_series_payload_cache.get_or_load((line_item_id, top), build)
+
     def get_market_cap(
         self,
         line_item_id: int,
@@ -469,12 +737,16 @@ market_data_service = MarketDataService()
 def get_market_data_service() -> MarketDataService:
     return market_data_service
 
+register_invalidation_hook(TAG_FINANCIAL_REPORTS, market_data_service.warm_market_cap_cache)
+
 # ==== NEWS SERVICE (from news_service.py) ====
 def fetch_all_news() -> List[Dict[str, Any]]:
     client = get_supabase_client()
     try:
-        response = client.table("news").select("*").execute()
-        return response.data if response.data else []
+        news: List[Dict[str, Any]] = []
+        for page in iter_pages(lambda: client.table("news").select("*"), keyset="id"):
+            news.extend(page)
+        return news
     except Exception as e:
         print(f"Error fetching all news: {e}")
         return []
@@ -0,0 +1,140 @@
+# app/services/upstream_executor.py
+"""
+Thread pool có giới hạn cho các lời gọi blocking tới upstream (vnstock, supabase-py),
+để các handler async không chặn event loop.
+"""
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class UpstreamError(Exception):
+    """Lỗi của lớp executor (không phải lỗi do chính lời gọi upstream ném ra)."""
+    status_code: int = 503
+
+
+class UpstreamBusyError(UpstreamError):
+    """Hàng đợi của executor đã đầy, từ chối nhận thêm lời gọi."""
+    status_code = 503
+
+
+class UpstreamTimeoutError(UpstreamError):
+    """Lời gọi upstream vượt quá thời gian cho phép."""
+    status_code = 504
+
+
+class UpstreamExecutor:
+    """
+    Chạy hàm blocking trên thread pool riêng với số worker cố định, giới hạn số lời gọi đang chờ
+    và timeout cho từng lời gọi. Lời gọi bị timeout/cancel sẽ bị huỷ nếu chưa bắt đầu chạy;
+    nếu đã chạy thì thread vẫn chạy nốt nhưng kết quả bị bỏ qua.
+    """
+    def __init__(self, max_workers: int, max_pending: int, default_timeout: Optional[float]):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.default_timeout = default_timeout
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self._counters: Dict[str, int] = {
+            "submitted": 0, "completed": 0, "failed": 0,
+            "timed_out": 0, "cancelled": 0, "rejected": 0
+        }
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="upstream")
+                    logger.info(f"Upstream executor started with {self.max_workers} workers (max pending: {self.max_pending}).")
+        return self._executor
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def _invoke(self, func: Callable[[], T]) -> T:
+        with self._lock:
+            self._running += 1
+        try:
+            return func()
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    def _on_done(self, future) -> None:
+        with self._lock:
+            self._pending -= 1
+            if future.cancelled():
+                return
+            if future.exception() is not None:
+                self._counters["failed"] += 1
+            else:
+                self._counters["completed"] += 1
+
+    async def run(self, func: Callable[..., T], *args: Any, timeout: Optional[float] = None, **kwargs: Any) -> T:
+        call_name = getattr(func, "__qualname__", repr(func))
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._counters["rejected"] += 1
+                logger.warning(f"Upstream executor saturated ({self._pending} pending). Rejecting call to {call_name}.")
+                raise UpstreamBusyError(f"Upstream executor is busy ({self._pending} calls pending).")
+            self._pending += 1
+            self._counters["submitted"] += 1
+        future = self._get_executor().submit(self._invoke, partial(func, *args, **kwargs))
+        future.add_done_callback(self._on_done)
+        effective_timeout = self.default_timeout if timeout is None else timeout
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout=effective_timeout)
+        except asyncio.TimeoutError:
+            future.cancel()
+            self._count("timed_out")
+            logger.warning(f"Upstream call to {call_name} timed out after {effective_timeout}s.")
+            raise UpstreamTimeoutError(f"Upstream call to {call_name} timed out after {effective_timeout}s.")
+        except asyncio.CancelledError:
+            future.cancel()
+            self._count("cancelled")
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "default_timeout_seconds": self.default_timeout,
+                "running": self._running,
+                "queue_depth": max(self._pending - self._running, 0),
+                "pending": self._pending,
+                **self._counters
+            }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            logger.info("Shutting down upstream executor.")
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+upstream_executor = UpstreamExecutor(
+    max_workers=settings.UPSTREAM_MAX_WORKERS,
+    max_pending=settings.UPSTREAM_MAX_PENDING,
+    default_timeout=settings.UPSTREAM_CALL_TIMEOUT_SECONDS
+)
+
+async def run_upstream(func: Callable[..., T], *args: Any, timeout: Optional[float] = None, **kwargs: Any) -> T:
+    return await upstream_executor.run(func, *args, timeout=timeout, **kwargs)
+
+def get_upstream_executor() -> UpstreamExecutor:
+    return upstream_executor
@@ -1,3 +1,6 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
@@ -7,8 +10,61 @@ from app.controllers.information_controller import router as information_router
 from app.controllers.analytics_controller import router as analytics_router
 from app.controllers.report_controller import router as report_router
 from app.controllers.stock_controller import router as stock_router
+from app.services.priceboard_service import price_board_broadcaster
+from app.services.upstream_executor import upstream_executor, run_upstream
+from app.services.ingestion_scheduler import ingestion_scheduler, IngestionJob
+from app.services.tong_quan_service import get_index_service, get_market_data_service, warm_total_capital_cache
+from app.services.stock_service import sync_all_transaction_prices
+from app.services.catalog_service import reference_catalog
+from app.services.http_pool import http_pool
+from app.config import settings, validate_supabase_settings
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+def register_ingestion_jobs():
+    index_service = get_index_service()
+    ingestion_scheduler.register(IngestionJob(
+        "index_history", index_service.sync_all_indices,
+        trading_interval=settings.INDEX_SYNC_INTERVAL_SECONDS,
+        off_hours_interval=settings.INGESTION_OFF_HOURS_INTERVAL_SECONDS
+    ))
+    ingestion_scheduler.register(IngestionJob(
+        "transaction_price",
+        lambda: run_upstream(sync_all_transaction_prices, settings.BANK_SYMBOLS, timeout=settings.STOCK_SYNC_TIMEOUT_SECONDS),
+        trading_interval=settings.STOCK_SYNC_INTERVAL_SECONDS,
+        off_hours_interval=settings.INGESTION_OFF_HOURS_INTERVAL_SECONDS
+    ))
+
+async def warm_caches():
+    """Nạp sẵn các cache số liệu tài chính cho kỳ mặc định, chạy nền để không chặn khởi động."""
+    warmers = [warm_total_capital_cache, get_market_data_service().warm_market_cap_cache]
+    results = await asyncio.gather(*(run_upstream(warmer) for warmer in warmers), return_exceptions=True)
+    for warmer, result in zip(warmers, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Cache warm-up {warmer.__qualname__} failed (will load on first request): {result}")
+    logger.info("Financial cache warm-up finished.")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    validate_supabase_settings(settings)
+    app.state.price_board_broadcaster = price_board_broadcaster
+    app.state.ingestion_scheduler = ingestion_scheduler
+    app.state.http_pool = http_pool
+    app.state.reference_catalog = reference_catalog
+    reference_catalog.start()
+    app.state.cache_warmup_task = asyncio.create_task(warm_caches())
+    if settings.INGESTION_ENABLED:
+        register_ingestion_jobs()
+        ingestion_scheduler.start()
+    yield
+    app.state.cache_warmup_task.cancel()
+    await ingestion_scheduler.stop()
+    await reference_catalog.stop()
+    await price_board_broadcaster.stop()
+    upstream_executor.shutdown()
+    await http_pool.aclose()
+
+app = FastAPI(lifespan=lifespan)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
@@ -224,6 +224,20 @@ const metrics = [
 ];
 let chartCanvas, chartContainer, chartMessageElement, ctx, buttonsContainer, loadingIndicator, errorIndicator;
 let currentChart = null;
+// Dữ liệu của mọi metric, nạp một lần bằng endpoint batch: lineItemId -> [{symbol, value}]
+const metricDataCache = new Map();
+let metricPrefetch = null;
+function prefetchAllMetrics() {
+  const ids = metrics.map((m) => m.lineItemId).join(",");
+  const apiUrl = `/api/financial/chart-data?line_item_ids=${ids}&periods=${CHART_YEAR}${CHART_QUARTER}`;
+  metricPrefetch = fetch(apiUrl, { headers: { Accept: "application/json" } })
+    .then((response) => (response.ok ? response.json() : []))
+    .then((items) => {
+      items.forEach((item) => metricDataCache.set(item.line_item_id, item.data));
+    })
+    .catch((err) => console.warn("[FETCH] Batched metric prefetch failed, falling back to per-metric requests:", err));
+  return metricPrefetch;
+}
 function getRandomColor() {
   const hue = Math.floor(Math.random() * 360);
   return `hsla(${hue}, 70%, 75%, 0.85)`;
@@ -359,7 +373,14 @@ async function fetchDataFromAPI(lineItemId) {
   if (!loadingIndicator || !errorIndicator) return null;
   loadingIndicator.style.display = "block";
   errorIndicator.style.display = "none";
-  const apiUrl = `/api/financial/chart-data/${lineItemId}`;
+  if (metricPrefetch) {
+    await metricPrefetch;
+  }
+  if (metricDataCache.has(lineItemId)) {
+    loadingIndicator.style.display = "none";
+    return metricDataCache.get(lineItemId);
+  }
+  const apiUrl = `/api/financial/chart-data/${lineItemId}?year=${CHART_YEAR}&quarter=${CHART_QUARTER}`;
   console.log(`[FETCH] Requesting data from: ${apiUrl}`);
   try {
     const response = await fetch(apiUrl, { method: "GET", headers: { Accept: "application/json" } });
@@ -428,6 +449,7 @@ function initializePage() {
     currentChart = null;
   }
   showChartMessage("Vui lòng chọn một chỉ số tài chính để xem biểu đồ.");
+  prefetchAllMetrics();
   let firstButtonElement = null;
   buttonsContainer.innerHTML = "";
   metrics.forEach((metric, index) => {
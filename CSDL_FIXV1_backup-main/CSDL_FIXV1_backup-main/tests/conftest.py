@@ -0,0 +1,8 @@
+# tests/conftest.py
+import os
+
+# app.config đọc biến môi trường khi import; test không gọi Supabase nên chỉ cần giá trị giả
+os.environ.setdefault("SUPABASE_URL", "https://test.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "test-key")
+os.environ.setdefault("STOCK_SUPABASE_URL", "https://test-stock.supabase.co")
+os.environ.setdefault("STOCK_SUPABASE_KEY", "test-key")
@@ -0,0 +1,122 @@
+# tests/fake_supabase.py
+"""
+Client supabase-py tối giản trong bộ nhớ cho test: table(...).select/eq/gt/.../order/limit/range/execute,
+upsert theo khoá on_conflict và rpc. Bộ lọc dạng "bang.cot" đi vào dict lồng nhau (embedded join đã dựng sẵn
+trong dòng); select không chiếu cột.
+"""
+import copy
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
+
+
+def _lookup(row: Dict[str, Any], column: str) -> Any:
+    value: Any = row
+    for part in column.split('.'):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+class FakeSupabase:
+    def __init__(self, tables: Optional[Dict[str, List[Dict[str, Any]]]] = None,
+                 rpcs: Optional[Dict[str, Callable[[Dict[str, Any]], List[Dict[str, Any]]]]] = None):
+        self.tables: Dict[str, List[Dict[str, Any]]] = {name: [dict(row) for row in rows] for name, rows in (tables or {}).items()}
+        self.rpcs = rpcs or {}
+        self.calls: List[tuple] = []
+
+    def table(self, name: str) -> "FakeRequest":
+        return FakeRequest(self, name)
+
+    def rpc(self, name: str, params: Dict[str, Any]) -> "FakeRequest":
+        self.calls.append(('rpc', name, dict(params)))
+        return FakeRequest(self, name, result=self.rpcs[name](params))
+
+    def rows(self, name: str) -> List[Dict[str, Any]]:
+        return self.tables.setdefault(name, [])
+
+
+class FakeRequest:
+    def __init__(self, client: FakeSupabase, name: str, result: Optional[List[Dict[str, Any]]] = None):
+        self.client = client
+        self.name = name
+        self.result = result
+        self.filters: List[Callable[[Dict[str, Any]], bool]] = []
+        self.orders: List[tuple] = []
+        self._limit: Optional[int] = None
+        self._range: Optional[tuple] = None
+        self._upsert: Optional[tuple] = None
+
+    def select(self, *columns: str, **kwargs: Any) -> "FakeRequest":
+        return self
+
+    def _filter(self, column: str, predicate: Callable[[Any], bool]) -> "FakeRequest":
+        self.filters.append(lambda row: predicate(_lookup(row, column)))
+        return self
+
+    def eq(self, column: str, value: Any) -> "FakeRequest":
+        return self._filter(column, lambda v: v == value)
+
+    def gt(self, column: str, value: Any) -> "FakeRequest":
+        return self._filter(column, lambda v: v is not None and v > value)
+
+    def gte(self, column: str, value: Any) -> "FakeRequest":
+        return self._filter(column, lambda v: v is not None and v >= value)
+
+    def lt(self, column: str, value: Any) -> "FakeRequest":
+        return self._filter(column, lambda v: v is not None and v < value)
+
+    def lte(self, column: str, value: Any) -> "FakeRequest":
+        return self._filter(column, lambda v: v is not None and v <= value)
+
+    def in_(self, column: str, values: Any) -> "FakeRequest":
+        values = list(values)
+        return self._filter(column, lambda v: v in values)
+
+    def order(self, column: str, desc: bool = False) -> "FakeRequest":
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, size: int) -> "FakeRequest":
+        self._limit = size
+        return self
+
+    def range(self, start: int, end: int) -> "FakeRequest":
+        self._range = (start, end)
+        return self
+
+    def upsert(self, records: List[Dict[str, Any]], on_conflict: str = "", ignore_duplicates: bool = False) -> "FakeRequest":
+        self._upsert = (records, [column.strip() for column in on_conflict.split(',')], ignore_duplicates)
+        return self
+
+    def execute(self) -> SimpleNamespace:
+        if self.result is not None:
+            return SimpleNamespace(data=copy.deepcopy(self.result))
+        if self._upsert is not None:
+            return SimpleNamespace(data=self._execute_upsert(*self._upsert))
+        self.client.calls.append(('select', self.name))
+        rows = [row for row in self.client.rows(self.name) if all(f(row) for f in self.filters)]
+        for column, desc in reversed(self.orders):
+            rows.sort(key=lambda row: _lookup(row, column), reverse=desc)
+        if self._range:
+            rows = rows[self._range[0]:self._range[1] + 1]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        return SimpleNamespace(data=copy.deepcopy(rows))
+
+    def _execute_upsert(self, records: List[Dict[str, Any]], keys: List[str], ignore_duplicates: bool) -> List[Dict[str, Any]]:
+        self.client.calls.append(('upsert', self.name, len(records), ignore_duplicates))
+        table = self.client.rows(self.name)
+        index = {tuple(row[key] for key in keys): row for row in table}
+        written: List[Dict[str, Any]] = []
+        for record in records:
+            existing = index.get(tuple(record[key] for key in keys))
+            if existing is None:
+                row = dict(record)
+                table.append(row)
+                index[tuple(row[key] for key in keys)] = row
+            elif ignore_duplicates:
+                continue
+            else:
+                existing.update(record)
+                row = existing
+            written.append(dict(row))
+        return written
@@ -0,0 +1,27 @@
+# tests/fake_vnstock.py
+"""Thay cho `Vnstock` trong test: Vnstock().stock(symbol, source).quote.history(start, end) đọc từ DataFrame theo mã."""
+from types import SimpleNamespace
+from typing import Dict, List, Tuple
+
+import pandas as pd
+
+
+class FakeVnstockFeed:
+    def __init__(self, frames: Dict[str, pd.DataFrame]):
+        self.frames = frames
+        self.requests: List[Tuple[str, str, str]] = []
+
+    def __call__(self) -> "FakeVnstockFeed":
+        # Dùng chính feed làm class Vnstock: Vnstock() trả về feed
+        return self
+
+    def stock(self, symbol: str, source: str = 'VCI') -> SimpleNamespace:
+        def history(start: str, end: str) -> pd.DataFrame:
+            self.requests.append((symbol, start, end))
+            frame = self.frames.get(symbol, pd.DataFrame(columns=['time']))
+            return frame[(frame['time'] >= start) & (frame['time'] <= end)].copy()
+        return SimpleNamespace(quote=SimpleNamespace(history=history))
+
+
+def daily_bars(*rows) -> pd.DataFrame:
+    return pd.DataFrame(rows, columns=['time', 'open', 'high', 'low', 'close', 'volume'])
@@ -0,0 +1,80 @@
+# tests/test_catalog_service.py
+import asyncio
+
+import pytest
+
+from app.services import catalog_service
+from app.services.catalog_service import CatalogSnapshot, ReferenceCatalog
+
+TABLES = {
+    "stocks": [{"stock_id": 1, "symbol": "VCB"}, {"stock_id": 2, "symbol": "BID"}, {"stock_id": 3, "symbol": None}],
+    "report_types": [{"report_type_id": 1, "name": "BCĐKT"}, {"report_type_id": 2, "name": "KQKD"}],
+    "line_items": [
+        {"line_item_id": 2, "line_item_name": "Tổng tài sản", "report_type_id": 1},
+        {"line_item_id": 49, "line_item_name": "LN sau thuế", "report_type_id": 2},
+        {"line_item_id": 88, "line_item_name": "Tổng nguồn vốn", "report_type_id": 1}
+    ]
+}
+
+
+@pytest.fixture
+def fetches(monkeypatch):
+    calls = []
+
+    async def fetch_table(table, order):
+        calls.append(table)
+        if isinstance(TABLES.get(table), Exception):
+            raise TABLES[table]
+        return [dict(row) for row in TABLES[table]]
+    monkeypatch.setattr(catalog_service, "_fetch_table", fetch_table)
+    return calls
+
+
+def test_snapshot_indexes_lookups():
+    snapshot = CatalogSnapshot.build(TABLES["stocks"], TABLES["report_types"], TABLES["line_items"])
+    assert snapshot.stock_id_by_symbol == {"VCB": 1, "BID": 2}
+    assert snapshot.line_item_name_by_id[88] == "Tổng nguồn vốn"
+    assert [item["line_item_id"] for item in snapshot.line_items_by_report_type[1]] == [2, 88]
+    assert snapshot.loaded_at is not None
+
+
+def test_ensure_loaded_fetches_once(fetches):
+    async def scenario():
+        catalog = ReferenceCatalog(refresh_interval=3600)
+        assert not catalog.loaded
+        first, second = await asyncio.gather(catalog.ensure_loaded(), catalog.ensure_loaded())
+        assert first is second
+        assert catalog.loaded
+        assert sorted(fetches) == ["line_items", "report_types", "stocks"]
+        assert catalog.stats()["refresh_count"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_failed_refresh_keeps_previous_snapshot(fetches, monkeypatch):
+    async def scenario():
+        catalog = ReferenceCatalog(refresh_interval=3600)
+        await catalog.load()
+        snapshot = catalog.snapshot
+        monkeypatch.setitem(TABLES, "line_items", RuntimeError("db down"))
+        with pytest.raises(RuntimeError):
+            await catalog.load()
+        assert catalog.snapshot is snapshot
+        assert catalog.stats()["last_error"] == "db down"
+
+    asyncio.run(scenario())
+
+
+def test_background_refresh_replaces_snapshot_and_stops(fetches, monkeypatch):
+    async def scenario():
+        catalog = ReferenceCatalog(refresh_interval=0.01)
+        catalog.start()
+        await asyncio.sleep(0.05)
+        monkeypatch.setitem(TABLES, "stocks", TABLES["stocks"] + [{"stock_id": 4, "symbol": "CTG"}])
+        await asyncio.sleep(0.05)
+        await catalog.stop()
+        assert catalog.snapshot.stock_id_by_symbol["CTG"] == 4
+        assert catalog.refresh_count >= 2
+        assert catalog._task is None
+
+    asyncio.run(scenario())
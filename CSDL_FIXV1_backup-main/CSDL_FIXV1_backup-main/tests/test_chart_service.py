@@ -0,0 +1,72 @@
+# tests/test_chart_service.py
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.services.chart_service import ChartService, lttb_indices, resample_ohlcv
+from app.services.history_cache import OhlcvSeries
+
+
+def daily_frame(rows: int = 300) -> pd.DataFrame:
+    rng = np.random.default_rng(3)
+    close = 50 + np.cumsum(rng.normal(0, 1, rows))
+    high = close + rng.uniform(0, 2, rows)
+    high[::17] = np.nan
+    return pd.DataFrame({
+        'time': pd.bdate_range('2023-01-02', periods=rows),
+        'open': close - 0.5,
+        'high': high,
+        'low': close - rng.uniform(0, 2, rows),
+        'close': close,
+        'volume': rng.integers(100, 1000, rows).astype(float)
+    })
+
+
+@pytest.mark.parametrize('resolution, rule', [('W', 'W-SUN'), ('M', 'MS'), ('Q', 'QS')])
+def test_resample_matches_pandas(resolution, rule):
+    frame = daily_frame()
+    bars = resample_ohlcv(OhlcvSeries.from_frame(frame).snapshot(), resolution)
+    expected = frame.set_index('time').resample(rule) \
+        .agg({'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'volume': 'sum'}) \
+        .dropna(subset=['close'])
+
+    first_days = frame.groupby(frame['time'].dt.to_period(resolution))['time'].min()
+    assert bars['time'].tolist() == first_days.to_numpy().astype('datetime64[D]').tolist()
+    for name in ('open', 'high', 'low', 'close', 'volume'):
+        np.testing.assert_allclose(bars[name], expected[name].to_numpy())
+
+
+def test_lttb_keeps_endpoints_and_extremes():
+    x = np.arange(1000)
+    y = np.sin(x / 50.0)
+    y[500] = 10.0
+    indices = lttb_indices(x, y, 50)
+    assert len(indices) == 50
+    assert indices[0] == 0 and indices[-1] == 999
+    assert np.all(np.diff(indices) > 0)
+    assert 500 in indices
+
+
+def test_lttb_returns_all_points_when_threshold_not_smaller():
+    assert lttb_indices(np.arange(10), np.arange(10.0), 10).tolist() == list(range(10))
+
+
+def test_chart_recomputed_after_new_bars():
+    frame = daily_frame(100)
+    series = OhlcvSeries.from_frame(frame.iloc[:80])
+    service = ChartService(max_entries=8)
+    assert service.get_chart('stock', 'VCB', series, 'D', 20)['total_bars'] == 80
+    series.append_frame(frame.iloc[80:])
+    chart = service.get_chart('stock', 'VCB', series, 'D', 20)
+    assert chart['total_bars'] == 100
+    assert chart['points'] == 20
+    assert chart['time'][-1] == str(frame['time'].iloc[-1].date())
+
+
+def test_chart_cache_is_bounded():
+    series = OhlcvSeries.from_frame(daily_frame(60))
+    service = ChartService(max_entries=2)
+    for symbol in ('A', 'B', 'C'):
+        service.get_chart('stock', symbol, series, 'W', 5)
+    assert list(service._bars) == [('stock', 'B'), ('stock', 'C')]
+    assert len(service._downsampled) == 2
@@ -0,0 +1,124 @@
+# tests/test_history_cache.py
+import threading
+import time
+
+import pandas as pd
+
+from app.services.history_cache import HistoryCache, OhlcvSeries
+
+
+def bars(*rows):
+    return pd.DataFrame(rows, columns=['time', 'open', 'high', 'low', 'close', 'volume'])
+
+
+class FrameLoader:
+    """Loader của HistoryCache đọc từ một DataFrame có thể sửa giữa các lần refresh."""
+    def __init__(self, frame: pd.DataFrame):
+        self.frame = frame
+        self.calls = []
+
+    def __call__(self, key, after_date):
+        self.calls.append(after_date)
+        if after_date is None:
+            return self.frame.copy()
+        return self.frame[self.frame['time'] > after_date].copy()
+
+
+def test_append_frame_appends_new_days_and_skips_unchanged_last_day():
+    series = OhlcvSeries.from_frame(bars(('2025-06-02', 1, 2, 0.5, 1.5, 100)))
+    version = series.version
+
+    assert series.append_frame(bars(('2025-06-02', 1, 2, 0.5, 1.5, 100))) == 0
+    assert series.version == version
+
+    assert series.append_frame(bars(('2025-06-02', 1, 2, 0.5, 1.5, 100), ('2025-06-03', 2, 3, 1, 2.5, 50))) == 1
+    assert series.size == 2
+    assert series.rewritten_version == 0
+
+
+def test_append_frame_overwrites_last_session():
+    series = OhlcvSeries.from_frame(bars(('2025-06-02', 1, 2, 0.5, 1.5, 100), ('2025-06-03', 2, 3, 1, 2.5, 50)))
+
+    changed = series.append_frame(bars(('2025-06-03', 2, 4, 1, 3.5, 80), ('2025-06-04', 3, 4, 2, 3, 10)))
+
+    assert changed == 2
+    assert series.size == 3
+    assert series.column('close').tolist() == [1.5, 3.5, 3.0]
+    assert series.column('volume').tolist() == [100, 80, 10]
+    assert series.rewritten_version == series.version
+
+
+def test_refresh_rereads_last_day_and_picks_up_closing_values():
+    loader = FrameLoader(bars(('2025-06-02', 1, 2, 0.5, 1.5, 100), ('2025-06-03', 2, 3, 1, 2.0, 40)))
+    cache = HistoryCache(loader)
+    series = cache.refresh('VCB')
+    assert series.column('close').tolist() == [1.5, 2.0]
+
+    # Lần đồng bộ sau trong cùng phiên ghi đè nến 2025-06-03 trong DB
+    loader.frame = bars(('2025-06-02', 1, 2, 0.5, 1.5, 100), ('2025-06-03', 2, 3, 1, 2.7, 90))
+    assert cache.refresh('VCB') is series
+    assert loader.calls[-1] == '2025-06-02'
+    assert series.size == 2
+    assert series.column('close').tolist() == [1.5, 2.7]
+    assert series.tail_frame(1)['volume'].tolist() == [90]
+
+
+def test_refresh_without_changes_keeps_version():
+    loader = FrameLoader(bars(('2025-06-02', 1, 2, 0.5, 1.5, 100)))
+    cache = HistoryCache(loader)
+    version = cache.refresh('VCB').version
+    assert cache.refresh('VCB').version == version
+
+
+
+def test_snapshot_is_unaffected_by_later_appends_and_rewrites():
+    series = OhlcvSeries.from_frame(bars(('2025-06-02', 1, 2, 0.5, 1.5, 100)))
+    before = series.snapshot()
+
+    series.append_frame(bars(('2025-06-02', 1, 2, 0.5, 1.9, 120), ('2025-06-03', 2, 3, 1, 2.5, 50)))
+
+    assert before.size == 1
+    assert before.column('close').tolist() == [1.5]
+    assert not before.column('close').flags.writeable
+    after = series.snapshot()
+    assert after.size == 2
+    assert after.column('close').tolist() == [1.9, 2.5]
+    assert after.version > before.version
+
+
+def test_snapshot_columns_stay_aligned_while_another_thread_appends():
+    series = OhlcvSeries(capacity=1)
+    dates = pd.bdate_range('2015-01-01', periods=400).strftime('%Y-%m-%d')
+    done = threading.Event()
+    mismatches = []
+
+    def writer():
+        for i, day in enumerate(dates):
+            series.append_frame(bars((day, i, i, i, i, i)))
+        done.set()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    while not done.is_set():
+        snapshot = series.snapshot()
+        lengths = {len(snapshot.time), *(len(column) for column in snapshot.columns.values())}
+        if lengths != {snapshot.size} or (snapshot.size and snapshot.column('close')[-1] != snapshot.size - 1):
+            mismatches.append(snapshot.size)
+        time.sleep(0)
+    thread.join()
+    assert mismatches == []
+    assert series.size == len(dates)
+
+
+def test_empty_load_is_not_cached_and_lru_evicts_series_with_its_lock():
+    frames = {key: bars(('2025-06-02', i, i, i, i, i)) for i, key in enumerate(('A', 'B', 'C'), start=1)}
+    cache = HistoryCache(lambda key, after: frames.get(key, pd.DataFrame()), max_series=2)
+
+    assert cache.refresh('missing').size == 0
+    assert cache.get('missing') is None
+    assert 'missing' not in cache._locks
+    for key in ('A', 'B', 'C'):
+        cache.refresh(key)
+    assert cache.get('A') is None
+    assert list(cache._series) == ['B', 'C']
+    assert set(cache._locks) <= {'B', 'C'}
@@ -0,0 +1,104 @@
+# tests/test_http_pool.py
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from app.config import settings, validate_supabase_settings
+from app.services import http_pool as http_pool_module
+from app.services.http_pool import HttpPool, _RetryingTransport
+
+
+def flaky(*failures):
+    """Handler MockTransport: lần lượt trả lỗi / mã trạng thái trong `failures`, sau đó 200."""
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.method)
+        if len(calls) <= len(failures):
+            failure = failures[len(calls) - 1]
+            if isinstance(failure, Exception):
+                raise failure
+            return httpx.Response(failure)
+        return httpx.Response(200, json={"ok": True})
+    return handler, calls
+
+
+def make_pool(attempts=3) -> HttpPool:
+    return HttpPool(retry_attempts=attempts, retry_backoff=0, retry_max_backoff=0)
+
+
+def test_async_get_retries_transient_failures():
+    handler, calls = flaky(httpx.ConnectError("refused"), 503)
+    pool = make_pool()
+    pool._async_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    response = asyncio.run(pool.get("https://db.test/rest/v1/stocks"))
+    assert response.status_code == 200
+    assert calls == ["GET"] * 3
+    assert pool.stats()["retries"] == 2
+
+
+def test_async_gives_up_after_attempts_and_returns_last_response():
+    handler, calls = flaky(503, 503, 503, 503)
+    pool = make_pool(attempts=2)
+    pool._async_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    assert asyncio.run(pool.get("https://db.test/x")).status_code == 503
+    assert len(calls) == 2
+
+
+def test_async_writes_are_not_retried():
+    handler, calls = flaky(503)
+    pool = make_pool()
+    pool._async_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    assert asyncio.run(pool.request("POST", "https://db.test/x", json={})).status_code == 503
+    assert calls == ["POST"]
+
+
+def test_sync_client_retries_reads_through_transport():
+    handler, calls = flaky(httpx.ReadTimeout("slow"), 429)
+    pool = make_pool()
+    pool._sync_client = httpx.Client(transport=_RetryingTransport(pool, httpx.MockTransport(handler)))
+    assert pool.sync_client.get("https://db.test/x").json() == {"ok": True}
+    assert calls == ["GET"] * 3
+    assert pool.stats()["retries"] == 2
+
+
+def test_sync_client_does_not_retry_writes_and_raises_last_error():
+    handler, calls = flaky(502)
+    pool = make_pool()
+    pool._sync_client = httpx.Client(transport=_RetryingTransport(pool, httpx.MockTransport(handler)))
+    assert pool.sync_client.post("https://db.test/x", json=[]).status_code == 502
+    assert calls == ["POST"]
+
+    handler, calls = flaky(*[httpx.ConnectError("refused")] * 3)
+    pool._sync_client = httpx.Client(transport=_RetryingTransport(pool, httpx.MockTransport(handler)))
+    with pytest.raises(httpx.ConnectError):
+        pool.sync_client.get("https://db.test/x")
+    assert len(calls) == 3
+    assert pool.stats()["failed"] == 1
+
+
+def test_default_sync_client_uses_retrying_transport():
+    pool = make_pool()
+    assert isinstance(pool.sync_client._transport, _RetryingTransport)
+    asyncio.run(pool.aclose())
+
+
+def test_aclose_drops_cached_supabase_clients(monkeypatch):
+    cleared = []
+    for name in ("get_supabase_client", "get_stock_supabase_client"):
+        monkeypatch.setattr(http_pool_module, name, SimpleNamespace(cache_clear=lambda name=name: cleared.append(name)))
+    pool = make_pool()
+    sync_client = pool.sync_client
+    asyncio.run(pool.aclose())
+    assert sync_client.is_closed
+    assert cleared == ["get_supabase_client", "get_stock_supabase_client"]
+    assert pool.sync_client is not sync_client
+    asyncio.run(pool.aclose())
+
+
+def test_validate_supabase_settings_fails_fast(monkeypatch):
+    monkeypatch.setattr(settings, "STOCK_SUPABASE_KEY", "")
+    with pytest.raises(RuntimeError, match="STOCK_SUPABASE_KEY"):
+        validate_supabase_settings(settings)
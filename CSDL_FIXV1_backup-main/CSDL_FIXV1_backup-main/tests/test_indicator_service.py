@@ -0,0 +1,87 @@
+# tests/test_indicator_service.py
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.services.history_cache import OhlcvSeries
+from app.services.indicator_service import INDICATORS, IndicatorEngine, resolve_params
+
+
+def ohlcv_frame(rows: int, seed: int = 7) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(0, 1, rows))
+    spread = rng.uniform(0.1, 2.0, rows)
+    return pd.DataFrame({
+        'time': pd.bdate_range('2020-01-01', periods=rows).strftime('%Y-%m-%d'),
+        'open': close + rng.normal(0, 0.5, rows),
+        'high': close + spread,
+        'low': close - spread,
+        'close': close,
+        'volume': rng.integers(1_000, 10_000, rows)
+    })
+
+
+@pytest.mark.parametrize('indicator', sorted(INDICATORS))
+@pytest.mark.parametrize('chunks', [[120, 1, 1, 1], [60, 25, 40], [3, 2, 200]])
+def test_incremental_matches_full_recompute(indicator, chunks):
+    frame = ohlcv_frame(sum(chunks))
+    params = resolve_params(indicator, {})
+    engine = IndicatorEngine(max_entries=16)
+
+    series = OhlcvSeries.from_frame(frame.iloc[:chunks[0]])
+    engine.compute('stock', 'VCB', series, indicator, params)
+    start = chunks[0]
+    for size in chunks[1:]:
+        series.append_frame(frame.iloc[start:start + size])
+        start += size
+        incremental = engine.compute('stock', 'VCB', series, indicator, params)
+
+    full = IndicatorEngine(max_entries=16).compute('stock', 'VCB', OhlcvSeries.from_frame(frame), indicator, params)
+    assert incremental.keys() == full.keys()
+    for name in full:
+        assert len(incremental[name]) == len(frame)
+        np.testing.assert_allclose(incremental[name], full[name], rtol=1e-9, atol=1e-9, equal_nan=True)
+
+
+def test_sma_matches_pandas_rolling_mean():
+    frame = ohlcv_frame(80)
+    result = IndicatorEngine(max_entries=4).compute('stock', 'VCB', OhlcvSeries.from_frame(frame), 'sma', {'window': 10})
+    np.testing.assert_allclose(result['sma'], frame['close'].rolling(10).mean().to_numpy(), equal_nan=True)
+
+
+def test_resolve_params_rejects_invalid_input():
+    with pytest.raises(ValueError):
+        resolve_params('unknown', {})
+    with pytest.raises(ValueError):
+        resolve_params('sma', {'fast': 3})
+    with pytest.raises(ValueError):
+        resolve_params('macd', {'fast': 30, 'slow': 26})
+    assert resolve_params('bollinger', {'window': 10.0, 'k': 1.5}) == {'window': 10, 'k': 1.5}
+
+
+def test_engine_cache_is_bounded():
+    engine = IndicatorEngine(max_entries=2)
+    series = OhlcvSeries.from_frame(ohlcv_frame(40))
+    for window in (5, 10, 15):
+        engine.compute('stock', 'VCB', series, 'sma', {'window': window})
+    assert len(engine._cache) == 2
+
+
+@pytest.mark.parametrize('indicator', sorted(INDICATORS))
+def test_rewritten_last_bar_is_recomputed(indicator):
+    frame = ohlcv_frame(90)
+    params = resolve_params(indicator, {})
+    engine = IndicatorEngine(max_entries=16)
+    series = OhlcvSeries.from_frame(frame.iloc[:60])
+    engine.compute('stock', 'VCB', series, indicator, params)
+
+    # Nến cuối được lưu khi còn trong phiên, rồi được ghi đè bằng giá đóng cửa cùng lúc với các nến mới
+    revised = frame.iloc[59:].copy()
+    revised.loc[revised.index[0], ['high', 'close']] += 3.0
+    series.append_frame(revised)
+    incremental = engine.compute('stock', 'VCB', series, indicator, params)
+
+    expected_frame = pd.concat([frame.iloc[:59], revised])
+    full = IndicatorEngine(max_entries=16).compute('stock', 'VCB', OhlcvSeries.from_frame(expected_frame), indicator, params)
+    for name in full:
+        np.testing.assert_allclose(incremental[name], full[name], rtol=1e-9, atol=1e-9, equal_nan=True)
@@ -0,0 +1,221 @@
+# tests/test_information_service.py
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from app.config import settings
+from app.services import information_service
+from app.services.catalog_service import CatalogSnapshot, reference_catalog
+
+STOCKS = [{"stock_id": 1, "symbol": "VCB"}, {"stock_id": 2, "symbol": "BID"}, {"stock_id": 3, "symbol": "CTG"}]
+LINE_ITEMS = [
+    {"line_item_id": 2, "line_item_name": "Tổng tài sản", "report_type_id": 1},
+    {"line_item_id": 8, "line_item_name": "Tín dụng", "report_type_id": 1},
+    {"line_item_id": 49, "line_item_name": "LN sau thuế", "report_type_id": 2}
+]
+
+
+def value_of(stock_id, line_item_id, year, quarter):
+    return stock_id * 10000 + line_item_id * 100 + (year - 2000) + int(quarter[1]) / 10
+
+
+def financial_rows(stock_ids=(1, 2), line_item_ids=(8, 2), years=(2023, 2024)):
+    """financial_data đã embed financial_reports, theo thứ tự report_id như trong DB."""
+    rows, report_id = [], 0
+    for stock_id in stock_ids:
+        for year in years:
+            for quarter in information_service.QUARTERS:
+                report_id += 1
+                report = {"stock_id": stock_id, "report_type_id": 1, "year": year, "quarter": quarter}
+                for line_item_id in line_item_ids:
+                    rows.append({"report_id": report_id, "line_item_id": line_item_id,
+                                 "value": value_of(stock_id, line_item_id, year, quarter), "financial_reports": report})
+    return rows
+
+
+def _lookup(row, column):
+    value = row
+    for part in column.split('.'):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+class FakePostgrest:
+    """Trả lời GET financial_data kiểu PostgREST: bộ lọc eq./in. (cả cột embed "bang.cot"), order, limit/offset."""
+    def __init__(self, rows):
+        self.rows = rows
+        self.requests = []
+
+    async def get(self, url, params=None, headers=None):
+        self.requests.append(dict(params))
+        selected = self.rows
+        for column, expression in params.items():
+            if column in ("select", "order", "limit", "offset"):
+                continue
+            op, _, operand = expression.partition('.')
+            wanted = set(operand[1:-1].split(',')) if op == "in" else {operand}
+            selected = [row for row in selected if str(_lookup(row, column)) in wanted]
+        for key in reversed(params["order"].split(',')):
+            column, _, direction = key.partition('.')
+            selected = sorted(selected, key=lambda row: row[column], reverse=direction == "desc")
+        offset, limit = params["offset"], params["limit"]
+        return httpx.Response(200, json=selected[offset:offset + limit], request=httpx.Request("GET", url))
+
+
+@pytest.fixture
+def catalog(monkeypatch):
+    monkeypatch.setattr(reference_catalog, "_snapshot", CatalogSnapshot.build(STOCKS, [], LINE_ITEMS))
+
+
+def use_rows(monkeypatch, rows, page_size=1000) -> FakePostgrest:
+    client = FakePostgrest(rows)
+    monkeypatch.setattr(information_service, "client", client)
+    monkeypatch.setattr(settings, "SUPABASE_PAGE_SIZE", page_size)
+    return client
+
+
+# ==== BẢNG BÁO CÁO MỘT MÃ ====
+def test_fetch_financial_data_reads_one_embedded_join_query(catalog, monkeypatch):
+    client = use_rows(monkeypatch, financial_rows())
+    records = asyncio.run(information_service.fetch_financial_data("VCB", 1, "quarterly", year_from=2023, year_to=2024))
+    assert [record["item"] for record in records] == ["Tổng tài sản", "Tín dụng"]
+    assert records[1]["2024Q3"] == value_of(1, 8, 2024, "Q3")
+    assert len(client.requests) == 1
+    request = client.requests[0]
+    assert request["financial_reports.stock_id"] == "eq.1"
+    assert request["financial_reports.year"] == "in.(2023,2024)"
+    assert request["select"].startswith("line_item_id,value,financial_reports!inner(")
+
+
+def test_fetch_financial_data_pages_until_short_page(catalog, monkeypatch):
+    client = use_rows(monkeypatch, financial_rows(), page_size=5)
+    records = asyncio.run(information_service.fetch_financial_data("VCB", 1, "quarterly", year_from=2023, year_to=2024))
+    assert len(client.requests) == 4        # 16 dòng của VCB / trang 5
+    assert all(value is not None for record in records for key, value in record.items() if key.startswith("2023"))
+
+
+def test_fetch_financial_data_reports_missing_symbol_and_data(catalog, monkeypatch):
+    use_rows(monkeypatch, financial_rows())
+    assert asyncio.run(information_service.fetch_financial_data("XYZ", 1, "quarterly")) == {"error": "Symbol not found"}
+    assert asyncio.run(information_service.fetch_financial_data("CTG", 1, "quarterly")) == {"error": "No reports found"}
+
+
+# ==== XOAY BẢNG / DẠNG COMPACT ====
+def test_pivot_keeps_first_seen_item_order_and_last_duplicate():
+    columns = {
+        "line_item_id": [8, 2, 8, 99, 8],
+        "value": ["1.5", "2", None, "7", "3.5"],
+        "year": [2024, 2024, 2023, 2024, 2024],
+        "quarter": ["Q1", "Q1", "Q4", "Q1", "Q1"]
+    }
+    names = {2: "Tổng tài sản", 8: "Tín dụng"}
+    table = information_service._pivot_financial_data(columns, names, "quarterly", range(2023, 2025))
+    assert list(table.index) == ["Tín dụng", "Tổng tài sản", "Unknown"]
+    assert list(table.columns) == [f"{y}{q}" for y in (2023, 2024) for q in information_service.QUARTERS]
+    records = information_service._to_records(table)
+    assert records[0]["2024Q1"] == 3.5          # trùng ô: lấy giá trị sau cùng
+    assert records[0]["2023Q4"] is None
+    assert records[2]["2024Q1"] == 7.0
+
+
+def test_compact_format_matches_records(catalog, monkeypatch):
+    use_rows(monkeypatch, financial_rows())
+    fetch = information_service.fetch_financial_data
+    records = asyncio.run(fetch("BID", 1, "quarterly", year_from=2023, year_to=2024))
+    compact = asyncio.run(fetch("BID", 1, "quarterly", format=information_service.FORMAT_COMPACT, year_from=2023, year_to=2024))
+    assert compact["period"] == "quarterly"
+    assert compact["items"] == [record["item"] for record in records]
+    assert [dict(zip(compact["columns"], row), item=item) for item, row in zip(compact["items"], compact["values"])] == records
+    json.dumps(compact)
+
+
+def test_yearly_columns_follow_year_range():
+    assert information_service._period_columns("yearly", range(2021, 2024)) == ["2021", "2022", "2023"]
+    assert information_service._period_columns("quarterly", range(2024, 2025)) == ["2024Q1", "2024Q2", "2024Q3", "2024Q4"]
+
+
+# ==== SO SÁNH NHIỀU MÃ ====
+def test_comparison_builds_symbol_by_period_matrix_per_line_item(catalog, monkeypatch):
+    client = use_rows(monkeypatch, financial_rows(stock_ids=(1, 2)))
+    result = asyncio.run(information_service.fetch_financial_comparison(["BID", "VCB", "BID", "XYZ"], 1, [2, 49], "quarterly", 2024, 2024))
+    assert result["symbols"] == ["BID", "VCB"]
+    assert result["missing_symbols"] == ["XYZ"]
+    assert result["columns"] == ["2024Q1", "2024Q2", "2024Q3", "2024Q4"]
+    total_assets, profit = result["line_items"]
+    assert total_assets["item"] == "Tổng tài sản"
+    assert total_assets["values"][0] == [value_of(2, 2, 2024, q) for q in information_service.QUARTERS]
+    assert total_assets["values"][1][3] == value_of(1, 2, 2024, "Q4")
+    # Không có dữ liệu: ma trận toàn null, vẫn đủ hàng / cột
+    assert profit["values"] == [[None] * 4, [None] * 4]
+    assert len(client.requests) == 1
+    assert client.requests[0]["line_item_id"] == "in.(2,49)"
+
+
+def test_comparison_expands_banks_and_chunks_stock_ids(catalog, monkeypatch):
+    client = use_rows(monkeypatch, financial_rows(stock_ids=(1, 2, 3)))
+    monkeypatch.setattr(settings, "BANK_SYMBOLS", ["VCB", "BID", "CTG"])
+    monkeypatch.setattr(settings, "SUPABASE_IN_CHUNK_SIZE", 2)
+    result = asyncio.run(information_service.fetch_financial_comparison([information_service.ALL_BANKS], 1, [8], "quarterly", 2023, 2024))
+    assert result["symbols"] == ["VCB", "BID", "CTG"]
+    assert sorted(request["financial_reports.stock_id"] for request in client.requests) == ["in.(1,2)", "in.(3)"]
+    values = result["line_items"][0]["values"]
+    assert values[2][0] == value_of(3, 8, 2023, "Q1")
+    assert all(None not in row for row in values)
+
+
+def test_comparison_rejects_bad_requests(catalog, monkeypatch):
+    use_rows(monkeypatch, [])
+    compare = information_service.fetch_financial_comparison
+    assert asyncio.run(compare(["XYZ"], 1, [2], "quarterly", 2024, 2024)) == {"error": "Symbol not found", "missing_symbols": ["XYZ"]}
+    assert "error" in asyncio.run(compare(["VCB"], 1, [], "quarterly", 2024, 2024))
+    assert "error" in asyncio.run(compare(["VCB"], 1, [2], "quarterly", 2025, 2024))
+
+
+# ==== KHOẢNG NĂM / NDJSON ====
+def test_financial_year_range_defaults_and_limits(monkeypatch):
+    assert information_service.financial_year_range(None, None) == information_service.FINANCIAL_DATA_YEARS
+    assert information_service.financial_year_range(2010, 2012) == range(2010, 2013)
+    with pytest.raises(ValueError):
+        information_service.financial_year_range(2024, 2023)
+    monkeypatch.setattr(settings, "FINANCIAL_DATA_MAX_YEARS", 3)
+    with pytest.raises(ValueError):
+        information_service.financial_year_range(2020, 2023)
+
+
+def collect_stream(*args, **kwargs):
+    async def collect():
+        return [chunk async for chunk in information_service.stream_financial_data(*args, **kwargs)]
+    return asyncio.run(collect())
+
+
+def ndjson_lines(chunks):
+    return [json.loads(line) for line in b"".join(chunks).decode("utf-8").splitlines()]
+
+
+@pytest.mark.parametrize("page_size", [3, 8, 1000])
+def test_stream_matches_fetch_across_page_boundaries(catalog, monkeypatch, page_size):
+    rows = financial_rows(stock_ids=(1,), line_item_ids=(2, 8, 49), years=(2022, 2023, 2024))
+    use_rows(monkeypatch, rows)
+    expected = asyncio.run(information_service.fetch_financial_data("VCB", 1, "quarterly", year_from=2022, year_to=2024))
+    client = use_rows(monkeypatch, rows, page_size=page_size)
+    chunks = collect_stream(1, 1, "quarterly", range(2022, 2025))
+    # Theo line_item_id, mỗi chỉ tiêu đúng một dòng dù dữ liệu của nó nằm trên nhiều trang
+    order = ["Tổng tài sản", "Tín dụng", "LN sau thuế"]
+    assert ndjson_lines(chunks) == sorted(expected, key=lambda record: order.index(record["item"]))
+    assert client.requests[0]["order"] == "line_item_id.asc,report_id.asc"
+    if page_size < len(rows):
+        assert len(chunks) > 1
+
+
+def test_compact_stream_sends_header_then_rows(catalog, monkeypatch):
+    use_rows(monkeypatch, financial_rows(stock_ids=(2,), line_item_ids=(2,), years=(2024,)), page_size=2)
+    lines = ndjson_lines(collect_stream(2, 1, "quarterly", range(2024, 2025), format=information_service.FORMAT_COMPACT))
+    assert lines[0] == {"period": "quarterly", "columns": ["2024Q1", "2024Q2", "2024Q3", "2024Q4"]}
+    assert lines[1:] == [{"item": "Tổng tài sản", "values": [value_of(2, 2, 2024, q) for q in information_service.QUARTERS]}]
+
+
+def test_stream_without_rows_sends_nothing(catalog, monkeypatch):
+    use_rows(monkeypatch, [])
+    assert collect_stream(1, 1, "quarterly", range(2024, 2025)) == []
@@ -0,0 +1,106 @@
+# tests/test_ingestion_scheduler.py
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from app.config import settings
+from app.services.ingestion_scheduler import VN_TZ, IngestionJob, IngestionScheduler, is_trading_hours
+
+
+def vn(*args) -> datetime:
+    return datetime(*args, tzinfo=VN_TZ)
+
+
+async def noop():
+    return None
+
+
+def make_job(func=noop) -> IngestionJob:
+    return IngestionJob("job", func, trading_interval=300, off_hours_interval=3600)
+
+
+def test_trading_hours_follow_calendar(monkeypatch):
+    monkeypatch.setattr(settings, "MARKET_HOLIDAYS", ["2025-09-02"])
+    assert is_trading_hours(vn(2025, 6, 2, 10, 0))
+    assert not is_trading_hours(vn(2025, 6, 2, 8, 59))
+    assert not is_trading_hours(vn(2025, 6, 7, 10, 0))   # thứ Bảy
+    assert not is_trading_hours(vn(2025, 9, 2, 10, 0))   # nghỉ lễ
+
+
+def test_next_delay_lands_one_run_after_the_close(monkeypatch):
+    monkeypatch.setattr(settings, "INGESTION_POST_CLOSE_DELAY_SECONDS", 120.0)
+    job = make_job()
+    assert job.next_delay(vn(2025, 6, 2, 10, 0)) == 300
+    # 14:58 -> chạy lúc 15:02 thay vì 15:03; 15:00 -> 15:02
+    assert job.next_delay(vn(2025, 6, 2, 14, 58)) == 240
+    assert job.next_delay(vn(2025, 6, 2, 15, 0)) == 120
+    assert job.next_delay(vn(2025, 6, 2, 15, 2)) == 3600
+    assert job.next_delay(vn(2025, 6, 7, 14, 58)) == 3600
+
+
+def test_should_run_on_holiday_only_before_first_success():
+    job = make_job()
+    saturday = vn(2025, 6, 7, 10, 0)
+    assert job.should_run(saturday)
+    job.last_success_at = saturday
+    assert not job.should_run(saturday)
+    assert job.should_run(vn(2025, 6, 9, 10, 0))
+
+
+def test_trigger_runs_once_and_reports_busy_job():
+    async def scenario():
+        release = asyncio.Event()
+        runs = []
+
+        async def slow():
+            runs.append(1)
+            await release.wait()
+            return "done"
+
+        scheduler = IngestionScheduler()
+        scheduler.register(IngestionJob("slow", slow, 300, 3600))
+        assert scheduler.trigger("slow")
+        assert not scheduler.trigger("slow")
+        await asyncio.sleep(0)
+        assert not await scheduler.run_job("slow")
+        release.set()
+        await asyncio.sleep(0.01)
+        job = scheduler.jobs["slow"]
+        assert runs == [1]
+        assert job.last_result == "done"
+        assert job.run_count == 1
+        assert scheduler._manual_runs == {}
+
+    asyncio.run(scenario())
+
+
+def test_failed_run_is_recorded_and_stop_cancels_manual_runs():
+    async def scenario():
+        async def failing():
+            raise RuntimeError("upstream down")
+
+        async def forever():
+            await asyncio.Event().wait()
+
+        scheduler = IngestionScheduler()
+        scheduler.register(IngestionJob("failing", failing, 300, 3600))
+        scheduler.register(IngestionJob("forever", forever, 300, 3600))
+        assert await scheduler.run_job("failing")
+        job = scheduler.jobs["failing"]
+        assert job.failure_count == 1
+        assert job.last_error == "upstream down"
+        assert job.last_success_at is None
+
+        assert scheduler.trigger("forever")
+        await asyncio.sleep(0)
+        await scheduler.stop()
+        assert scheduler._manual_runs == {}
+        assert not scheduler.jobs["forever"].lock.locked()
+
+    asyncio.run(scenario())
+
+
+def test_unknown_job_raises_key_error():
+    with pytest.raises(KeyError):
+        IngestionScheduler().trigger("missing")
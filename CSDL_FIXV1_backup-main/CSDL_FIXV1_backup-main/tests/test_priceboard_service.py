@@ -0,0 +1,141 @@
+# tests/test_priceboard_service.py
+import json
+
+import pytest
+
+from app.services.priceboard_service import (
+    PROTOCOL_DELTA,
+    PriceBoardBroadcaster,
+    PriceBoardOutbox,
+    PriceBoardSubscriber,
+)
+from app.services.tick_history_service import TickHistoryStore
+
+
+def make_broadcaster() -> PriceBoardBroadcaster:
+    return PriceBoardBroadcaster(stock_model=object(), interval_seconds=3600, tick_history=TickHistoryStore(16))
+
+
+def attach(broadcaster: PriceBoardBroadcaster, symbols=None, outbox_size: int = 8) -> PriceBoardSubscriber:
+    subscriber = PriceBoardSubscriber("test", PROTOCOL_DELTA, outbox_size=outbox_size)
+    broadcaster._set_watchlist(subscriber, symbols)
+    broadcaster._subscribers.add(subscriber)
+    return subscriber
+
+
+def board(**prices):
+    return [{"symbol": symbol, "current_price": price} for symbol, price in prices.items()]
+
+
+def publish(broadcaster: PriceBoardBroadcaster, records):
+    tick = broadcaster._apply_snapshot(records)
+    if tick is not None:
+        broadcaster._publish_tick(tick)
+    return tick
+
+
+def drain(subscriber: PriceBoardSubscriber):
+    frames = []
+    while subscriber.outbox.qsize():
+        item = subscriber.outbox._items.popleft()
+        text = subscriber.render(*item)
+        if text is not None:
+            subscriber.mark_sent()
+            frames.append(json.loads(text))
+    return frames
+
+
+def test_delta_frames_chain_seq_after_initial_snapshot():
+    broadcaster = make_broadcaster()
+    subscriber = attach(broadcaster)
+    publish(broadcaster, board(VCB=1, BID=2))
+    publish(broadcaster, board(VCB=1, BID=3))
+    publish(broadcaster, board(VCB=4, BID=3))
+
+    frames = drain(subscriber)
+
+    assert [frame["type"] for frame in frames] == ["snapshot", "delta", "delta"]
+    assert [frame["seq"] for frame in frames] == [1, 2, 3]
+    for previous, frame in zip(frames, frames[1:]):
+        assert frame["prev_seq"] == previous["seq"]
+    assert frames[1]["changes"] == {"BID": {"current_price": 3}}
+    assert frames[2]["changes"] == {"VCB": {"current_price": 4}}
+
+
+def test_unchanged_poll_does_not_advance_seq():
+    broadcaster = make_broadcaster()
+    assert publish(broadcaster, board(VCB=1)).seq == 1
+    assert publish(broadcaster, board(VCB=1)) is None
+    assert publish(broadcaster, board(VCB=2)).seq == 2
+
+
+def test_watchlist_delta_prev_seq_skips_ticks_without_watched_symbols():
+    broadcaster = make_broadcaster()
+    subscriber = attach(broadcaster, {"VCB"})
+    publish(broadcaster, board(VCB=1, BID=1))
+    subscriber.deliver((broadcaster.latest_tick, None, None))
+    publish(broadcaster, board(VCB=1, BID=2))  # VCB không đổi: không gửi cho subscriber
+    publish(broadcaster, board(VCB=5, BID=2))
+
+    frames = drain(subscriber)
+
+    assert [frame["type"] for frame in frames] == ["snapshot", "delta"]
+    assert frames[0]["data"] == [{"symbol": "VCB", "current_price": 1}]
+    assert frames[1]["seq"] == 3
+    assert frames[1]["prev_seq"] == 1
+    assert frames[1]["changes"] == {"VCB": {"current_price": 5}}
+
+
+def test_outbox_overflow_keeps_only_latest_item():
+    outbox = PriceBoardOutbox(2)
+    assert outbox.put_nowait("a")
+    assert outbox.put_nowait("b")
+    assert not outbox.put_nowait("c")
+    assert outbox.qsize() == 1
+    assert outbox.dropped == 2
+
+
+def test_overflow_forces_snapshot_of_latest_tick():
+    broadcaster = make_broadcaster()
+    subscriber = attach(broadcaster, outbox_size=2)
+    publish(broadcaster, board(VCB=1))
+    drain(subscriber)
+    for price in (2, 3, 4):
+        publish(broadcaster, board(VCB=price))
+
+    assert subscriber.last_seq is None
+    frames = drain(subscriber)
+
+    assert len(frames) == 1
+    assert frames[0]["type"] == "snapshot"
+    assert frames[0]["seq"] == 4
+    assert frames[0]["data"] == [{"symbol": "VCB", "current_price": 4}]
+
+    publish(broadcaster, board(VCB=5))
+    delta = drain(subscriber)[0]
+    assert delta["type"] == "delta"
+    assert delta["prev_seq"] == 4
+
+
+def test_slow_consumer_is_evicted_after_consecutive_overflows():
+    broadcaster = make_broadcaster()
+    broadcaster.max_consecutive_overflows = 2
+    subscriber = attach(broadcaster, outbox_size=1)
+    for price in range(1, 6):
+        publish(broadcaster, board(VCB=price))
+
+    assert subscriber.evicted
+    assert subscriber.outbox.closed
+    assert broadcaster.evicted_count == 1
+
+
+def test_unsubscribe_all_is_rejected_and_keeps_watchlist():
+    broadcaster = make_broadcaster()
+    subscriber = attach(broadcaster, {"VCB", "BID"})
+    with pytest.raises(ValueError, match=r'"\*"'):
+        broadcaster.remove_symbols(subscriber, None)
+    assert subscriber.symbols == {"VCB", "BID"}
+
+    broadcaster.remove_symbols(subscriber, {"BID"})
+    assert subscriber.symbols == {"VCB"}
+    assert broadcaster._symbol_index == {"VCB": {subscriber}}
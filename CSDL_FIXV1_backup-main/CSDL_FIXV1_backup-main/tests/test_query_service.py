@@ -0,0 +1,186 @@
+# tests/test_query_service.py
+import asyncio
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from app.services.query_service import (
+    aiter_in_chunks,
+    aiter_rest_pages,
+    chunk_ids,
+    iter_in_chunks,
+    map_concurrent,
+    iter_pages,
+    read_frame,
+)
+
+
+class FakeTable:
+    """Bảng trong bộ nhớ, ghi lại mọi lần execute (như một builder supabase-py tối giản)."""
+    def __init__(self, rows):
+        self.rows = rows
+        self.executed = []
+
+    def query(self):
+        return FakeQuery(self)
+
+
+class FakeQuery:
+    def __init__(self, table: FakeTable):
+        self.table = table
+        self.filters = []
+        self._order = None
+        self._limit = None
+        self._range = None
+
+    def gt(self, column, value):
+        self.filters.append(lambda row: row[column] > value)
+        return self
+
+    def lt(self, column, value):
+        self.filters.append(lambda row: row[column] < value)
+        return self
+
+    def in_(self, column, values):
+        values = set(values)
+        self.filters.append(lambda row: row[column] in values)
+        return self
+
+    def order(self, column, desc=False):
+        self._order = (column, desc)
+        return self
+
+    def limit(self, size):
+        self._limit = size
+        return self
+
+    def range(self, start, end):
+        self._range = (start, end)
+        return self
+
+    def execute(self):
+        rows = [row for row in self.table.rows if all(f(row) for f in self.filters)]
+        if self._order:
+            column, desc = self._order
+            rows.sort(key=lambda row: row[column], reverse=desc)
+        if self._range:
+            rows = rows[self._range[0]:self._range[1] + 1]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        self.table.executed.append(len(rows))
+        return SimpleNamespace(data=rows)
+
+
+def rows(n):
+    return [{'id': i, 'group': i % 7, 'value': i * 10} for i in range(1, n + 1)]
+
+
+@pytest.mark.parametrize('total, page_size, expected_pages', [
+    (0, 3, []),
+    (2, 3, [2]),
+    (6, 3, [3, 3]),      # bội số của page_size: thêm một lần đọc rỗng để biết đã hết
+    (7, 3, [3, 3, 1]),
+])
+def test_keyset_pages_cover_all_rows_once(total, page_size, expected_pages):
+    table = FakeTable(rows(total))
+    pages = list(iter_pages(table.query, keyset='id', page_size=page_size))
+    assert [len(page) for page in pages] == expected_pages
+    assert [row['id'] for page in pages for row in page] == list(range(1, total + 1))
+    assert len(table.executed) == total // page_size + 1
+
+
+def test_keyset_desc_and_after():
+    table = FakeTable(rows(10))
+    ids = [row['id'] for page in iter_pages(table.query, keyset='id', desc=True, after=8, page_size=3) for row in page]
+    assert ids == [7, 6, 5, 4, 3, 2, 1]
+    ids = [row['id'] for page in iter_pages(table.query, keyset='id', after=8, page_size=3) for row in page]
+    assert ids == [9, 10]
+
+
+@pytest.mark.parametrize('total', [0, 4, 5, 11])
+def test_range_pages_cover_all_rows_once(total):
+    table = FakeTable(rows(total))
+    pages = list(iter_pages(lambda: table.query().order('id'), page_size=5))
+    assert [row['id'] for page in pages for row in page] == list(range(1, total + 1))
+    assert all(len(page) == 5 for page in pages[:-1])
+
+
+def test_read_frame_concatenates_pages():
+    frame = read_frame(FakeTable(rows(7)).query, keyset='id', page_size=3)
+    assert frame['id'].tolist() == list(range(1, 8))
+    assert read_frame(FakeTable([]).query, keyset='id').empty
+
+
+def test_chunk_ids_deduplicates_and_bounds_chunks():
+    assert chunk_ids([5, 3, 5, 1, 9, 3, 7], 2) == [[1, 3], [5, 7], [9]]
+    assert chunk_ids([], 2) == []
+
+
+def test_iter_in_chunks_merges_all_chunks():
+    table = FakeTable(rows(50))
+    ids = list(range(1, 41)) + [10, 20]
+    chunks = list(iter_in_chunks(table.query, 'id', ids, chunk_size=7, keyset='id', page_size=4))
+    assert len(chunks) == 6
+    assert all(len(chunk) <= 7 for chunk in chunks)
+    assert sorted(row['id'] for chunk in chunks for row in chunk) == list(range(1, 41))
+
+
+def test_map_concurrent_keeps_input_order():
+    def slow_square(n):
+        time.sleep(0.01 * (5 - n))
+        return n * n
+    assert map_concurrent(slow_square, range(5)) == [0, 1, 4, 9, 16]
+    assert map_concurrent(slow_square, []) == []
+
+
+def test_iter_in_chunks_without_ids_runs_no_query():
+    table = FakeTable(rows(5))
+    assert list(iter_in_chunks(table.query, 'id', [])) == []
+    assert table.executed == []
+
+
+class FakeRestClient:
+    """Trả lời GET kiểu PostgREST (limit/offset, bộ lọc `in.(...)` trên một cột) từ danh sách dòng."""
+    def __init__(self, data):
+        self.data = data
+        self.requests = []
+
+    async def get(self, url, params=None, headers=None):
+        self.requests.append(dict(params))
+        selected = self.data
+        for column, expression in params.items():
+            if isinstance(expression, str) and expression.startswith('in.('):
+                wanted = {int(x) for x in expression[4:-1].split(',')}
+                selected = [row for row in selected if row[column] in wanted]
+        offset, limit = params['offset'], params['limit']
+        return httpx.Response(200, json=selected[offset:offset + limit], request=httpx.Request('GET', url))
+
+
+def test_aiter_rest_pages_uses_limit_offset_until_short_page():
+    client = FakeRestClient(rows(7))
+
+    async def collect():
+        return [page async for page in aiter_rest_pages(client, 'https://x/rest/v1/t', {'select': '*'}, {}, 'id.asc', page_size=3)]
+
+    pages = asyncio.run(collect())
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert [request['offset'] for request in client.requests] == [0, 3, 6]
+    assert all(request['order'] == 'id.asc' for request in client.requests)
+
+
+def test_aiter_in_chunks_merges_all_chunks():
+    client = FakeRestClient(rows(30))
+
+    async def collect():
+        return [chunk async for chunk in aiter_in_chunks(
+            client, 'https://x/rest/v1/t', {'select': '*'}, {}, 'id', range(1, 26), 'id.asc', chunk_size=10
+        )]
+
+    chunks = asyncio.run(collect())
+    assert len(chunks) == 3
+    assert sorted(row['id'] for chunk in chunks for row in chunk) == list(range(1, 26))
+    assert {request['id'] for request in client.requests} == {
+        'in.(1,2,3,4,5,6,7,8,9,10)', 'in.(11,12,13,14,15,16,17,18,19,20)', 'in.(21,22,23,24,25)'
+    }
@@ -0,0 +1,141 @@
+# tests/test_result_cache.py
+import threading
+import time
+
+from app.services.result_cache import (
+    ResultCache,
+    etag_matches,
+    invalidate_tag,
+    make_json_payload,
+    register_invalidation_hook,
+)
+
+
+def test_invalidate_tag_runs_hooks_in_order_and_survives_failures():
+    tag = "test-hooks-order"
+    calls = []
+
+    def failing():
+        calls.append("failing")
+        raise RuntimeError("boom")
+
+    register_invalidation_hook(tag, lambda: calls.append("first"))
+    register_invalidation_hook(tag, failing)
+    register_invalidation_hook(tag, lambda: calls.append("last"))
+
+    assert invalidate_tag(tag) == 3
+    assert calls == ["first", "failing", "last"]
+    assert invalidate_tag("test-hooks-unknown") == 0
+
+
+def test_tagged_cache_is_cleared_and_warm_hook_reloads():
+    tag = "test-hooks-cache"
+    cache = ResultCache("test", tags=(tag,))
+    loads = []
+
+    def load():
+        loads.append(1)
+        return len(loads)
+
+    # Hook làm ấm đăng ký sau cache: chạy sau khi cache đã bị xoá nên nạp lại giá trị mới
+    register_invalidation_hook(tag, lambda: cache.get_or_load("key", load))
+
+    assert cache.get_or_load("key", load) == 1
+    assert cache.get_or_load("key", load) == 1
+    invalidate_tag(tag)
+    assert cache.get("key") == 2
+    assert len(loads) == 2
+
+
+def test_invalidate_single_key():
+    cache = ResultCache("test")
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.invalidate("a")
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+
+
+def test_ttl_expiry():
+    cache = ResultCache("test", ttl_seconds=0.05)
+    cache.set("key", "value")
+    assert cache.get("key") == "value"
+    time.sleep(0.08)
+    assert cache.get("key", "expired") == "expired"
+
+
+def test_get_or_load_is_single_flight_and_prunes_key_locks():
+    cache = ResultCache("test")
+    loads = []
+
+    def load():
+        loads.append(1)
+        time.sleep(0.05)
+        return "value"
+
+    threads = [threading.Thread(target=cache.get_or_load, args=(i % 2, load)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(loads) == 2
+    stats = cache.stats()
+    assert stats["misses"] == 2
+    assert stats["hits"] == 18
+    assert cache._key_locks == {}
+
+
+def test_json_payload_etag():
+    payload = make_json_payload({"b": 1, "a": [1, 2]})
+    assert payload.body == b'{"b":1,"a":[1,2]}'
+    assert payload.etag == make_json_payload({"b": 1, "a": [1, 2]}).etag
+    assert payload.etag != make_json_payload({"b": 2}).etag
+    assert etag_matches(payload.etag, payload.etag)
+    assert etag_matches(f'"other", W/{payload.etag}', payload.etag)
+    assert etag_matches("*", payload.etag)
+    assert not etag_matches(None, payload.etag)
+    assert not etag_matches('"other"', payload.etag)
+
+
+def test_load_racing_with_invalidate_is_not_cached():
+    cache = ResultCache("test")
+    started, release = threading.Event(), threading.Event()
+
+    def stale_load():
+        started.set()
+        release.wait(1)
+        return "stale"
+
+    thread = threading.Thread(target=cache.get_or_load, args=("key", stale_load))
+    thread.start()
+    started.wait(1)
+    # Báo cáo mới được nạp trong lúc truy vấn cũ còn chạy
+    cache.invalidate()
+    release.set()
+    thread.join()
+
+    assert cache.get("key") is None
+    assert cache.get_or_load("key", lambda: "fresh") == "fresh"
+    assert cache.get("key") == "fresh"
+
+
+def test_set_with_stale_generation_is_skipped():
+    cache = ResultCache("test")
+    generation = cache.generation
+    assert cache.set("a", 1, generation)
+    cache.invalidate("b")
+    assert not cache.set("a", 2, generation)
+    assert cache.get("a") == 1
+    assert cache.set("a", 3)
+
+
+def test_max_entries_evicts_least_recently_used():
+    cache = ResultCache("test", max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.stats()["entries"] == 2
@@ -0,0 +1,91 @@
+# tests/test_stock_service.py
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("vnstock")
+
+from app.services import stock_service  # noqa: E402
+from app.services.ingestion_scheduler import VN_TZ  # noqa: E402
+from tests.fake_supabase import FakeSupabase  # noqa: E402
+from tests.fake_vnstock import FakeVnstockFeed, daily_bars  # noqa: E402
+
+
+@pytest.fixture
+def db(monkeypatch):
+    client = FakeSupabase({
+        "stocks": [{"stock_id": 1, "symbol": "VCB"}],
+        "transaction_price": [
+            {"stock_id": 1, "time": "2025-06-02", "open": 90.0, "high": 91.0, "low": 89.0, "close": 90.5, "volume": 1000}
+        ]
+    })
+    monkeypatch.setattr(stock_service, "get_stock_supabase_client", lambda: client)
+    monkeypatch.setattr(stock_service, "_stock_ids", {})
+    monkeypatch.setattr(stock_service, "_stock_id_misses", {})
+    monkeypatch.setattr(stock_service, "vn_now", lambda: datetime(2025, 6, 3, 10, 30, tzinfo=VN_TZ))
+    return client
+
+
+def feed(monkeypatch, frame) -> FakeVnstockFeed:
+    vnstock = FakeVnstockFeed({"VCB": frame})
+    monkeypatch.setattr(stock_service, "Vnstock", vnstock)
+    return vnstock
+
+
+def stored(db, time):
+    return next(row for row in db.rows("transaction_price") if row["time"] == time)
+
+
+def test_second_in_session_sync_overwrites_todays_row(db, monkeypatch):
+    first = feed(monkeypatch, daily_bars(
+        ("2025-06-02", 90.0, 91.0, 89.0, 90.5, 1000),
+        ("2025-06-03", 90.5, 91.0, 90.0, 90.8, 200)      # 10:30, phiên chưa đóng cửa
+    ))
+    stock_service.sync_transaction_prices("VCB")
+    assert first.requests == [("VCB", "2025-06-02", "2025-06-03")]
+    assert stored(db, "2025-06-03")["close"] == 90.8
+
+    second = feed(monkeypatch, daily_bars(
+        ("2025-06-02", 90.0, 91.0, 89.0, 90.5, 1000),
+        ("2025-06-03", 90.5, 92.0, 90.0, 91.7, 1500)     # giá đóng cửa
+    ))
+    assert stock_service.sync_transaction_prices("VCB") == 1
+    # Lần sau bắt đầu từ chính phiên cuối đã lưu, không phải ngày hôm sau
+    assert second.requests == [("VCB", "2025-06-03", "2025-06-03")]
+    row = stored(db, "2025-06-03")
+    assert (row["high"], row["close"], row["volume"]) == (92.0, 91.7, 1500)
+    assert len(db.rows("transaction_price")) == 2
+    assert ("upsert", "transaction_price", 1, False) in db.calls
+
+
+def test_history_series_picks_up_overwritten_close(db, monkeypatch):
+    monkeypatch.setattr(stock_service, "stock_history_cache", stock_service.HistoryCache(stock_service._load_transaction_prices))
+    feed(monkeypatch, daily_bars(("2025-06-03", 90.5, 91.0, 90.0, 90.8, 200)))
+    stock_service.sync_transaction_prices("VCB")
+    series = stock_service.get_stock_history_series("VCB")
+    assert series.column("close").tolist() == [90.5, 90.8]
+
+    feed(monkeypatch, daily_bars(("2025-06-03", 90.5, 92.0, 90.0, 91.7, 1500)))
+    stock_service.sync_transaction_prices("VCB")
+    assert stock_service.get_stock_history_series("VCB") is series
+    assert series.column("close").tolist() == [90.5, 91.7]
+
+
+
+def test_unsupported_symbol_does_not_touch_cache_or_db(db):
+    assert stock_service.get_stock_history_series("XYZ") is None
+    assert db.calls == []
+
+
+def test_stock_id_misses_are_memoized(db):
+    assert stock_service.get_stock_id("NOPE") is None
+    assert stock_service.get_stock_id("NOPE") is None
+    assert db.calls == [("select", "stocks")]
+    assert stock_service.get_stock_id("VCB") == 1
+    assert stock_service.get_stock_id("VCB") == 1
+    assert db.calls.count(("select", "stocks")) == 2
+
+
+def test_stock_model_does_not_build_client_at_import():
+    from app.models import stock
+    assert not hasattr(stock, "supabase")
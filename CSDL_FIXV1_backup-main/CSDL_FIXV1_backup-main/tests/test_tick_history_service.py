@@ -0,0 +1,67 @@
+# tests/test_tick_history_service.py
+from datetime import date, datetime
+
+from app.services.ingestion_scheduler import VN_TZ
+from app.services.tick_history_service import SymbolTickBuffer, TickHistoryStore
+
+
+def fill(buffer: SymbolTickBuffer, seqs):
+    for seq in seqs:
+        buffer.append(seq, 1000.0 + seq, float(seq), seq * 10, 0.1, 0.01)
+
+
+def test_since_before_wraparound():
+    buffer = SymbolTickBuffer(4)
+    fill(buffer, [1, 2, 3])
+    assert buffer.since('seq', -1)['seq'].tolist() == [1, 2, 3]
+    assert buffer.since('seq', 2)['seq'].tolist() == [3]
+    assert buffer.since('seq', 3)['seq'].tolist() == []
+
+
+def test_since_after_wraparound_returns_ticks_in_order():
+    buffer = SymbolTickBuffer(4)
+    fill(buffer, range(1, 8))  # giữ 4..7, vùng nhớ vật lý đã quay vòng
+
+    everything = buffer.since('seq', -1)
+    assert everything['seq'].tolist() == [4, 5, 6, 7]
+    assert everything['price'].tolist() == [4.0, 5.0, 6.0, 7.0]
+    assert everything['volume'].tolist() == [40, 50, 60, 70]
+    # Mốc nằm ở đoạn đầu / đoạn sau của ring buffer
+    assert buffer.since('seq', 4)['seq'].tolist() == [5, 6, 7]
+    assert buffer.since('seq', 6)['seq'].tolist() == [7]
+    assert buffer.since('seq', 7)['seq'].tolist() == []
+
+
+def test_since_by_timestamp_after_wraparound():
+    buffer = SymbolTickBuffer(3)
+    fill(buffer, range(1, 6))
+    assert buffer.since('ts', 1003.5)['seq'].tolist() == [4, 5]
+    assert buffer.since('ts', 0)['seq'].tolist() == [3, 4, 5]
+
+
+def test_store_filters_symbols_and_rolls_session():
+    store = TickHistoryStore(4)
+    day_one = datetime(2025, 6, 2, 10, 0, tzinfo=VN_TZ).timestamp()
+    store.record(1, day_one, [{'symbol': 'VCB', 'current_price': 90.5, 'volume': 100}, {'symbol': 'BID', 'current_price': 40}])
+    store.record(2, day_one + 10, [{'symbol': 'VCB', 'current_price': 91.0, 'volume': 200}])
+
+    history = store.get_history(['VCB', 'XXX'], since_seq=1)
+    assert list(history) == ['VCB']
+    assert history['VCB']['seq'] == [2]
+    assert history['VCB']['price'] == [91.0]
+
+    store.record(3, datetime(2025, 6, 3, 9, 15, tzinfo=VN_TZ).timestamp(), [{'symbol': 'BID', 'current_price': 41}])
+    assert list(store.get_history()) == ['BID']
+
+
+def test_session_rolls_at_vietnam_midnight():
+    store = TickHistoryStore(4)
+    # 06:30 và 08:00 giờ VN: cùng một phiên dù trên host UTC là hai ngày khác nhau (23:30 và 01:00)
+    store.record(1, datetime(2025, 6, 2, 6, 30, tzinfo=VN_TZ).timestamp(), [{'symbol': 'VCB', 'current_price': 90}])
+    store.record(2, datetime(2025, 6, 2, 8, 0, tzinfo=VN_TZ).timestamp(), [{'symbol': 'VCB', 'current_price': 91}])
+    assert store.session_date == date(2025, 6, 2)
+    assert store.get_history()['VCB']['seq'] == [1, 2]
+
+    store.record(3, datetime(2025, 6, 3, 0, 5, tzinfo=VN_TZ).timestamp(), [{'symbol': 'VCB', 'current_price': 92}])
+    assert store.session_date == date(2025, 6, 3)
+    assert store.get_history()['VCB']['seq'] == [3]
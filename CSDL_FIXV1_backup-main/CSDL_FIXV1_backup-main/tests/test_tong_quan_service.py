@@ -0,0 +1,192 @@
+# tests/test_tong_quan_service.py
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("vnstock")
+
+from app.services import tong_quan_service  # noqa: E402
+from app.services.ingestion_scheduler import VN_TZ  # noqa: E402
+from tests.fake_supabase import FakeSupabase  # noqa: E402
+from tests.fake_vnstock import FakeVnstockFeed, daily_bars  # noqa: E402
+
+
+# ==== INDEX SERVICE ====
+@pytest.fixture
+def index_db(monkeypatch):
+    client = FakeSupabase({
+        "index_types": [{"id": 1, "index_type": "VN"}, {"id": 2, "index_type": "HNX"}, {"id": 3, "index_type": "UPCOM"}],
+        "index_history": [
+            {"index_type_id": 1, "time": "2025-05-30", "open": 1300.0, "high": 1310.0, "low": 1295.0, "close": 1305.0, "volume": 500},
+            {"index_type_id": 1, "time": "2025-06-02", "open": 1305.0, "high": 1312.0, "low": 1301.0, "close": 1310.0, "volume": 600}
+        ]
+    })
+    monkeypatch.setattr(tong_quan_service, "get_supabase_client", lambda: client)
+    monkeypatch.setattr(tong_quan_service, "vn_now", lambda: datetime(2025, 6, 3, 11, 0, tzinfo=VN_TZ))
+    return client
+
+
+@pytest.fixture
+def index_service(index_db):
+    service = tong_quan_service.IndexService()
+    service._initialize_index_type_ids()
+    return service
+
+
+def set_feed(monkeypatch, frame) -> FakeVnstockFeed:
+    vnstock = FakeVnstockFeed({"VNINDEX": frame})
+    monkeypatch.setattr(tong_quan_service, "Vnstock", vnstock)
+    return vnstock
+
+
+def index_row(db, time):
+    return next(row for row in db.rows("index_history") if row["index_type_id"] == 1 and row["time"] == time)
+
+
+def test_index_type_ids_are_loaded_from_table(index_service):
+    assert {name: config["index_type_id"] for name, config in index_service.INDEX_CONFIG.items()} == {
+        "VNINDEX": 1, "HNXINDEX": 2, "UPCOMINDEX": 3
+    }
+
+
+def test_second_in_session_index_sync_overwrites_todays_row(index_service, index_db, monkeypatch):
+    first = set_feed(monkeypatch, daily_bars(
+        ("2025-06-02", 1305.0, 1312.0, 1301.0, 1310.0, 600),
+        ("2025-06-03", 1310.0, 1315.0, 1308.0, 1312.0, 100)
+    ))
+    assert index_service.sync_index_data("VNINDEX") == {"upserted": 2, "invalid": 0, "failed": 0}
+    assert first.requests == [("VNINDEX", "2025-06-02", "2025-06-03")]
+
+    second = set_feed(monkeypatch, daily_bars(
+        ("2025-06-03", 1310.0, 1320.0, 1305.0, 1318.5, 900)
+    ))
+    assert index_service.sync_index_data("VNINDEX")["upserted"] == 1
+    assert second.requests == [("VNINDEX", "2025-06-03", "2025-06-03")]
+    row = index_row(index_db, "2025-06-03")
+    assert (row["high"], row["close"], row["volume"]) == (1320.0, 1318.5, 900)
+    assert len(index_db.rows("index_history")) == 3
+
+    # Cache lịch sử của đường đọc thấy giá đóng cửa mới
+    tail = index_service.get_index_data("VNINDEX", "VN")
+    assert tail["time"].tolist()[-2:] == ["2025-06-02", "2025-06-03"]
+    assert tail["close"].tolist()[-1] == 1318.5
+
+
+def test_save_to_supabase_counts_invalid_rows_and_deduplicates(index_service, index_db):
+    frame = daily_bars(
+        ("2025-06-03", 1.0, 1.0, 1.0, 1318.0, 1),
+        ("2025-06-03", 1.0, 1.0, 1.0, 1319.0, 2),
+        ("2025-06-04", 1.0, 1.0, 1.0, None, 3),
+        (None, 1.0, 1.0, 1.0, 1.0, 4)
+    )
+    assert index_service._save_to_supabase(frame, 1, "VN") == {"upserted": 1, "invalid": 2, "failed": 0}
+    assert index_row(index_db, "2025-06-03")["close"] == 1319.0
+
+
+def test_display_payload_reports_change_from_previous_close(index_service):
+    result = index_service.process_index_data_for_display(index_service.get_index_data("VNINDEX", "VN"), "VNINDEX")
+    assert result["status"] == "success"
+    assert result["latest_close"] == 1310.0
+    assert result["change"] == 5.0
+    assert result["change_percent"] == round(5.0 / 1305.0 * 100, 3)
+    assert [point["time"] for point in result["mini_chart_data"]] == ["2025-05-30", "2025-06-02"]
+
+
+# ==== THAM SỐ CỦA CÁC API SỐ LIỆU TÀI CHÍNH ====
+def api_client(monkeypatch, line_item_ids=None):
+    """TestClient cho router API; `line_item_ids` = catalog đã nạp với các line item này (None: chưa nạp)."""
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from app.controllers import tong_quan_controller
+
+    catalog = SimpleNamespace(
+        loaded=line_item_ids is not None,
+        snapshot=SimpleNamespace(line_item_name_by_id={line_item_id: f"Item {line_item_id}" for line_item_id in line_item_ids or []})
+    )
+    monkeypatch.setattr(tong_quan_controller, "get_reference_catalog", lambda: catalog)
+    app = FastAPI()
+    app.include_router(tong_quan_controller.router_api)
+    return tong_quan_controller, TestClient(app)
+
+
+@pytest.mark.parametrize("params", [
+    {"quarter": "Q5"}, {"quarter": "q1"}, {"quarter": "Q1x"}, {"year": 1800}, {"year": 99999}, {"line_item_id": 0}
+])
+def test_total_capital_rejects_out_of_range_params(params, monkeypatch):
+    controller, client = api_client(monkeypatch)
+    calls = []
+    monkeypatch.setattr(controller, "get_cached_total_capital", lambda *args: calls.append(args))
+    assert client.get("/capital/total", params=params).status_code == 422
+    assert calls == []
+
+
+@pytest.mark.parametrize("url", [
+    "/capital/total?line_item_id=7",
+    "/market-cap/series?line_item_id=7",
+    "/financial/chart-data/7",
+    "/financial/chart-data?line_item_ids=2,7"
+])
+def test_unknown_line_item_is_rejected_once_catalog_is_loaded(url, monkeypatch):
+    _, client = api_client(monkeypatch, line_item_ids=[2, 88])
+    response = client.get(url)
+    assert response.status_code == 404
+    assert "7" in response.json()["detail"]
+
+
+@pytest.mark.parametrize("periods", ["1800Q4", "2024Q4,9999Q1"])
+def test_chart_data_batch_rejects_years_out_of_range(periods, monkeypatch):
+    _, client = api_client(monkeypatch)
+    assert client.get("/financial/chart-data", params={"line_item_ids": "2", "periods": periods}).status_code == 400
+
+
+def test_chart_data_rejects_year_out_of_range(monkeypatch):
+    _, client = api_client(monkeypatch)
+    assert client.get("/financial/chart-data/2", params={"year": 9999}).status_code == 422
+
+
+def test_client_keyed_financial_caches_are_bounded():
+    for cache in (tong_quan_service.total_capital_cache, tong_quan_service.chart_data_cache,
+                  tong_quan_service.market_cap_series_cache, tong_quan_service.market_cap_series_payload_cache):
+        assert cache.max_entries is not None
+
+
+# ==== DỮ LIỆU BIỂU ĐỒ TÀI CHÍNH ====
+def chart_rpc(params):
+    # RPC lọc phía DB: chỉ trả các mã có giá trị dương của đúng line item / kỳ
+    values = {
+        (2, 2024, "Q4"): {"VCB": 1800.0, "BID": 2500.0, "XYZ": None, "ABC": -1.0},
+        (8, 2024, "Q4"): {"VCB": 1300.0, "BID": 1900.0},
+        (2, 2024, "Q3"): {"VCB": 1750.0}
+    }.get((params["p_line_item_id"], params["p_year"], params["p_quarter"]), {})
+    return [{"symbol": symbol, "value": value} for symbol, value in values.items() if value is not None and value > 0]
+
+
+@pytest.fixture
+def financial_db():
+    tong_quan_service.chart_data_cache.invalidate()
+    yield FakeSupabase(rpcs={"get_financial_data_for_chart": chart_rpc})
+    tong_quan_service.chart_data_cache.invalidate()
+
+
+def test_batch_and_single_chart_data_agree(financial_db):
+    batch = tong_quan_service.FinancialService(financial_db).get_chart_data_batch([2, 8], [(2024, "Q4"), (2024, "Q3")])
+    assert list(batch) == [(2, 2024, "Q4"), (2, 2024, "Q3"), (8, 2024, "Q4"), (8, 2024, "Q3")]
+    assert batch[(2, 2024, "Q4")] == [{"symbol": "VCB", "value": 1800.0}, {"symbol": "BID", "value": 2500.0}]
+    assert batch[(8, 2024, "Q3")] == []
+    assert len(financial_db.calls) == 4
+
+    tong_quan_service.chart_data_cache.invalidate()
+    fresh = FakeSupabase(rpcs={"get_financial_data_for_chart": chart_rpc})
+    service = tong_quan_service.FinancialService(fresh)
+    for (line_item_id, year, quarter), data in batch.items():
+        assert asyncio.run(service.get_chart_data(line_item_id, year, quarter)) == data
+
+
+def test_batch_reuses_chart_data_cached_by_single_endpoint(financial_db):
+    service = tong_quan_service.FinancialService(financial_db)
+    single = asyncio.run(service.get_chart_data(2, 2024, "Q4"))
+    batch = service.get_chart_data_batch([2, 8], [(2024, "Q4")])
+    assert batch[(2, 2024, "Q4")] == single
+    assert [call[2]["p_line_item_id"] for call in financial_db.calls] == [2, 8]